@@ -309,6 +309,7 @@ SEARCH_ENGINES_MAP = {
     'es7': 'haystack.backends.elasticsearch7_backend.Elasticsearch7SearchEngine',
     'es': 'haystack.backends.elasticsearch7_backend.Elasticsearch7SearchEngine',
     'solr': 'haystack.backends.solr_backend.SolrEngine',
+    'sqlite': 'papermerge.search.sqlite_backend.SQLiteEngine',
     'whoosh': 'haystack.backends.whoosh_backend.WhooshEngine',
     'xapian': 'xapian_backend.XapianEngine',
 }
@@ -324,4 +325,8 @@ HAYSTACK_CONNECTIONS = {
     },
 }
 
+if search_engine == 'sqlite':
+    # embedded search index, kept in one single file
+    HAYSTACK_CONNECTIONS['default']['PATH'] = config.get('search', 'path')
+
 HAYSTACK_SIGNAL_PROCESSOR = 'papermerge.search.signals.SignalProcessor'
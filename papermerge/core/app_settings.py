@@ -32,6 +32,158 @@ class AppSettings():
             {}
         )
 
+    @property
+    def INDEX_UPDATE_DEBOUNCE(self):  # noqa
+        """
+        Number of seconds search index updates of the same node
+        are coalesced for (0 disables coalescing across transactions).
+        Updates are coalesced across transactions only if Django's cache
+        is shared between web and worker processes; see
+        ``papermerge.search.queue``
+        """
+        return self._settings(
+            "INDEX_UPDATE_DEBOUNCE",
+            5
+        )
+
+    @property
+    def SEARCH_CACHE_TIMEOUT(self):  # noqa
+        """
+        Number of seconds search results are cached for (0 disables
+        caching). Results are cached only if Django's cache is shared
+        between web and worker processes (e.g. redis, memcached), not with
+        process local ``LocMemCache`` (Django's default); see
+        ``papermerge.search.cache``
+        """
+        return self._settings(
+            "SEARCH_CACHE_TIMEOUT",
+            300
+        )
+
+    @property
+    def OCR_PAGES_PER_CHUNK(self):  # noqa
+        """
+        Number of pages OCRed by one worker task. PDF documents with more
+        pages than that are split into page ranges which are OCRed in
+        parallel (0 disables splitting i.e. whole document is OCRed
+        by one task)
+        """
+        return self._settings(
+            "OCR_PAGES_PER_CHUNK",
+            0
+        )
+
+    @property
+    def OCR_INCREMENTAL(self):  # noqa
+        """
+        When True, OCR of PDF documents skips pages which were already
+        OCRed (i.e. pages with text and with all OCR sidecars in the
+        storage); these pages are reused as they are
+        """
+        return self._settings(
+            "OCR_INCREMENTAL",
+            False
+        )
+
+    @property
+    def PREVIEW_SIZES(self):  # noqa
+        """
+        Preview tiers i.e. mapping of tier name to preview width in pixels
+        (tier named "full" is served by default)
+        """
+        return self._settings(
+            "PREVIEW_SIZES",
+            {
+                'thumbnail': 150,
+                'list': 400,
+                'full': 900
+            }
+        )
+
+    @property
+    def PREVIEW_FORMAT(self):  # noqa
+        """
+        Format of the page previews: "jpeg", "webp" or "avif"
+        """
+        return self._settings(
+            "PREVIEW_FORMAT",
+            "jpeg"
+        )
+
+    @property
+    def PREVIEW_BATCH_SIZE(self):  # noqa
+        """
+        Number of pages rendered at once when generating previews
+        """
+        return self._settings(
+            "PREVIEW_BATCH_SIZE",
+            16
+        )
+
+    @property
+    def PREVIEW_THREAD_COUNT(self):  # noqa
+        """
+        Number of threads (pdftoppm processes) rendering previews
+        """
+        return self._settings(
+            "PREVIEW_THREAD_COUNT",
+            4
+        )
+
+    @property
+    def THUMBNAIL_CACHE_MAX_SIZE(self):  # noqa
+        """
+        Max size, in bytes, of the disk cache of page thumbnails (least
+        recently used thumbnails are evicted first)
+        """
+        return self._settings(
+            "THUMBNAIL_CACHE_MAX_SIZE",
+            256 * 1024 * 1024
+        )
+
+    @property
+    def SENDFILE_BACKEND(self):  # noqa
+        """
+        When set, files (page previews/svgs and document files) are not
+        sent by Django; instead, after permissions check, the response
+        only instructs front proxy which file to send:
+
+            * 'nginx' - ``X-Accel-Redirect`` header with file URL (see
+              ``SENDFILE_URL_PREFIX``)
+            * 'xsendfile' - ``X-Sendfile`` header with absolute path of the
+              file (Apache mod_xsendfile, lighttpd)
+        """
+        return self._settings(
+            "SENDFILE_BACKEND",
+            None
+        )
+
+    @property
+    def SENDFILE_URL_PREFIX(self):  # noqa
+        """
+        Internal location of front proxy mapped to MEDIA_ROOT e.g.::
+
+            location /protected/ {
+                internal;
+                alias /path/to/media/;
+            }
+        """
+        return self._settings(
+            "SENDFILE_URL_PREFIX",
+            "/protected/"
+        )
+
+    @property
+    def DOWNLOAD_URL_EXPIRES(self):  # noqa
+        """
+        Number of seconds asynchronously built downloads are available
+        for (after that their URL expires and their file is deleted)
+        """
+        return self._settings(
+            "DOWNLOAD_URL_EXPIRES",
+            3600
+        )
+
     @property
     def BINARY_FILE(self):  # noqa
         return self._settings(
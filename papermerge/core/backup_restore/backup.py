@@ -8,7 +8,7 @@ import json
 from pathlib import PurePath
 from os.path import getsize, getmtime, exists
 
-from papermerge.core.storage import abs_path
+from papermerge.core.storage import abs_path, abs_paths
 from .serializers import UserSerializer
 from .utils import CType
 
@@ -59,9 +59,13 @@ class BackupPages:
         self._version_dict = version_dict
 
     def __iter__(self):
-        for page in self._version_dict.get('pages', []):
-            file_path = page['file_path']
-            abs_file_path = abs_path(file_path)
+        file_paths = [
+            page['file_path'] for page in self._version_dict.get('pages', [])
+        ]
+        for file_path, abs_file_path in zip(
+            file_paths,
+            abs_paths(file_paths)
+        ):
             if exists(abs_file_path):
                 content = get_content(abs_file_path)
                 entry = tarfile.TarInfo(file_path)
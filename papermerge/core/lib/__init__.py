@@ -9,7 +9,16 @@ def parse_bbox_title(bbox_title):
     Look here: http://kba.cloud/hocr-spec/1.2/
     for bbox and x_wconf properties.
     """
-    pass
+    result = {}
+    for prop in bbox_title.split(';'):
+        name, _, value = prop.strip().partition(' ')
+        if name == 'bbox':
+            x1, y1, x2, y2 = [int(item) for item in value.split()]
+            result.update(x1=x1, y1=y1, x2=x2, y2=y2)
+        elif name == 'x_wconf':
+            result['wconf'] = int(value)
+
+    return result
 
 
 def extract_words_from(hocr_file):
@@ -26,12 +35,13 @@ def extract_words_from(hocr_file):
         elem['id'] = span.attrib['id']
         bbox = parse_bbox_title(span.attrib['title'])
         elem['title'] = span.attrib['title']
-        elem['text'] = span.text
+        # word may be wrapped in formatting tags e.g. <strong>
+        elem['text'] = span.text_content()
         elem['x1'] = bbox['x1']
-        elem['x2'] = bbox['x1']
+        elem['x2'] = bbox['x2']
         elem['y1'] = bbox['y1']
         elem['y2'] = bbox['y2']
-        elem['wconf'] = bbox['wconf']
+        elem['wconf'] = bbox.get('wconf')
 
         result.append(elem)
 
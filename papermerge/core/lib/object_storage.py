@@ -0,0 +1,514 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from .path import DocumentPath, PagePath, AUX_DIR_DOCS, AUX_DIR_SIDECARS
+from .storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# max number of keys S3 deletes with one request
+DELETE_BATCH_SIZE = 1000
+# error codes of missing object
+NOT_FOUND_CODES = ('404', 'NoSuchKey', 'NotFound')
+# suffix of files being downloaded into local cache
+DOWNLOAD_SUFFIX = '.download'
+# local working folders of OCR (within document version's sidecars); their
+# files are not in the bucket, thus they are never evicted from the cache
+WORK_DIR_NAMES = ('ocr', 'chunks', 'incremental')
+# files modified less than that many seconds ago are never evicted from
+# the cache (i.e. files being written which may not be uploaded yet)
+CACHE_MIN_AGE = 3600
+# when cache grows over ``cache_max_size``, it is shrunk to this fraction
+# of ``cache_max_size``, so that it is not scanned again right away
+LOW_WATERMARK = 0.9
+
+# cache location => estimated size (bytes) of the cache, per process
+_cache_sizes = {}
+_cache_sizes_lock = threading.Lock()
+
+
+class S3Storage(Storage):
+    """
+    Storage which keeps documents and their sidecars in S3 compatible
+    object storage (AWS S3, MinIO, Ceph etc).
+
+    ``location`` (i.e. MEDIA_ROOT) is used as local read-through cache:
+    ``abspath`` of a file which is not in the cache downloads it from the
+    bucket first, thus code working with local paths keeps working. Files
+    created locally are sent to the bucket with ``upload``. Files can
+    also be read (in ranges) straight from the bucket with ``iter_range``.
+
+    With ``cache_max_size``, least recently used documents and sidecars
+    are evicted from the cache once it grows over ``cache_max_size``
+    bytes (see ``collect_garbage``).
+
+    Example of configuration::
+
+        PAPERMERGE_DEFAULT_FILE_STORAGE = \
+            "papermerge.core.lib.object_storage.S3Storage"
+        PAPERMERGE_FILE_STORAGE_KWARGS = {
+            "bucket_name": "papermerge",
+            "endpoint_url": "https://minio.local:9000",
+            "cache_max_size": 10 * 1024 * 1024 * 1024
+        }
+    """
+
+    def __init__(
+        self,
+        location=None,
+        bucket_name=None,
+        prefix='',
+        endpoint_url=None,
+        multipart_chunksize=8 * 1024 * 1024,
+        max_concurrency=8,
+        cache_max_size=None,
+        client_kwargs=None,
+        **kwargs
+    ):
+        super().__init__(location=location, **kwargs)
+        if not bucket_name:
+            raise ValueError("S3Storage requires bucket_name")
+
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip('/')
+        self.endpoint_url = endpoint_url
+        self.max_concurrency = max_concurrency
+        self.cache_max_size = cache_max_size
+        self.client_kwargs = client_kwargs or {}
+        # files bigger than one chunk are uploaded/downloaded in chunks,
+        # ``max_concurrency`` chunks at once
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunksize,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency
+        )
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url,
+                **self.client_kwargs
+            )
+
+        return self._client
+
+    def key(self, _path) -> str:
+        """
+        Returns object key of given path (relative path, absolute path
+        within the cache, DocumentPath or PagePath)
+        """
+        local_path = self.local_path(_path)
+        relative_path = os.path.relpath(local_path, self.location)
+        key = relative_path.replace(os.sep, '/')
+        if local_path.endswith(os.sep):
+            # prefix of "folder" keys
+            key = f"{key}/"
+
+        if self.prefix:
+            return f"{self.prefix}/{key}"
+
+        return key
+
+    def relative_path(self, key: str) -> str:
+        """
+        Reverse of ``key`` i.e. returns path (relative to ``location``)
+        of given object key
+        """
+        if self.prefix:
+            return key[len(self.prefix) + 1:]
+
+        return key
+
+    def local_path(self, _path) -> str:
+        """
+        Returns path of given file in local cache (without fetching it)
+        """
+        return super().abspath(_path)
+
+    def abspath(self, _path, download=True):
+        local_path = self.local_path(_path)
+        _, ext = os.path.splitext(local_path)
+        if not download or not ext:
+            return local_path
+
+        try:
+            # mark as recently used (see ``collect_garbage``)
+            os.utime(local_path)
+        except FileNotFoundError:
+            # read-through: fetch missing file from the bucket
+            self.download(_path)
+
+        return local_path
+
+    def exists(self, _path):
+        if os.path.exists(self.local_path(_path)):
+            return True
+
+        try:
+            self.client.head_object(
+                Bucket=self.bucket_name,
+                Key=self.key(_path)
+            )
+        except ClientError:
+            return False
+
+        return True
+
+    def size(self, _path) -> int:
+        local_path = self.local_path(_path)
+        if os.path.exists(local_path):
+            return os.path.getsize(local_path)
+
+        response = self.client.head_object(
+            Bucket=self.bucket_name,
+            Key=self.key(_path)
+        )
+
+        return response['ContentLength']
+
+    def iter_range(self, _path, start: int, end: int, chunk_size: int):
+        """
+        Same as ``Storage.iter_range``, except that file which is not in
+        the local cache is read with one ranged GET i.e. without fetching
+        whole file into the cache
+        """
+        if os.path.exists(self.local_path(_path)):
+            yield from super().iter_range(_path, start, end, chunk_size)
+            return
+
+        response = self.client.get_object(
+            Bucket=self.bucket_name,
+            Key=self.key(_path),
+            Range=f"bytes={start}-{end}"
+        )
+        body = response['Body']
+        try:
+            yield from body.iter_chunks(chunk_size=chunk_size)
+        finally:
+            body.close()
+
+    def read_range(self, _path, start: int, end: int) -> bytes:
+        """
+        Returns bytes ``start``..``end`` (inclusive) of the stored file
+        without fetching the whole file
+        """
+        return b''.join(
+            self.iter_range(_path, start, end, chunk_size=end - start + 1)
+        )
+
+    def listdir(self, dirname: str):
+        prefix = self.key(dirname)
+
+        return [
+            key[len(prefix):]
+            for key in self._list_keys(prefix, delimiter='/')
+        ]
+
+    def list_files(self, dirname: str) -> set:
+        """
+        Returns paths of the files in given folder (and its subfolders)
+        both in local cache and in the bucket, with one listing request
+        per 1000 keys
+        """
+        result = super().list_files(dirname)
+        result.update(
+            self.relative_path(key)
+            for key in self._list_keys(self.key(dirname))
+        )
+
+        return result
+
+    def delete_dir(self, dirname: str):
+        super().delete_dir(dirname)
+        self._delete_prefix(self.key(dirname))
+
+    def upload(self, doc_path_url, recursive=True, **kwargs):
+        """
+        Sends local file (or all files in local folder) to the bucket.
+
+        Big files are sent as multipart uploads streamed from the disk,
+        files of a folder are sent in parallel.
+        """
+        local_path = self.local_path(doc_path_url)
+
+        if not os.path.isdir(local_path):
+            self._upload_file(local_path)
+            return
+
+        file_paths = []
+        for root, dirs, file_names in os.walk(local_path):
+            file_paths.extend(
+                os.path.join(root, file_name) for file_name in file_names
+            )
+            if not recursive:
+                break
+
+        self._map(self._upload_file, file_paths)
+
+    def _upload_file(self, local_path: str):
+        logger.debug(f"upload {local_path}")
+        self.client.upload_file(
+            local_path,
+            self.bucket_name,
+            self.key(local_path),
+            Config=self.transfer_config
+        )
+        self._cache_file_added(local_path)
+
+    def download(self, doc_path_url, **kwargs):
+        """
+        Fetches the file (or, if ``doc_path_url`` ends with '/', all files
+        of the folder) from the bucket into the local cache.
+
+        Returns its local path or None if there is no such object.
+        """
+        local_path = self.local_path(doc_path_url)
+        if str(doc_path_url).endswith('/'):
+            prefix = self.key(doc_path_url)
+            self._map(
+                lambda key: self.download(self.relative_path(key)),
+                list(self._list_keys(prefix))
+            )
+            return local_path
+
+        self.make_sure_path_exists(local_path)
+        file_handle, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(local_path),
+            prefix='.',
+            suffix=DOWNLOAD_SUFFIX
+        )
+        os.close(file_handle)
+        try:
+            self.client.download_file(
+                self.bucket_name,
+                self.key(doc_path_url),
+                tmp_path,
+                Config=self.transfer_config
+            )
+        except ClientError as error:
+            os.remove(tmp_path)
+            if error.response['Error']['Code'] in NOT_FOUND_CODES:
+                logger.debug(f"download {doc_path_url}: {error}")
+                return None
+            raise
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        # concurrent readers never see partially downloaded file
+        os.replace(tmp_path, local_path)
+        self._cache_file_added(local_path)
+
+        return local_path
+
+    def copy_doc(self, src, dst: DocumentPath):
+        if isinstance(src, DocumentPath):
+            src = self.abspath(src)
+
+        logger.debug(
+            f"copy_doc: {src} to {dst}"
+        )
+        self.copy_file(src, self.local_path(dst))
+        self.upload(dst)
+
+    def copy_pages(self, page_paths):
+        """
+        Copies page data of multiple pages within the bucket (no data is
+        sent over the wire). Copies are made in parallel.
+
+        Instead of checking which page files exist one by one, each source
+        "folder" is listed only once.
+        """
+        listings = {}
+
+        def exists(url):
+            key = self.key(url)
+            prefix = key.rsplit('/', 1)[0] + '/'
+            if prefix not in listings:
+                listings[prefix] = set(
+                    self._list_keys(prefix, delimiter='/')
+                )
+
+            return key in listings[prefix]
+
+        page_paths = list(page_paths)
+        keys = []
+        for src, dst in page_paths:
+            for inst in [src, dst]:
+                if not isinstance(inst, PagePath):
+                    raise ValueError(
+                        "copy_page accepts only PagePath instances"
+                    )
+            for src_url, dst_url in (
+                (src.txt_url, dst.txt_url),
+                (src.hocr_url, dst.hocr_url),
+                (src.jpg_url, dst.jpg_url),
+                (src.svg_url, dst.svg_url),
+            ):
+                if exists(src_url):
+                    keys.append((self.key(src_url), self.key(dst_url)))
+                else:
+                    logger.debug(f"{src_url} does not exits")
+
+        preview_urls, manifests = self.previews_to_copy(page_paths)
+        for src_url, dst_url in preview_urls:
+            if exists(src_url):
+                keys.append((self.key(src_url), self.key(dst_url)))
+            else:
+                logger.debug(f"{src_url} does not exits")
+
+        self._map(lambda item: self._copy_key(*item), keys)
+
+        for doc_path, manifest in manifests:
+            self.write_previews_manifest(doc_path, manifest)
+
+    def _copy_key(self, src_key: str, dst_key: str):
+        # managed copy i.e. big objects are copied in parts, in parallel
+        self.client.copy(
+            {'Bucket': self.bucket_name, 'Key': src_key},
+            self.bucket_name,
+            dst_key,
+            Config=self.transfer_config
+        )
+
+    def delete_doc(self, doc_path: DocumentPath):
+        if os.path.exists(self.local_path(doc_path.dirname_docs)):
+            super().delete_doc(doc_path)
+
+        self._delete_prefix(self.key(doc_path.dirname_docs))
+        self._delete_prefix(self.key(doc_path.dir_sidecars))
+
+    def delete_user_data(self, user_id: str):
+        super().delete_user_data(user_id)
+
+        for aux_dir in (AUX_DIR_DOCS, AUX_DIR_SIDECARS):
+            self._delete_prefix(self.key(f"{aux_dir}/user_{user_id}/"))
+
+    def collect_garbage(self, max_size=None):
+        """
+        Evicts least recently used documents and sidecars from local
+        cache until it is not bigger than ``max_size`` (by default
+        ``cache_max_size``) bytes. Evicted files are in the bucket, thus
+        they can be fetched again.
+
+        Other files in ``location`` (e.g. OCR working folders, downloads
+        being built, thumbnails cache) as well as files modified less than
+        ``CACHE_MIN_AGE`` seconds ago (which may be not uploaded yet) are
+        never evicted, though they count into the size of the cache.
+        Recency is tracked with file's modification time (bumped by
+        ``abspath``), as access time is often not updated (noatime mounts).
+
+        Returns number of evicted files.
+        """
+        if not self.cache_max_size:
+            return 0
+
+        if max_size is None:
+            max_size = self.cache_max_size
+
+        total_size = 0
+        files = []
+        min_mtime = time.time() - CACHE_MIN_AGE
+        for root, dirs, file_names in os.walk(self.location):
+            relative_root = os.path.relpath(root, self.location)
+            is_evictable = (
+                relative_root.split(os.sep)[0] in (
+                    AUX_DIR_DOCS,
+                    AUX_DIR_SIDECARS
+                ) and not any(
+                    name in WORK_DIR_NAMES
+                    for name in relative_root.split(os.sep)
+                )
+            )
+            for file_name in file_names:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # e.g. removed by concurrent run
+                    continue
+                total_size += stat.st_size
+                if not is_evictable or stat.st_mtime > min_mtime:
+                    continue
+                if file_name.endswith(DOWNLOAD_SUFFIX):
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        removed = 0
+        for _, size, path in sorted(files):
+            if total_size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total_size -= size
+            removed += 1
+
+        with _cache_sizes_lock:
+            _cache_sizes[self.location] = total_size
+
+        if removed:
+            logger.debug(f"collect_garbage: evicted {removed} file(s)")
+
+        return removed
+
+    def _cache_file_added(self, local_path: str):
+        """
+        Accounts file added to local cache; whole cache is scanned (and
+        evicted) only when its estimated size crosses ``cache_max_size``
+        """
+        if not self.cache_max_size:
+            return
+
+        with _cache_sizes_lock:
+            size = _cache_sizes.get(self.location)
+            if size is not None:
+                try:
+                    size += os.path.getsize(local_path)
+                except FileNotFoundError:
+                    pass
+                _cache_sizes[self.location] = size
+
+        if size is None or size > self.cache_max_size:
+            self.collect_garbage(round(self.cache_max_size * LOW_WATERMARK))
+
+    def _list_keys(self, prefix: str, delimiter=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(
+            Bucket=self.bucket_name,
+            Prefix=prefix,
+            Delimiter=delimiter
+        ):
+            for item in page.get('Contents', []):
+                yield item['Key']
+
+    def _delete_prefix(self, prefix: str):
+        keys = list(self._list_keys(prefix))
+        for index in range(0, len(keys), DELETE_BATCH_SIZE):
+            self.client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={
+                    'Objects': [
+                        {'Key': key}
+                        for key in keys[index:index + DELETE_BATCH_SIZE]
+                    ],
+                    'Quiet': True
+                }
+            )
+
+    def _map(self, func, items):
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            # consume results to re-raise first exception (if any)
+            list(executor.map(func, items))
@@ -8,6 +8,9 @@ logger = logging.getLogger(__name__)
 
 AUX_DIR_DOCS = "docs"
 AUX_DIR_SIDECARS = "sidecars"
+AUX_DIR_DOWNLOADS = "downloads"
+AUX_DIR_BLOBS = "blobs"
+AUX_DIR_THUMBNAILS = "thumbnails"
 
 
 def filter_by_extention(
@@ -99,6 +102,14 @@ class DocumentPath:
 
         return _path
 
+    @property
+    def previews_manifest_url(self):
+        """
+        Manifest of generated page previews (see
+        ``DocumentVersion.generate_previews``)
+        """
+        return f"{self.dirname_sidecars()}previews.json"
+
     def dirname(self):
 
         full_path = (
@@ -246,7 +257,73 @@ class PagePath:
         url = f"{pages_dirname}{self.page_num:06}_ocr_hocr.hocr"
         return url
 
+    @property
+    def preview_dirname(self):
+        # folder with previews of all pages of the document
+        pages_dirname = self.results_document_ep.pages_dirname()
+        return f"{pages_dirname}previews/"
+
+    def preview_tier_url(self, tier, extension='jpg'):
+        return f"{self.preview_dirname}{tier}/{self.page_num:06d}.{extension}"
+
     @property
     def preview_url(self):
         pages_dirname = self.results_document_ep.pages_dirname()
         return f"{pages_dirname}001-{self.page_num}.jpg"
+
+
+class DownloadPath:
+    """
+    Path of the asynchronously built download (e.g. zip archive):
+    /<aux_dir>/<user_id>/<download_id>/<file_name>
+
+    While download is being built, its data is written
+    to `part_url` file. If building the download fails, empty
+    `failed_url` file is written instead.
+    """
+    FAILED_FILE_NAME = '.failed'
+
+    def __init__(
+        self,
+        user_id,
+        download_id,
+        file_name,
+        aux_dir=AUX_DIR_DOWNLOADS
+    ):
+        self.user_id = user_id
+        self.download_id = download_id
+        # only base name is used, so that file_name can't point
+        # outside of download's folder
+        self.file_name = os.path.basename(file_name)
+        self.aux_dir = aux_dir
+
+    @property
+    def dirname(self):
+        return (
+            f"{self.aux_dir}/user_{self.user_id}/"
+            f"download_{self.download_id}/"
+        )
+
+    @property
+    def url(self):
+        return f"{self.dirname}{self.file_name}"
+
+    @property
+    def path(self):
+        return self.url
+
+    @property
+    def part_url(self):
+        return f"{self.url}.part"
+
+    @property
+    def failed_url(self):
+        return f"{self.dirname}{self.FAILED_FILE_NAME}"
+
+    def __repr__(self):
+        message = (
+            f"DownloadPath(user_id={self.user_id},"
+            f"download_id={self.download_id},"
+            f"file_name={self.file_name})"
+        )
+        return message
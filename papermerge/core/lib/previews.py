@@ -0,0 +1,108 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf2image import convert_from_path
+from PIL import Image
+
+from .storage import replaced_file
+
+logger = logging.getLogger(__name__)
+
+JPEG = 'jpeg'
+WEBP = 'webp'
+AVIF = 'avif'
+
+# preview format => (file extension, content type)
+FORMATS = {
+    JPEG: ('jpg', 'image/jpeg'),
+    WEBP: ('webp', 'image/webp'),
+    AVIF: ('avif', 'image/avif'),
+}
+
+# preview tier served when no other was asked for
+FULL = 'full'
+
+QUALITY = 85
+
+
+def get_extension(fmt: str) -> str:
+    return FORMATS[fmt][0]
+
+
+def get_content_type(fmt: str) -> str:
+    return FORMATS[fmt][1]
+
+
+def render_previews(
+    pdf_path: str,
+    page_numbers,
+    sizes: dict,
+    tier_path,
+    fmt: str = JPEG,
+    batch_size: int = 16,
+    thread_count: int = 1
+):
+    """
+    Renders previews of given pages of the PDF file.
+
+    ``sizes`` maps tier name to preview width in pixels e.g.
+    ``{'thumbnail': 150, 'full': 900}``. ``tier_path(page_number, tier)``
+    returns absolute path of the preview file.
+
+    Pages are rendered (with ``thread_count`` pdftoppm processes) in
+    batches of ``batch_size`` consecutive pages, each page only once, at
+    the biggest width; smaller tiers are downscaled from it.
+
+    Yields ``(page_number, {tier: path})`` for each rendered page.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported preview format {fmt}")
+
+    max_width = max(sizes.values())
+    page_numbers = sorted(page_numbers)
+
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        for index in range(0, len(page_numbers), batch_size):
+            batch = page_numbers[index:index + batch_size]
+            images = convert_from_path(
+                pdf_path,
+                first_page=batch[0],
+                last_page=batch[-1],
+                size=(max_width,),
+                thread_count=thread_count
+            )
+            by_number = dict(
+                zip(range(batch[0], batch[-1] + 1), images)
+            )
+            results = executor.map(
+                lambda number: _save_tiers(
+                    by_number[number],
+                    number,
+                    sizes,
+                    tier_path,
+                    fmt
+                ),
+                batch
+            )
+            for number, paths in zip(batch, results):
+                yield number, paths
+
+
+def _save_tiers(image, page_number, sizes, tier_path, fmt):
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    paths = {}
+    for tier, width in sizes.items():
+        path = tier_path(page_number, tier)
+        tier_image = image
+        if width < image.width:
+            height = round(image.height * width / image.width)
+            tier_image = image.resize((width, height), Image.LANCZOS)
+
+        # previews may be linked to previews of other document versions
+        with replaced_file(path) as tmp_path:
+            tier_image.save(tmp_path, format=fmt.upper(), quality=QUALITY)
+        paths[tier] = path
+
+    return paths
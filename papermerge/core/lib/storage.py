@@ -1,14 +1,44 @@
+import hashlib
+import json
 import logging
 import os
+import sys
 import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
 from os import listdir
 from os.path import isdir, join
 
-from .path import DocumentPath, PagePath, AUX_DIR_SIDECARS, AUX_DIR_DOCS
+from .path import (
+    DocumentPath,
+    PagePath,
+    AUX_DIR_BLOBS,
+    AUX_DIR_SIDECARS,
+    AUX_DIR_DOCS
+)
 from .utils import safe_to_delete
 
 logger = logging.getLogger(__name__)
 
+# size of chunks in which files are read when computing their digest
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# how storage copies files (see ``Storage.copy_file``)
+COPY = 'copy'
+LINK = 'link'
+REFLINK = 'reflink'
+
+# files which are never modified in place i.e. documents, OCR sidecars
+# and page previews (see ``replaced_file``); only these are safe to share
+# as hard links
+LINKED_EXTENSIONS = (
+    '.pdf', '.txt', '.hocr', '.svg', '.jpg', '.webp', '.avif'
+)
+
+# ioctl request cloning file's extents (linux/fs.h)
+FICLONE = 0x40049409
+
 
 class Storage:
     """
@@ -16,10 +46,13 @@ class Storage:
     on local host filesystem
     """
 
-    def __init__(self, location=None, **kwargs):
+    def __init__(self, location=None, copy_mode=COPY, **kwargs):
         # by default, this will be something like
         # settings.MEDIA_ROOT
         self._location = location
+        if copy_mode not in (COPY, LINK, REFLINK):
+            raise ValueError(f"Unsupported copy_mode={copy_mode}")
+        self.copy_mode = copy_mode
 
     @property
     def location(self):
@@ -112,7 +145,14 @@ class Storage:
         ]
         return len(only_dirs)
 
-    def abspath(self, _path):
+    def abspath(self, _path, download=True):
+        """
+        Returns absolute path of given file (or folder)
+
+        Storages which keep files elsewhere (see ``S3Storage``) fetch
+        missing file first, unless ``download`` is False i.e. unless
+        the file is about to be written.
+        """
         if isinstance(_path, DocumentPath):
             return os.path.join(
                 self.location, _path.url
@@ -177,7 +217,7 @@ class Storage:
         logger.debug(
             f"copy_doc: {src} to {dst}"
         )
-        shutil.copyfile(
+        self.copy_file(
             self.abspath(src),
             self.abspath(dst)
         )
@@ -187,46 +227,82 @@ class Storage:
             self.path(_path)
         )
 
+    def size(self, _path) -> int:
+        """Returns size (in bytes) of given file"""
+        return os.path.getsize(self.abspath(_path))
+
+    def iter_range(self, _path, start: int, end: int, chunk_size: int):
+        """
+        Yields, in chunks of (at most) ``chunk_size``, bytes
+        ``start``..``end`` (inclusive) of given file
+        """
+        with open(self.abspath(_path), 'rb') as file_handle:
+            file_handle.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file_handle.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def listdir(self, dirname: str):
+        """Returns names of the files in given folder"""
+        abs_dirname = self.abspath(dirname)
+        if not os.path.isdir(abs_dirname):
+            return []
+
+        return [
+            name for name in listdir(abs_dirname)
+            if not isdir(join(abs_dirname, name))
+        ]
+
+    def list_files(self, dirname: str) -> set:
+        """
+        Returns paths (relative to ``location``) of all files in given
+        folder and in its subfolders
+        """
+        abs_dirname = self.abspath(dirname)
+        result = set()
+        for root, _, names in os.walk(abs_dirname):
+            for name in names:
+                result.add(
+                    os.path.relpath(os.path.join(root, name), self.location)
+                )
+
+        return result
+
+    def delete_dir(self, dirname: str):
+        """Deletes given folder together with all its files"""
+        shutil.rmtree(self.abspath(dirname), ignore_errors=True)
+
     def copy_page_txt(self, src: PagePath, dst: PagePath):
         logger.debug(f"copy_page_txt src={src.txt_url} dst={dst.txt_url}")
         src_txt = self.abspath(src.txt_url)
         dst_txt = self.abspath(dst.txt_url)
 
-        self.make_sure_path_exists(
-            self.abspath(dst.txt_url)
-        )
-
-        shutil.copy(src_txt, dst_txt)
+        self.copy_file(src_txt, dst_txt)
 
     def copy_page_jpg(self, src: PagePath, dst: PagePath):
         logger.debug(f"copy_page_jpg src={src.jpg_url} dst={dst.jpg_url}")
         src_jpg = self.abspath(src.jpg_url)
         dst_jpg = self.abspath(dst.jpg_url)
 
-        self.make_sure_path_exists(
-            self.abspath(dst.jpg_url)
-        )
-        shutil.copy(src_jpg, dst_jpg)
+        self.copy_file(src_jpg, dst_jpg)
 
     def copy_page_hocr(self, src: PagePath, dst: PagePath):
         logger.debug(f"copy_page_hocr: src={src.hocr_url} dst={dst.hocr_url}")
         src_hocr = self.abspath(src.hocr_url)
         dst_hocr = self.abspath(dst.hocr_url)
 
-        self.make_sure_path_exists(
-            self.abspath(dst.hocr_url)
-        )
-
-        shutil.copy(src_hocr, dst_hocr)
+        self.copy_file(src_hocr, dst_hocr)
 
     def copy_page_svg(self, src: PagePath, dst: PagePath):
         logger.debug(f"copy_page_svg: src={src.svg_url} dst={dst.svg_url}")
         src_svg = self.abspath(src.svg_url)
         dst_svg = self.abspath(dst.svg_url)
 
-        self.make_sure_path_exists(self.abspath(dst.svg_url))
-
-        shutil.copy(src_svg, dst_svg)
+        self.copy_file(src_svg, dst_svg)
 
     def copy_page_preview(self, src: PagePath, dst: PagePath):
         logger.debug(
@@ -235,9 +311,39 @@ class Storage:
         src_preview = self.abspath(src.preview_url)
         dst_preview = self.abspath(dst.preview_url)
 
-        self.make_sure_path_exists(self.abspath(dst.preview_url))
+        self.copy_file(src_preview, dst_preview)
 
-        shutil.copy(src_preview, dst_preview)
+    def copy_file(self, src: str, dst: str):
+        """
+        Copies file ``src`` to ``dst`` (both absolute paths); destination
+        folder is created if it does not exist yet.
+
+        Depending on storage's ``copy_mode`` file's data is not copied at
+        all: with ``link`` mode documents, OCR sidecars and previews become
+        hard links of the source, with ``reflink`` mode file is cloned (copy on
+        write). If source and destination are not on the same file system
+        (or file system does not support it) file is copied.
+        """
+        self.make_sure_path_exists(dst)
+        _, ext = os.path.splitext(dst)
+        try:
+            if self.copy_mode == LINK and ext.lower() in LINKED_EXTENSIONS:
+                return link_file(src, dst)
+            if self.copy_mode == REFLINK:
+                return reflink_file(src, dst)
+        except OSError as error:
+            logger.debug(f"Can not {self.copy_mode} {dst} ({error})")
+
+        shutil.copy(src, dst)
+
+    def collect_garbage(self):
+        """
+        Removes stored data which is not referenced anymore.
+
+        Returns number of removed files. Default storage does not share
+        data between documents, thus there is nothing to collect.
+        """
+        return 0
 
     def copy_page(self, src: PagePath, dst: PagePath):
         """
@@ -245,36 +351,137 @@ class Storage:
 
         Page data are files with 'txt', 'hocr', 'jpg', 'svg' extentions.
         """
-        for inst in [src, dst]:
-            if not isinstance(inst, PagePath):
-                raise ValueError("copy_page accepts only PagePath instances")
-
-        # copy .txt file
-        if self.exists(src.txt_url):
-            self.copy_page_txt(src=src, dst=dst)
-        else:
-            logger.debug(f"txt does not exits {src.txt_url}")
-
-        # hocr
-        if self.exists(src.hocr_url):
-            self.copy_page_hocr(src=src, dst=dst)
-        else:
-            logger.debug(f"hocr does not exits {src.hocr_url}")
+        self.copy_pages([(src, dst)])
 
-        if self.exists(src.jpg_url):
-            self.copy_page_jpg(src=src, dst=dst)
-        else:
-            logger.debug(f"jpg does not exits {src.jpg_url}")
-
-        if self.exists(src.svg_url):
-            self.copy_page_svg(src=src, dst=dst)
-        else:
-            logger.debug(f"svg does not exits {src.svg_url}")
+    def copy_pages(self, page_paths):
+        """
+        Copies page data of multiple pages (see ``copy_page``).
 
-        if self.exists(src.preview_url):
-            self.copy_page_preview(src=src, dst=dst)
-        else:
-            logger.debug(f"preview does not exits {src.preview_url}")
+        ``page_paths`` is an iterable of ``(src, dst)`` PagePath pairs.
+        Instead of checking which page files exist one by one, ``pages``
+        folder of each source version is listed (recursively) only once.
+        """
+        page_paths = list(page_paths)
+        for src, dst in page_paths:
+            for inst in [src, dst]:
+                if not isinstance(inst, PagePath):
+                    raise ValueError(
+                        "copy_page accepts only PagePath instances"
+                    )
+
+        files = set()
+        for pages_dirname in set(
+            src.results_document_ep.pages_dirname() for src, _ in page_paths
+        ):
+            files.update(self.list_files(pages_dirname))
+
+        def exists(url):
+            return os.path.normpath(url) in files
+
+        for src, dst in page_paths:
+            for url, copy in (
+                (src.txt_url, self.copy_page_txt),
+                (src.hocr_url, self.copy_page_hocr),
+                (src.jpg_url, self.copy_page_jpg),
+                (src.svg_url, self.copy_page_svg),
+            ):
+                if exists(url):
+                    copy(src=src, dst=dst)
+                else:
+                    logger.debug(f"{url} does not exits")
+
+        preview_urls, manifests = self.previews_to_copy(page_paths)
+        for src_url, dst_url in preview_urls:
+            if exists(src_url):
+                self.copy_file(self.abspath(src_url), self.abspath(dst_url))
+            else:
+                logger.debug(f"{src_url} does not exits")
+
+        for doc_path, manifest in manifests:
+            self.write_previews_manifest(doc_path, manifest)
+
+    def previews_to_copy(self, page_paths):
+        """
+        Returns ``(urls, manifests)`` i.e. what has to be done to copy
+        page previews of given ``(src, dst)`` PagePath pairs:
+
+            * ``urls`` - ``(src_url, dst_url)`` pairs of preview files (all
+              tiers listed in source version's previews manifest or, for
+              documents created before preview tiers, the legacy preview)
+            * ``manifests`` - ``(DocumentPath, manifest)`` pairs of updated
+              previews manifests of destination versions
+
+        Previews rendered with different format/sizes than previews already
+        in destination manifest are not copied (missing previews are
+        generated on demand).
+        """
+        src_manifests = {}
+        dst_manifests = {}
+        urls = []
+
+        for src, dst in page_paths:
+            src_key = src.document_path.previews_manifest_url
+            if src_key not in src_manifests:
+                src_manifests[src_key] = self.read_previews_manifest(
+                    src.document_path
+                )
+            src_manifest = src_manifests[src_key]
+            tiers = src_manifest.get('pages', {}).get(str(src.page_num))
+            if not tiers:
+                urls.append((src.preview_url, dst.preview_url))
+                continue
+
+            dst_key = dst.document_path.previews_manifest_url
+            if dst_key not in dst_manifests:
+                dst_manifest = self.read_previews_manifest(dst.document_path)
+                if not dst_manifest:
+                    dst_manifest = {
+                        'format': src_manifest['format'],
+                        'sizes': src_manifest['sizes'],
+                        'pages': {}
+                    }
+                dst_manifests[dst_key] = (dst.document_path, dst_manifest)
+            _, dst_manifest = dst_manifests[dst_key]
+            if (
+                dst_manifest['format'] != src_manifest['format'] or
+                dst_manifest['sizes'] != src_manifest['sizes']
+            ):
+                continue
+
+            dst_tiers = {}
+            for tier, src_url in tiers.items():
+                _, ext = os.path.splitext(src_url)
+                dst_tiers[tier] = dst.preview_tier_url(tier, ext[1:])
+                urls.append((src_url, dst_tiers[tier]))
+            dst_manifest['pages'][str(dst.page_num)] = dst_tiers
+
+        return urls, list(dst_manifests.values())
+
+    def read_previews_manifest(self, doc_path: DocumentPath) -> dict:
+        """
+        Returns previews manifest of given document version (see
+        ``DocumentVersion.previews_manifest``) or empty dictionary if
+        there is none
+        """
+        try:
+            with open(self.abspath(doc_path.previews_manifest_url)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write_previews_manifest(self, doc_path: DocumentPath, manifest):
+        manifest_url = doc_path.previews_manifest_url
+        manifest_path = self.abspath(manifest_url)
+        self.make_sure_path_exists(manifest_path)
+        file_handle, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(manifest_path),
+            suffix='.json'
+        )
+        with os.fdopen(file_handle, 'w') as f:
+            json.dump(manifest, f)
+        # readers never see partially written manifest
+        os.replace(tmp_path, manifest_path)
+        self.upload(manifest_url)
 
     def reorder_pages(self, doc_path, new_order):
         """
@@ -466,3 +673,248 @@ class Storage:
 
 class FileSystemStorage(Storage):
     pass
+
+
+class BlobFileSystemStorage(FileSystemStorage):
+    """
+    File system storage which keeps identical files only once.
+
+    Content of each stored file is kept in content addressed blob i.e.
+    in ``blobs/<xx>/<yy>/<sha256 of the content>`` file. Document files
+    and their OCR sidecars (txt, hocr, svg) are hard links to their
+    blob, thus uploading the same file twice or copying unchanged pages
+    to the new document version does not use any extra space.
+
+    Blob's reference count is its number of hard links: once all documents
+    linking to the blob are deleted, only the blob's own link is left
+    and the blob is removed. ``delete_doc`` and ``delete_user_data``
+    check only the blobs of the deleted files; ``collect_garbage`` sweeps
+    all blobs (e.g. after files were removed outside of the storage).
+
+    Page previews are linked as well, as regenerated previews replace
+    their files (see ``replaced_file``) instead of overwriting them.
+    """
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(
+            self.abspath(AUX_DIR_BLOBS),
+            digest[0:2],
+            digest[2:4],
+            digest
+        )
+
+    def copy_file(self, src: str, dst: str):
+        _, ext = os.path.splitext(dst)
+        if ext.lower() not in LINKED_EXTENSIONS:
+            return super().copy_file(src, dst)
+
+        self.link_blob(src, dst)
+
+    def link_blob(self, src: str, dst: str):
+        """
+        Makes ``dst`` a hard link to the blob with the content of
+        ``src`` file (blob is created if it does not exist yet). If ``src``
+        is in the storage, it is replaced with a link to the blob too.
+
+        Falls back to plain copy if hard link can not be created
+        (e.g. ``src`` is on another file system).
+        """
+        self.make_sure_path_exists(dst)
+        try:
+            if self._is_linked(src):
+                # already deduplicated i.e. ``src`` is a link to its blob
+                link_file(src, dst)
+                return
+
+            blob = self.store_blob(src)
+            link_file(blob, dst)
+            if self._is_stored(src):
+                # deduplicate source as well
+                link_file(blob, src)
+        except OSError as error:
+            logger.warning(
+                f"Can not link {dst} to its blob ({error}). Copying instead."
+            )
+            shutil.copy(src, dst)
+
+    def _is_stored(self, path: str) -> bool:
+        location = os.path.abspath(self.location)
+        return os.path.abspath(path).startswith(location + os.sep)
+
+    def _is_linked(self, path: str) -> bool:
+        # within the storage, only links to blobs have more than one link
+        return self._is_stored(path) and os.stat(path).st_nlink > 1
+
+    def store_blob(self, src: str) -> str:
+        """
+        Returns path to the blob with the content of ``src`` file
+        """
+        digest = file_digest(src)
+        blob = self.blob_path(digest)
+
+        if not os.path.exists(blob):
+            self.make_sure_path_exists(blob)
+            # copy under temporary name first, so that blob is never
+            # seen incomplete
+            file_handle, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(blob)
+            )
+            os.close(file_handle)
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, blob)
+
+        return blob
+
+    def delete_doc(self, doc_path: DocumentPath):
+        blobs = self.linked_blobs(
+            self.path(doc_path.dirname_docs),
+            self.path(doc_path.dir_sidecars)
+        )
+        super().delete_doc(doc_path)
+        self.collect_blobs(blobs)
+
+    def delete_user_data(self, user_id: str):
+        blobs = self.linked_blobs(
+            os.path.join(self.abspath(AUX_DIR_DOCS), f'user_{user_id}'),
+            os.path.join(self.abspath(AUX_DIR_SIDECARS), f'user_{user_id}')
+        )
+        super().delete_user_data(user_id)
+        self.collect_blobs(blobs)
+
+    def linked_blobs(self, *abs_dirnames) -> set:
+        """
+        Returns paths of the blobs linked by files in given folders.
+
+        Content of each linked file is hashed (once per blob, as all links
+        of the blob share the same inode) to find its blob, i.e. cost is
+        proportional to the deleted data, not to the size of the storage.
+        """
+        blobs = set()
+        seen_inodes = set()
+        for abs_dirname in abs_dirnames:
+            for root, _, file_names in os.walk(abs_dirname):
+                for file_name in file_names:
+                    path = os.path.join(root, file_name)
+                    try:
+                        stat = os.stat(path)
+                        if stat.st_nlink == 1:
+                            # copied, not linked
+                            continue
+                        if stat.st_ino in seen_inodes:
+                            continue
+                        seen_inodes.add(stat.st_ino)
+                        blob = self.blob_path(file_digest(path))
+                        if os.path.samefile(path, blob):
+                            blobs.add(blob)
+                    except FileNotFoundError:
+                        continue
+
+        return blobs
+
+    def collect_blobs(self, blobs) -> int:
+        """
+        Removes those of given blobs which are not linked by any document
+        file. Returns number of removed blobs.
+        """
+        removed = 0
+        for blob in blobs:
+            try:
+                if os.stat(blob).st_nlink == 1:
+                    os.remove(blob)
+                    removed += 1
+            except FileNotFoundError:
+                # collected by concurrent run
+                continue
+
+        logger.debug(f"collect_blobs: removed {removed} blob(s)")
+
+        return removed
+
+    def collect_garbage(self):
+        """
+        Removes blobs which are not linked by any document file.
+
+        Walks all blobs, thus it is meant to be run periodically
+        (see ``collect_storage_garbage`` task), not on every delete.
+        """
+        blobs = (
+            os.path.join(root, file_name)
+            for root, _, file_names in os.walk(self.abspath(AUX_DIR_BLOBS))
+            for file_name in file_names
+        )
+
+        return self.collect_blobs(blobs)
+
+
+def file_digest(path: str) -> str:
+    """
+    Returns hex encoded SHA-256 digest of given file's content
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file_handle:
+        for chunk in iter(lambda: file_handle.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def link_file(src: str, dst: str):
+    """
+    Makes ``dst`` a hard link of ``src``. Existing ``dst`` is replaced
+    atomically.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+
+    # unique per thread, as files are linked by multiple threads at once
+    tmp_path = f"{dst}.{uuid.uuid4().hex}.link"
+    os.link(src, tmp_path)
+    try:
+        os.replace(tmp_path, dst)
+    finally:
+        # replacing a link of the same file (e.g. linked meanwhile by
+        # another thread) is a no-op which leaves ``tmp_path`` behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def replaced_file(path: str):
+    """
+    Yields temporary path to write ``path`` file to; once written,
+    temporary file atomically replaces ``path``.
+
+    Files in the storage may be hard links of each other (see
+    ``link_file``), thus they are never written in place: replaced
+    ``path`` gets new inode, its links are left untouched.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.{uuid.uuid4().hex}{ext}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def reflink_file(src: str, dst: str):
+    """
+    Makes ``dst`` a copy on write clone of ``src`` i.e. data blocks are
+    shared until one of the files is modified (btrfs, xfs).
+    """
+    if not sys.platform.startswith('linux'):
+        raise OSError(f"reflink is not supported on {sys.platform}")
+
+    import fcntl
+
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+
+    shutil.copymode(src, dst)
@@ -0,0 +1,116 @@
+import logging
+import os
+import tempfile
+import threading
+
+from PIL import Image
+
+from .previews import QUALITY
+
+logger = logging.getLogger(__name__)
+
+# when cache grows over ``max_size``, it is shrunk to this fraction of
+# ``max_size``, so that it is not scanned again on the very next miss
+LOW_WATERMARK = 0.9
+
+# cache location => estimated size (bytes) of the cache, per process
+_cache_sizes = {}
+_cache_sizes_lock = threading.Lock()
+
+
+class ThumbnailCache:
+    """
+    Size bounded disk cache of resized page previews.
+
+    Least recently used thumbnails are evicted once cache grows over
+    ``max_size`` bytes. Recency is tracked with thumbnail file's
+    modification time (bumped on each hit), as access time is often
+    not updated (noatime mounts).
+
+    Cache is not scanned on each miss: its size is measured once (per
+    process) and then only incremented with the size of each created
+    thumbnail. Whole cache is scanned (and evicted) only when that
+    estimate crosses ``max_size``.
+    """
+
+    def __init__(self, location: str, max_size: int):
+        self.location = location
+        self.max_size = max_size
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.location, key[0:2], key)
+
+    def get_or_create(self, key: str, src_path: str, width: int, fmt: str):
+        """
+        Returns path to the thumbnail of ``src_path`` image resized to
+        ``width`` pixels. Thumbnail is created if it is not in the cache.
+        """
+        path = self.path(key)
+        try:
+            # mark as recently used
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(file_handle)
+        with Image.open(src_path) as image:
+            if width < image.width:
+                height = round(image.height * width / image.width)
+                image = image.resize((width, height), Image.LANCZOS)
+            image.save(tmp_path, format=fmt.upper(), quality=QUALITY)
+        # concurrent readers never see partially written thumbnail
+        os.replace(tmp_path, path)
+
+        with _cache_sizes_lock:
+            size = _cache_sizes.get(self.location)
+            if size is not None:
+                size += os.path.getsize(path)
+                _cache_sizes[self.location] = size
+        if size is None or size > self.max_size:
+            self.evict(round(self.max_size * LOW_WATERMARK))
+
+        return path
+
+    def evict(self, max_size=None):
+        """
+        Removes least recently used thumbnails until cache is not bigger
+        than ``max_size`` (by default cache's ``max_size``) bytes.
+        Returns number of removed thumbnails.
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        entries = []
+        total_size = 0
+        for root, _, file_names in os.walk(self.location):
+            for file_name in file_names:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # evicted by concurrent request
+                pass
+            total_size -= size
+            removed += 1
+
+        with _cache_sizes_lock:
+            _cache_sizes[self.location] = total_size
+
+        if removed:
+            logger.debug(f"ThumbnailCache: evicted {removed} thumbnail(s)")
+
+        return removed
@@ -12,7 +12,10 @@ SAFE_EXTENSIONS = [
     '.png',
     '.hocr',
     '.pdf',
-    '.tiff'
+    '.tiff',
+    '.webp',
+    '.avif',
+    '.json'
 ]
 
 
@@ -0,0 +1,63 @@
+# Generated by Django 4.0.10 on 2026-10-18 00:00
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def populate_tree_path(apps, schema_editor):
+    """
+    Builds materialized path of all existing nodes level by level,
+    starting with the topmost nodes (i.e. nodes with parent_id=NULL)
+    """
+    BaseTreeNode = apps.get_model('core', 'BaseTreeNode')
+
+    nodes = list(
+        BaseTreeNode.objects.filter(
+            parent__isnull=True
+        ).only('id', 'tree_path')
+    )
+
+    while len(nodes) > 0:
+        parent_paths = {}
+        for node in nodes:
+            node.tree_path = f"{node.tree_path}{node.id.hex}/"
+            parent_paths[node.id] = node.tree_path
+
+        BaseTreeNode.objects.bulk_update(
+            nodes,
+            ['tree_path'],
+            batch_size=BATCH_SIZE
+        )
+
+        # next level i.e. children of current level nodes
+        parent_ids = list(parent_paths.keys())
+        nodes = []
+        for index in range(0, len(parent_ids), BATCH_SIZE):
+            children = BaseTreeNode.objects.filter(
+                parent_id__in=parent_ids[index:index + BATCH_SIZE]
+            ).only('id', 'parent_id')
+            for child in children:
+                # temporarily holds parent's path, see loop above
+                child.tree_path = parent_paths[child.parent_id]
+                nodes.append(child)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_remove_basetreenode_unique title per parent_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basetreenode',
+            name='tree_path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=1024),
+        ),
+        migrations.RunPython(
+            populate_tree_path,
+            reverse_code=migrations.RunPython.noop
+        ),
+    ]
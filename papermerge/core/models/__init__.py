@@ -1,7 +1,7 @@
 import uuid
 
 from django.contrib.auth.models import AbstractUser, Permission
-from django.db import models
+from django.db import models, transaction
 
 from papermerge.core.models.document import Document
 from papermerge.core.models.folder import Folder
@@ -103,5 +103,15 @@ class User(AbstractUser):
         return list(set(result))
 
     def delete(self, using=None, keep_parents=False):
-        Document.objects.filter(user=self).delete()
-        super().delete(using=using, keep_parents=keep_parents)
+        with transaction.atomic():
+            # Special folders are detached first, otherwise deleting
+            # them would cascade (via one-to-one fields) to the user itself
+            User.objects.filter(pk=self.pk).update(
+                home_folder=None,
+                inbox_folder=None
+            )
+            BaseTreeNode.objects.filter(user=self, parent=None).delete()
+            return super().delete(
+                using=using,
+                keep_parents=keep_parents
+            )
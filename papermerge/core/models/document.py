@@ -14,7 +14,6 @@ from papermerge.core.models import utils
 
 from .node import BaseTreeNode
 
-from .page import Page
 from .document_version import DocumentVersion
 
 
@@ -219,16 +218,16 @@ class Document(BaseTreeNode):
         document_version.page_count = page_count
         document_version.save()
 
-        dirname = os.path.dirname(
-            abs_path(document_version.document_path.url)
+        file_path = abs_path(
+            document_version.document_path.url,
+            download=False
         )
-        os.makedirs(dirname, exist_ok=True)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-        dst_pdf.save(abs_path(document_version.document_path.url))
+        dst_pdf.save(file_path)
+        get_storage_instance().upload(document_version.document_path.url)
 
-        document_version.size = getsize(
-            abs_path(document_version.document_path.url)
-        )
+        document_version.size = getsize(file_path)
         document_version.save()
 
         document_version.create_pages()
@@ -269,14 +268,7 @@ class Document(BaseTreeNode):
             lang=last_doc_version.lang
         )
         new_doc_version.save()
-
-        for page_number in range(1, new_page_count + 1):
-            Page.objects.create(
-                document_version=new_doc_version,
-                number=page_number,
-                page_count=new_page_count,
-                lang=last_doc_version.lang
-            )
+        new_doc_version.create_pages()
 
         return new_doc_version
 
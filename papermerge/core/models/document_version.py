@@ -1,19 +1,20 @@
-import os
 import uuid
 import logging
 
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from papermerge.core.storage import abs_path
+from papermerge.core.storage import abs_path, get_storage_instance
 
-from pdf2image import convert_from_path
-from pdf2image.generators import counter_generator
-
-from papermerge.core.lib.path import DocumentPath
+from papermerge.core.app_settings import settings
+from papermerge.core.lib.path import DocumentPath, PagePath
+from papermerge.core.lib.previews import get_extension, render_previews
 
 
 logger = logging.getLogger(__name__)
 
+# max number of pages inserted with one statement
+PAGES_BATCH_SIZE = 500
+
 
 class DocumentVersion(models.Model):
     """Document Version
@@ -83,31 +84,80 @@ class DocumentVersion(models.Model):
         )
 
     def generate_previews(self, page_number=None):
+        """
+        Renders previews of all pages (or only of ``page_number`` page) in
+        all ``PAPERMERGE_PREVIEW_SIZES`` tiers and records them in
+        the previews manifest (see ``previews_manifest``).
+        """
         logger.debug('generate_previews BEGIN')
-        abs_dirname = abs_path(self.document_path.dirname_sidecars())
-
-        kwargs = {
-            'pdf_path': abs_path(self.document_path.url),
-            'output_folder':  abs_dirname,
-            'fmt': 'jpg',
-            'size': (900,),
-            'output_file': counter_generator(padding_goal=3)
-        }
-
-        # in case page_number not None - generate only specific
-        # page number's preview
-        if page_number:
-            kwargs['first_page'] = page_number
-            kwargs['last_page'] = page_number
+        fmt = settings.PREVIEW_FORMAT
+        sizes = settings.PREVIEW_SIZES
+        extension = get_extension(fmt)
+        document_path = self.document_path
 
-        os.makedirs(
-            abs_dirname,
-            exist_ok=True
+        if page_number:
+            page_numbers = [page_number]
+            manifest = self.previews_manifest()
+        else:
+            page_numbers = range(1, self.page_count + 1)
+            manifest = {}
+
+        if manifest.get('format') != fmt or manifest.get('sizes') != sizes:
+            # previews were generated with different settings
+            manifest = {'format': fmt, 'sizes': sizes, 'pages': {}}
+
+        def tier_url(number, tier):
+            page_path = PagePath(document_path=document_path, page_num=number)
+            return page_path.preview_tier_url(tier, extension)
+
+        rendered = render_previews(
+            pdf_path=abs_path(document_path.url),
+            page_numbers=page_numbers,
+            sizes=sizes,
+            tier_path=lambda number, tier: abs_path(
+                tier_url(number, tier),
+                download=False
+            ),
+            fmt=fmt,
+            batch_size=settings.PREVIEW_BATCH_SIZE,
+            thread_count=settings.PREVIEW_THREAD_COUNT
+        )
+        for number, paths in rendered:
+            manifest['pages'][str(number)] = {
+                tier: tier_url(number, tier) for tier in paths
+            }
+
+        storage = get_storage_instance()
+        storage.upload(
+            PagePath(document_path=document_path, page_num=1).preview_dirname
         )
-        # generates jpeg previews of PDF file using pdftoppm (poppler-utils)
-        convert_from_path(**kwargs)
+        # manifest is written last, thus it lists only uploaded previews
+        storage.write_previews_manifest(document_path, manifest)
         logger.debug('generate_previews END')
 
+        return manifest
+
+    def previews_manifest(self) -> dict:
+        """
+        Returns manifest of generated previews e.g.
+
+            {
+                "format": "jpeg",
+                "sizes": {"thumbnail": 150, "full": 900},
+                "pages": {
+                    "1": {
+                        "thumbnail": "sidecars/.../thumbnail/000001.jpg",
+                        "full": "sidecars/.../full/000001.jpg"
+                    }
+                }
+            }
+
+        Returns empty dictionary if no previews were generated yet.
+        """
+        return get_storage_instance().read_previews_manifest(
+            self.document_path
+        )
+
     @property
     def is_archived(self):
         """
@@ -124,7 +174,7 @@ class DocumentVersion(models.Model):
     @property
     def document_path(self):
         return DocumentPath(
-            user_id=self.document.user.pk,
+            user_id=self.document.user_id,
             document_id=self.document.pk,
             version=self.number,
             file_name=self.file_name,
@@ -149,12 +199,22 @@ class DocumentVersion(models.Model):
             # Also no argument was supplied. Nothing to do.
             return
 
-        for page_number in range(1, new_page_count + 1):
-            self.pages.create(
-                number=page_number,
-                page_count=new_page_count,
-                lang=self.lang
-            )
+        # one INSERT (per `PAGES_BATCH_SIZE` pages) instead of one per page.
+        # Page model has no signal receivers; search index is updated
+        # once per version, on version's save
+        Page = self.pages.model
+        Page.objects.bulk_create(
+            [
+                Page(
+                    document_version=self,
+                    number=page_number,
+                    page_count=new_page_count,
+                    lang=self.lang
+                )
+                for page_number in range(1, new_page_count + 1)
+            ],
+            batch_size=PAGES_BATCH_SIZE
+        )
 
         if new_page_count and new_page_count != self.page_count:
             self.page_count = new_page_count
@@ -167,44 +227,56 @@ class DocumentVersion(models.Model):
         page contains non empty, non whitespace text - otherwise
         returns ``False``
         """
-        text = ''
-
-        for page in self.pages.all():
-            text = text + ' ' + page.text
-
-        return len(text.strip()) != 0
+        return any(
+            text.strip()
+            for text in self.pages.values_list('text', flat=True)
+        )
 
     def update_text_field(self, streams):
         """Update document versions's text field from IO streams.
 
         Arguments:
-            ``streams`` - a list of IO text streams
+            ``streams`` - an iterable (e.g. list or generator) of
+                IO text streams, one per page
 
         It will update text field of all associated pages first
         and then concatinate all text field into doc.text field.
+        Pages are loaded once and saved with one ``bulk_update``
+        (per ``PAGES_BATCH_SIZE`` pages).
 
         Returns True if document version contains non empty non whitespace
         text (i.e it was OCRed)
         """
         text = []
+        pages_to_update = []
 
         logger.debug(
             'document.update_text_field: '
-            f'document_id={self.pk} streams_count={len(streams)}'
+            f'document_id={self.pk}'
         )
 
-        for page, stream in zip(self.pages.all(), streams):
+        pages = list(self.pages.all())
+        for page, stream in zip(pages, streams):
             if len(page.text) == 0:
-                page.update_text_field(stream)
+                page.text = stream.read()
+                pages_to_update.append(page)
                 text.append(page.stripped_text)
 
+        if len(pages_to_update) > 0:
+            self.pages.model.objects.bulk_update(
+                pages_to_update,
+                ['text'],
+                batch_size=PAGES_BATCH_SIZE
+            )
+
         stripped_text = ' '.join(text)
         stripped_text = stripped_text.strip()
         if stripped_text:
             self.text = stripped_text
             self.save()
 
-        return self.has_combined_text
+        # same as `self.has_combined_text`, without querying pages again
+        return any(page.stripped_text for page in pages)
 
     def get_ocred_text(
         self,
@@ -1,29 +1,14 @@
 from django.db import models
 
 from papermerge.core.models import utils
-from papermerge.core.models.node import BaseTreeNode
+from papermerge.core.models.node import BaseTreeNode, NodeQuerySet
 
 
 class FolderManager(models.Manager):
     pass
 
 
-class FolderQuerySet(models.QuerySet):
-
-    def delete(self, *args, **kwargs):
-        for node in self:
-            descendants = node.get_descendants()
-
-            if len(descendants) > 0:
-                descendants.delete(*args, **kwargs)
-            # At this point all descendants were deleted.
-            # Self delete :)
-            try:
-                node.delete(*args, **kwargs)
-            except BaseTreeNode.DoesNotExist:
-                # this node was deleted by earlier recursive call
-                # it is ok, just skip
-                pass
+class FolderQuerySet(NodeQuerySet):
 
     def get_by_breadcrumb(self, breadcrumb: str, user):
         return utils.get_by_breadcrumb(
@@ -56,24 +41,6 @@ class Folder(BaseTreeNode):
     class JSONAPIMeta:
         resource_name = "folders"
 
-    def delete(self, *args, **kwargs):
-        descendants = self.basetreenode_ptr.get_descendants()
-
-        if len(descendants) > 0:
-            for node in descendants:
-                try:
-                    node.delete(*args, **kwargs)
-                except BaseTreeNode.DoesNotExist:
-                    pass
-        # At this point all descendants were deleted.
-        # Self delete :)
-        try:
-            super().delete(*args, **kwargs)
-        except BaseTreeNode.DoesNotExist:
-            # this node was deleted by earlier recursive call
-            # it is ok, just skip
-            pass
-
     @property
     def breadcrumb(self) -> str:
         value = super().breadcrumb
@@ -1,22 +1,33 @@
 import pytz
 import uuid
 
-from django.db.models import Q
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import Concat, Length, Substr
 from django.utils import timezone
-from django.db import models
+from django.db import IntegrityError, models, transaction
 
 from taggit.managers import TaggableManager
 from taggit.managers import _TaggableManager
 
 from papermerge.core import validators
 from papermerge.core.models.tags import ColoredTag
-from papermerge.core.signal_definitions import node_post_move
+from papermerge.core.signal_definitions import (
+    node_post_move,
+    nodes_post_move
+)
 
 from .utils import uuid2raw_str
 
 NODE_TYPE_FOLDER = 'folder'
 NODE_TYPE_DOCUMENT = 'document'
 
+# separator of node IDs in `BaseTreeNode.tree_path`
+TREE_PATH_SEP = '/'
+# max number of subtrees which path is rewritten in one UPDATE statement
+MOVE_NODES_BATCH_SIZE = 100
+# max number of subtrees deleted with one (bulk) delete
+DELETE_NODES_BATCH_SIZE = 100
+
 
 def move_node(source_node, target_node):
     """
@@ -36,6 +47,129 @@ def move_node(source_node, target_node):
     )
 
 
+def build_tree_path(node_id, parent_tree_path: str = '') -> str:
+    """
+    Returns materialized path of the node with given ``node_id``
+
+    Materialized path is the list of (raw) IDs of all ancestors
+    of the node, starting with the topmost one and ending with the node
+    itself. Each ID is terminated with `TREE_PATH_SEP`. Example:
+
+        input: node_id=UUID('1a606e93-...'), parent_tree_path='9b71.../'
+        output: '9b71.../1a606e93.../'
+    """
+    return f'{parent_tree_path}{uuid2raw_str(node_id)}{TREE_PATH_SEP}'
+
+
+def update_descendants_tree_path(old_tree_path: str, new_tree_path: str):
+    """
+    Replaces `old_tree_path` prefix with `new_tree_path` in materialized
+    path of all descendants of the node (node itself excluded).
+
+    Descendants are updated with one single UPDATE statement no matter how
+    big (or deep) the subtree is.
+    """
+    if old_tree_path == new_tree_path:
+        return 0
+
+    return BaseTreeNode.objects.filter(
+        tree_path__startswith=old_tree_path
+    ).exclude(
+        tree_path=old_tree_path
+    ).update(
+        tree_path=Concat(
+            Value(new_tree_path),
+            Substr('tree_path', len(old_tree_path) + 1),
+            output_field=models.CharField()
+        )
+    )
+
+
+def move_nodes(node_ids, target_node, user=None):
+    """
+    Set `target_node` as new parent of all nodes identified by `node_ids`.
+
+    Bulk version of `move_node`. Nodes are validated with one query,
+    reparented with one UPDATE and the materialized path of all moved
+    subtrees is rewritten with one UPDATE (per `MOVE_NODES_BATCH_SIZE`
+    nodes). No `post_save` signals are sent for the moved nodes; instead,
+    `papermerge.core.signal_definitions.nodes_post_move` signal is sent
+    only once, with the IDs of the moved nodes.
+
+    If `user` is provided, only nodes of that user are moved.
+
+    Raises `ValueError` if some of the nodes were not found, if
+    `target_node` is inside one of the moved subtrees or if some of the
+    nodes has the same title as one of `target_node`'s children.
+    """
+    nodes_qs = BaseTreeNode.objects.filter(pk__in=node_ids)
+    if user is not None:
+        nodes_qs = nodes_qs.filter(user=user)
+
+    nodes = list(nodes_qs.only('id', 'parent_id', 'tree_path'))
+
+    if len(nodes) != len(set(str(node_id) for node_id in node_ids)):
+        raise ValueError("Some of the nodes to move were not found")
+
+    target_tree_path = target_node.tree_path
+    for node in nodes:
+        if target_tree_path.startswith(node.tree_path):
+            raise ValueError(
+                f"Cannot move {node.pk} inside its own subtree"
+            )
+
+    # Longer paths first: when both a node and one of its descendants are
+    # moved, descendant's subtree must get descendant's new path
+    moves = sorted(
+        [
+            (node.tree_path, build_tree_path(node.id, target_tree_path))
+            for node in nodes
+        ],
+        key=lambda item: len(item[0]),
+        reverse=True
+    )
+
+    try:
+        with transaction.atomic():
+            BaseTreeNode.objects.filter(
+                pk__in=[node.pk for node in nodes]
+            ).update(
+                parent=target_node,
+                updated_at=timezone.now()
+            )
+
+            for index in range(0, len(moves), MOVE_NODES_BATCH_SIZE):
+                batch = moves[index:index + MOVE_NODES_BATCH_SIZE]
+                condition = Q()
+                whens = []
+                for old_tree_path, new_tree_path in batch:
+                    condition |= Q(tree_path__startswith=old_tree_path)
+                    whens.append(
+                        When(
+                            tree_path__startswith=old_tree_path,
+                            then=Concat(
+                                Value(new_tree_path),
+                                Substr('tree_path', len(old_tree_path) + 1),
+                                output_field=models.CharField()
+                            )
+                        )
+                    )
+                BaseTreeNode.objects.filter(condition).update(
+                    tree_path=Case(*whens, default='tree_path')
+                )
+    except IntegrityError as exc:
+        # unique title per parent
+        raise ValueError(
+            "Target folder already contains a node with the same title"
+        ) from exc
+
+    nodes_post_move.send(
+        sender=BaseTreeNode,
+        node_ids=[node.pk for node in nodes],
+        new_parent=target_node
+    )
+
+
 class PolymorphicTagManager(_TaggableManager):
     """
     What is this ugliness all about?
@@ -73,11 +207,36 @@ class PolymorphicTagManager(_TaggableManager):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        # tags fetched with `prefetch_related('tags')` are cached on the
+        # instance the manager was accessed from
+        self.prefetched_instance = self.instance
         # Instead of Document or Folder instances/models
         # always use associated BaseTreeNode instances/model
         if hasattr(self.instance, 'basetreenode_ptr'):  # Document or Folder
             self.model = self.instance.basetreenode_ptr.__class__
             self.instance = self.instance.basetreenode_ptr
+        elif self.instance is None and hasattr(self.model, 'basetreenode_ptr'):
+            # manager prefetching tags of Document or Folder instances
+            self.model = self.model.basetreenode_ptr.field.related_model
+
+    def get_queryset(self, extra_filters=None):
+        if extra_filters is None:
+            try:
+                return self.prefetched_instance._prefetched_objects_cache[
+                    self.prefetch_cache_name
+                ]
+            except (AttributeError, KeyError):
+                pass
+
+        return super().get_queryset(extra_filters)
+
+    def _remove_prefetched_objects(self):
+        super()._remove_prefetched_objects()
+        prefetch_cache = getattr(
+            self.prefetched_instance, '_prefetched_objects_cache', None
+        )
+        if prefetch_cache:
+            prefetch_cache.pop(self.prefetch_cache_name, None)
 
 
 class NodeManager(models.Manager):
@@ -87,19 +246,65 @@ class NodeManager(models.Manager):
 class NodeQuerySet(models.QuerySet):
 
     def delete(self, *args, **kwargs):
-        for node in self:
-            descendants = node.get_descendants()
+        """
+        Deletes nodes of the queryset together with all their descendants
 
-            if descendants.count() > 0:
-                descendants.delete(*args, **kwargs)
-            # At this point all descendants were deleted.
-            # Self delete :)
-            try:
-                node.delete(*args, **kwargs)
-            except BaseTreeNode.DoesNotExist:
-                # this node was deleted by earlier recursive call
-                # it is ok, just skip
-                pass
+        Subtrees are looked up via materialized path (i.e. no per-node
+        queries) and deleted, up to `DELETE_NODES_BATCH_SIZE` subtrees at
+        once, with Django's bulk delete. Files of deleted documents
+        are removed afterwards by a background task.
+
+        Note that Django's bulk delete still loads deleted nodes and
+        sends `pre_delete`/`post_delete` signals per instance, as
+        receivers (e.g. files cleanup, search index) depend on them.
+
+        Returns same (total, per model counts) tuple as Django's
+        `QuerySet.delete`.
+        """
+        nodes = sorted(
+            self.values_list('tree_path', 'id'),
+            key=lambda node: node[0]
+        )
+        conditions = []
+        subtree_path = None
+        for tree_path, node_id in nodes:
+            if subtree_path and tree_path.startswith(subtree_path):
+                # node is inside a subtree which is already being deleted
+                continue
+            if tree_path:
+                subtree_path = tree_path
+                conditions.append(Q(tree_path__startswith=tree_path))
+            else:
+                conditions.append(Q(pk=node_id))
+
+        total = 0
+        per_model = {}
+        with transaction.atomic():
+            for index in range(0, len(conditions), DELETE_NODES_BATCH_SIZE):
+                condition = Q()
+                for item in conditions[index:index + DELETE_NODES_BATCH_SIZE]:
+                    condition |= item
+
+                count, count_per_model = super(
+                    NodeQuerySet,
+                    BaseTreeNode.objects.filter(condition)
+                ).delete()
+                total += count
+                for label, value in count_per_model.items():
+                    per_model[label] = per_model.get(label, 0) + value
+
+        return total, per_model
+
+    def with_listing_data(self):
+        """
+        Joins associated Folder/Document (and its parent) and prefetches
+        tags, so that listing of nodes does not perform extra queries
+        per node
+        """
+        return self.select_related(
+            'folder__parent',
+            'document__parent'
+        ).prefetch_related('tags')
 
 
 CustomNodeManager = NodeManager.from_queryset(NodeQuerySet)
@@ -130,6 +335,18 @@ class BaseTreeNode(models.Model):
         null=True
     )
 
+    # Materialized path i.e. raw IDs of all ancestors, including node itself,
+    # separated by `TREE_PATH_SEP`. Kept in sync in `save()`; helps to
+    # retrieve ancestors and descendants without recursive queries.
+    # Note that only IDs are stored here, thus title renames
+    # do not affect it.
+    tree_path = models.CharField(
+        max_length=1024,
+        blank=True,
+        default='',
+        db_index=True
+    )
+
     title = models.CharField(
         "Title",
         max_length=200,
@@ -257,48 +474,85 @@ class BaseTreeNode(models.Model):
 
         return self._type == NODE_TYPE_DOCUMENT
 
+    @property
+    def ancestor_ids(self) -> list:
+        """
+        Returns (raw) IDs of all ancestors as stored in materialized path
+
+        Topmost ancestor is first in the list, node itself is last.
+        """
+        return [
+            item for item in self.tree_path.split(TREE_PATH_SEP) if item
+        ]
+
     def get_ancestors(self, include_self=True):
-        """Returns all ancestors of the node"""
-        sql = '''
-        WITH RECURSIVE tree AS (
-            SELECT *, 0 as level FROM core_basetreenode WHERE id = %s
-            UNION ALL
-            SELECT core_basetreenode.*, level + 1
-            FROM core_basetreenode, tree
-            WHERE core_basetreenode.id = tree.parent_id
-        )
-        '''
-        node_id = uuid2raw_str(self.pk)
-        if include_self:
-            sql += 'SELECT * FROM tree ORDER BY level DESC'
-            return BaseTreeNode.objects.raw(sql, [node_id])
+        """Returns all ancestors of the node
 
-        sql += 'SELECT * FROM tree WHERE NOT id = %s ORDER BY level DESC'
+        Ancestors are ordered starting with the topmost one i.e. if
+        `include_self` is True, node itself is the last one in the result.
+        """
+        if not self.tree_path:
+            # node was not saved yet
+            self.tree_path = self._build_tree_path()
+
+        ancestor_ids = self.ancestor_ids
+        if not include_self:
+            ancestor_ids = ancestor_ids[:-1]
 
-        return BaseTreeNode.objects.raw(sql, [node_id, node_id])
+        # Because ancestors' materialized paths are prefixes of each other
+        # ordering by their length yields correct order
+        return BaseTreeNode.objects.filter(
+            id__in=ancestor_ids
+        ).order_by(Length('tree_path'))
 
     def get_descendants(self, include_self=True):
         """Returns all descendants of the node"""
-        sql = '''
-        WITH RECURSIVE tree AS (
-            SELECT * FROM core_basetreenode WHERE id = %s
-            UNION ALL
-            SELECT core_basetreenode.* FROM core_basetreenode, tree
-              WHERE core_basetreenode.parent_id = tree.id
+        if not self.tree_path:
+            self.tree_path = self._build_tree_path()
+
+        qs = BaseTreeNode.objects.filter(
+            tree_path__startswith=self.tree_path
         )
-        '''
-        node_id = uuid2raw_str(self.pk)
         if include_self:
-            sql += 'SELECT * FROM tree'
-            return BaseTreeNode.objects.raw(sql, [node_id])
+            return qs
+
+        return qs.exclude(pk=self.id)
 
-        sql += 'SELECT * FROM tree WHERE NOT id = %s'
-        return BaseTreeNode.objects.raw(sql, [node_id, node_id])
+    def _build_tree_path(self) -> str:
+        """Builds materialized path from the (fresh) parent's path"""
+        parent_tree_path = ''
+        if self.parent_id:
+            parent_tree_path = BaseTreeNode.objects.filter(
+                pk=self.parent_id
+            ).values_list('tree_path', flat=True).first() or ''
+
+        return build_tree_path(self.id, parent_tree_path)
 
     def save(self, *args, **kwargs):
         if not self.ctype:
             self.ctype = self.__class__.__name__.lower()
-        return super().save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is not None and 'parent' not in update_fields:
+            # parent did not change, neither did materialized path
+            return super().save(*args, **kwargs)
+
+        old_tree_path = self.tree_path
+        self.tree_path = self._build_tree_path()
+        if update_fields is not None:
+            kwargs['update_fields'] = list(update_fields) + ['tree_path']
+
+        ret = super().save(*args, **kwargs)
+
+        if old_tree_path and old_tree_path != self.tree_path:
+            # node was moved i.e. all its descendants need new path as well
+            update_descendants_tree_path(old_tree_path, self.tree_path)
+
+        return ret
+
+    def delete(self, *args, **kwargs):
+        """Deletes node together with all its descendants"""
+        return BaseTreeNode.objects.filter(pk=self.id).delete()
 
     class Meta:
         # please do not confuse this "Documents" verbose name
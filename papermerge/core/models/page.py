@@ -5,7 +5,8 @@ import uuid
 from django.db import models
 
 from papermerge.core.lib.path import PagePath
-from papermerge.core.storage import abs_path
+from papermerge.core.lib.previews import FULL, JPEG, get_content_type
+from papermerge.core.storage import abs_path, get_storage_instance
 from papermerge.core.utils import clock
 
 from .utils import (
@@ -194,22 +195,47 @@ class Page(models.Model):
 
         return OCR_STATUS_UNKNOWN
 
-    @clock
-    def get_jpeg(self):
-        jpeg_abs_path = abs_path(self.page_path.preview_url)
+    def get_preview(self, tier=FULL, manifest=None):
+        """
+        Returns ``(absolute path, content type)`` of page's preview
+        of given tier.
 
-        if not os.path.exists(jpeg_abs_path):
-            # generate preview only for this page
-            self.document_version.generate_previews(
-                page_number=self.number
-            )
+        Previews are never rendered here: if preview was not generated
+        yet (see ``DocumentVersion.generate_previews``) IOError is raised.
+        """
+        url, content_type = self.get_preview_url(tier, manifest)
+        preview_abs_path = abs_path(url)
+        if not os.path.exists(preview_abs_path):
+            raise IOError(f"Preview {preview_abs_path} does not exist")
 
-        if not os.path.exists(jpeg_abs_path):
-            # means that self.generate_preview() failed
-            # to extract page image from the document
-            raise IOError
+        return preview_abs_path, content_type
+
+    def get_preview_url(self, tier=FULL, manifest=None):
+        """
+        Returns ``(storage relative path, content type)`` of page's preview
+        of given tier. Raises IOError if preview was not generated yet.
+
+        Pages of documents created before preview tiers were introduced
+        (i.e. without previews manifest) fall back to the legacy preview.
+        """
+        if manifest is None:
+            manifest = self.document_version.previews_manifest()
+        try:
+            url = manifest['pages'][str(self.number)][tier]
+        except KeyError:
+            url = self.page_path.preview_url
+            if get_storage_instance().exists(url):
+                return url, get_content_type(JPEG)
+
+            raise IOError(f"Preview {tier} of page {self.pk} not available")
+
+        return url, get_content_type(manifest['format'])
+
+    @clock
+    def get_jpeg(self):
+        preview_abs_path, _ = self.get_preview()
 
-        with open(jpeg_abs_path, "rb") as f:
+        with open(preview_abs_path, "rb") as f:
             data = f.read()
 
         return data
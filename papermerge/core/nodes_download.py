@@ -1,16 +1,49 @@
+import io
 import os
 import zipfile
 import tarfile
+from collections import defaultdict
+from functools import partial
 
-from django.core.files.temp import NamedTemporaryFile
+from django.db.models import OuterRef, Q, Subquery
 
-from papermerge.core.models import Document, BaseTreeNode
+from papermerge.core.models import Document, DocumentVersion, BaseTreeNode
 from papermerge.core.serializers.node import (
     ONLY_ORIGINAL,
     ONLY_LAST,
     ZIP
 )
 
+# size (in bytes) of file chunks read/streamed at once
+CHUNK_SIZE = 64 * 1024
+# max number of requested subtrees loaded with one query
+SUBTREES_BATCH_SIZE = 100
+
+
+class StreamBuffer(io.RawIOBase):
+    """
+    Non-seekable, write-only file object used as archive's output.
+
+    Whatever archive writer writes is kept only until next `drain` call
+    i.e. memory usage is bounded by the amount of data written in
+    between two `drain` calls.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+
+        return data
+
 
 class NodesDownload:
     """
@@ -29,16 +62,21 @@ class NodesDownload:
         self._include_version = include_version
         self._node_ids = node_ids
 
-    def _create(self):
+    def stream(self, on_progress=None):
+        """
+        Yields downloaded content (archive or document file) in chunks
+
+        If provided, `on_progress(processed, total)` is invoked each time
+        one more document file was entirely streamed.
+        """
         raise Exception("Not Implemented")
 
     def get_content(self):
-        file_handle = self._create()
-        file_handle.seek(0)
-        data = file_handle.read()
-        file_handle.close()
+        return b''.join(self.stream())
 
-        return data
+    @property
+    def content_disposition(self):
+        return f"attachment; filename={self.file_name}"
 
     def wants_only_orignal(self):
         return self._include_version == ONLY_ORIGINAL
@@ -46,29 +84,122 @@ class NodesDownload:
     def wants_only_last(self):
         return self._include_version == ONLY_LAST
 
-    def _recursive_create_archive(self, archive, node_ids, abspath):
-        for node in BaseTreeNode.objects.filter(id__in=node_ids):
-            if node.is_document():
-                arcname = os.path.join(*abspath, node.idified_title)
-                if self.wants_only_last():
-                    doc_version = node.versions.last()
-                else:
-                    doc_version = node.versions.first()
-
-                self.archive_add(
-                    archive=archive,
-                    abs_file_path=doc_version.abs_file_path(),
-                    arcname=arcname
+    def _load_subtrees(self):
+        """
+        Loads requested nodes, all their descendants and the chosen
+        version of each document within.
+
+        Returns a tuple (requested nodes, children per parent ID,
+        document version per document ID). Number of queries does not
+        depend on the size or depth of the subtrees: one for requested
+        nodes, plus two per `SUBTREES_BATCH_SIZE` requested nodes.
+        """
+        fields = ('id', 'parent_id', 'title', 'ctype', 'tree_path')
+        nodes = list(
+            BaseTreeNode.objects.filter(id__in=self._node_ids).only(*fields)
+        )
+        children = defaultdict(list)
+        loaded_ids = set()
+        doc_versions = {}
+
+        if self.wants_only_last():
+            version_order = '-number'
+        else:
+            version_order = 'number'
+
+        chosen_number = DocumentVersion.objects.filter(
+            document_id=OuterRef('document_id')
+        ).order_by(version_order).values('number')[:1]
+
+        for index in range(0, len(nodes), SUBTREES_BATCH_SIZE):
+            nodes_cond = Q()
+            versions_cond = Q()
+            for node in nodes[index:index + SUBTREES_BATCH_SIZE]:
+                nodes_cond |= Q(tree_path__startswith=node.tree_path)
+                versions_cond |= Q(
+                    document__tree_path__startswith=node.tree_path
                 )
+
+            descendants = BaseTreeNode.objects.filter(
+                nodes_cond
+            ).only(*fields).order_by('title')
+            for node in descendants:
+                # subtrees from different batches may overlap
+                if node.id not in loaded_ids:
+                    loaded_ids.add(node.id)
+                    children[node.parent_id].append(node)
+
+            versions = DocumentVersion.objects.filter(
+                versions_cond,
+                number=Subquery(chosen_number)
+            ).select_related('document')
+            for doc_version in versions:
+                doc_versions[doc_version.document_id] = doc_version
+
+        return nodes, children, doc_versions
+
+    def _archive_entries(self):
+        """
+        Yields (abs_file_path, arcname) tuple for each document to
+        be included in the archive.
+
+        Subtrees are walked iteratively (i.e. without recursion),
+        over the data prefetched by `_load_subtrees`.
+        """
+        nodes, children, doc_versions = self._load_subtrees()
+        stack = [(node, []) for node in reversed(nodes)]
+
+        while len(stack) > 0:
+            node, abspath = stack.pop()
+            if node.is_document:
+                doc_version = doc_versions.get(node.id, None)
+                if doc_version is None:
+                    # document without any version
+                    continue
+                arcname = os.path.join(
+                    *abspath,
+                    doc_version.document.idified_title
+                )
+                yield doc_version.abs_file_path(), arcname
             else:
-                child_ids = [child.id for child in node.get_children()]
-                self._recursive_create_archive(
-                    archive,
-                    child_ids,
-                    abspath + [node.idified_title]
+                child_abspath = abspath + [node.idified_title]
+                stack.extend(
+                    (child, child_abspath)
+                    for child in reversed(children[node.id])
                 )
 
-    def archive_add(self, abs_file_path, arcname):
+
+class NodesDownloadArchive(NodesDownload):
+    """
+    Base class for archive downloads.
+
+    Archive is built on the fly, while it is streamed: each document
+    file is read and passed to the archive writer in chunks of `CHUNK_SIZE`
+    and archive's output is yielded after each chunk.
+    """
+    def stream(self, on_progress=None):
+        buffer = StreamBuffer()
+        archive = self.archive_open(buffer)
+        entries = list(self._archive_entries())
+        for index, (abs_file_path, arcname) in enumerate(entries):
+            for _ in self.archive_add(archive, abs_file_path, arcname):
+                data = buffer.drain()
+                if data:
+                    yield data
+            if on_progress:
+                on_progress(index + 1, len(entries))
+
+        archive.close()
+        yield buffer.drain()
+
+    def archive_open(self, fileobj):
+        raise Exception("Not Implemented")
+
+    def archive_add(self, archive, abs_file_path, arcname):
+        """
+        Adds file to the archive. Yields after each chunk of the file
+        was written
+        """
         raise Exception("Not Implemented")
 
     @property
@@ -79,12 +210,8 @@ class NodesDownload:
     def content_type(self):
         raise Exception("Not Implemented")
 
-    @property
-    def content_disposition(self):
-        return f"attachment; filename={self.file_name}"
 
-
-class NodesDownloadZip(NodesDownload):
+class NodesDownloadZip(NodesDownloadArchive):
     """
     Creates zip archive from a list of nodes. It preserves folder structure.
 
@@ -96,22 +223,20 @@ class NodesDownloadZip(NodesDownload):
         include_version="only_last"
     )
 
-    # returns zip archives content (as bytes)
-    data = nodes_download.get_content()
+    # yields zip archive's content (as bytes) chunk by chunk
+    for chunk in nodes_download.stream():
+        ...
     """
-    def _create(self):
-        temp_file_obj = NamedTemporaryFile(prefix='download_')
-        archive = zipfile.ZipFile(temp_file_obj, mode='w')
-        self._recursive_create_archive(
-            archive=archive,
-            node_ids=self._node_ids,
-            abspath=[]
-        )
-        temp_file_obj.seek(0)
-        return temp_file_obj
+    def archive_open(self, fileobj):
+        return zipfile.ZipFile(fileobj, mode='w')
 
     def archive_add(self, archive, abs_file_path, arcname):
-        archive.write(abs_file_path, arcname=arcname)
+        zinfo = zipfile.ZipInfo.from_file(abs_file_path, arcname=arcname)
+        with open(abs_file_path, 'rb') as src:
+            with archive.open(zinfo, mode='w') as dst:
+                for chunk in iter(partial(src.read, CHUNK_SIZE), b''):
+                    dst.write(chunk)
+                    yield
 
     @property
     def file_name(self):
@@ -128,7 +253,7 @@ class NodesDownloadZip(NodesDownload):
         return f'NodesDownloadZip(node_ids={self._node_ids})'
 
 
-class NodesDownloadTarGz(NodesDownload):
+class NodesDownloadTarGz(NodesDownloadArchive):
     """
     Creates targz archive from a list of nodes. It preserves folder structure.
 
@@ -140,22 +265,33 @@ class NodesDownloadTarGz(NodesDownload):
         include_version="only_last"
     )
 
-    # returns tar.gz archives content (as bytes)
-    data = nodes_download.get_content()
+    # yields tar.gz archive's content (as bytes) chunk by chunk
+    for chunk in nodes_download.stream():
+        ...
     """
-    def _create(self):
-        temp_file_obj = NamedTemporaryFile(prefix='download_')
-        archive = tarfile.open(temp_file_obj.name, mode='w:gz')
-        self._recursive_create_archive(
-            archive=archive,
-            node_ids=self._node_ids,
-            abspath=[]
-        )
-        temp_file_obj.seek(0)
-        return temp_file_obj
+    def archive_open(self, fileobj):
+        return tarfile.open(fileobj=fileobj, mode='w|gz')
 
     def archive_add(self, archive, abs_file_path, arcname):
-        archive.add(abs_file_path, arcname=arcname)
+        # Same as `archive.addfile`, except that file's data is written
+        # (i.e. can be streamed) chunk by chunk; `addfile` writes whole
+        # file at once i.e. whole compressed file would be buffered
+        tarinfo = archive.gettarinfo(abs_file_path, arcname=arcname)
+        header = tarinfo.tobuf(archive.format, archive.encoding, archive.errors)
+        archive.fileobj.write(header)
+
+        with open(abs_file_path, 'rb') as src:
+            for chunk in iter(partial(src.read, CHUNK_SIZE), b''):
+                archive.fileobj.write(chunk)
+                yield
+
+        blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+        if remainder > 0:
+            archive.fileobj.write(
+                tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+            )
+            blocks += 1
+        archive.offset += len(header) + blocks * tarfile.BLOCKSIZE
 
     @property
     def file_name(self):
@@ -185,12 +321,18 @@ class NodesDownloadDocument(NodesDownload):
         include_version="only_last"
     )
 
-    # returns document's last version file content (as bytes)
-    data = nodes_download.get_content()
+    # yields document's last version file content (as bytes)
+    # chunk by chunk
+    for chunk in nodes_download.stream():
+        ...
     """
-    def _create(self):
+    def stream(self, on_progress=None):
         abs_path = self.get_document_file_abs_path()
-        return open(abs_path, 'rb')
+        with open(abs_path, 'rb') as src:
+            yield from iter(partial(src.read, CHUNK_SIZE), b'')
+
+        if on_progress:
+            on_progress(1, 1)
 
     def get_document_version(self):
         doc = Document.objects.get(pk=self._node_ids[0])
@@ -206,6 +348,11 @@ class NodesDownloadDocument(NodesDownload):
 
         return abs_file_path
 
+    @property
+    def url(self):
+        """Returns storage relative path of the document file"""
+        return self.get_document_version().document_path.url
+
     @property
     def file_name(self):
         if self._file_name:
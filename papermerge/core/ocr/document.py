@@ -1,14 +1,19 @@
 import os
+import re
+import shutil
 import logging
 
 import ocrmypdf
+from pikepdf import Pdf
 
-from papermerge.core.storage import abs_path
+from papermerge.core.storage import abs_path, get_storage_instance
 from papermerge.core.lib import mime
 from papermerge.core.lib.tiff import convert_tiff2pdf
 from papermerge.core.lib.path import (
     DocumentPath,
+    PagePath
 )
+from papermerge.core.lib.storage import replaced_file
 
 
 logger = logging.getLogger(__name__)
@@ -16,6 +21,11 @@ logger = logging.getLogger(__name__)
 STARTED = "started"
 COMPLETE = "complete"
 
+# name of the file which marks page range's OCR as complete
+CHECKPOINT_FILE_NAME = "complete"
+# six digits page number in sidecars' file/folder names e.g. 000012_ocr.svg
+SIDECAR_PAGE_NUMBER = re.compile(r'(?<!\d)(\d{6})(?!\d)')
+
 
 def notify_hocr_ready(page_path, **kwargs):
     pass
@@ -45,7 +55,7 @@ def _ocr_document(
 
     input_document = abs_path(input_doc_path.path)
 
-    output_document = abs_path(target_doc_path.path)
+    output_document = abs_path(target_doc_path.path, download=False)
 
     output_dir = os.path.dirname(output_document)
 
@@ -55,6 +65,30 @@ def _ocr_document(
             exist_ok=True
         )
 
+    # OCR results are written aside and then moved in place, as existing
+    # document file and sidecars may be shared (hard linked) with other
+    # document versions
+    work_dir = os.path.join(sidecars_dir, 'ocr')
+    shutil.rmtree(work_dir, ignore_errors=True)
+    with replaced_file(output_document) as tmp_output_document:
+        _run_ocrmypdf(
+            input_document=input_document,
+            output_document=tmp_output_document,
+            sidecars_dir=work_dir,
+            lang=lang,
+            preview_width=preview_width
+        )
+    _move_sidecars(src_dir=work_dir, dst_dir=sidecars_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _run_ocrmypdf(
+    input_document: str,
+    output_document: str,
+    sidecars_dir: str,
+    lang: str,
+    preview_width: int
+):
     ocrmypdf.ocr(
         input_document,
         output_document,
@@ -130,4 +164,309 @@ def ocr_document(
         )
         return True
 
+    _upload_ocr_results(target_doc_path)
+
     return True
+
+
+def _upload_ocr_results(target_doc_path: DocumentPath):
+    """
+    Sends OCRed document and its sidecars to the storage
+    (see ``Storage.upload``)
+    """
+    storage = get_storage_instance()
+    storage.upload(target_doc_path.url)
+    storage.upload(target_doc_path.dirname_sidecars())
+
+
+def get_page_ranges(page_count: int, pages_per_range: int):
+    """
+    Splits pages 1..page_count into consecutive ranges of at most
+    ``pages_per_range`` pages.
+
+    Returns a list of (first_page, last_page) tuples (both inclusive) e.g.
+    get_page_ranges(10, 4) => [(1, 4), (5, 8), (9, 10)]
+    """
+    return [
+        (first_page, min(first_page + pages_per_range - 1, page_count))
+        for first_page in range(1, page_count + 1, pages_per_range)
+    ]
+
+
+def page_range_dirname(
+    target_doc_path: DocumentPath,
+    lang: str,
+    first_page: int,
+    last_page: int
+) -> str:
+    """
+    Returns (relative) folder where results of page range's OCR
+    are checkpointed
+    """
+    return (
+        f"{target_doc_path.dirname_sidecars()}chunks/"
+        f"{lang}-{first_page:06d}-{last_page:06d}/"
+    )
+
+
+def ocr_page_range(
+    user_id,
+    document_id,
+    file_name,
+    lang,
+    version,
+    target_version,
+    first_page: int,
+    last_page: int
+) -> bool:
+    """
+    OCRs pages ``first_page``..``last_page`` (inclusive) of the document
+    version into page range's checkpoint folder.
+
+    Page range which was already OCRed (i.e. its checkpoint is complete) is
+    skipped. Returns True if OCR was performed, False if it was skipped.
+    """
+    lang = lang.lower()
+    doc_path = DocumentPath(
+        user_id=user_id,
+        document_id=document_id,
+        file_name=file_name,
+        version=version
+    )
+    target_doc_path = DocumentPath.copy_from(
+        doc_path,
+        version=target_version
+    )
+    storage = get_storage_instance()
+    range_dirname = page_range_dirname(
+        target_doc_path, lang, first_page, last_page
+    )
+    range_dir = abs_path(range_dirname)
+    checkpoint_url = f"{range_dirname}{CHECKPOINT_FILE_NAME}"
+
+    if storage.exists(checkpoint_url):
+        logger.debug(
+            f"Pages {first_page}-{last_page} of doc_id={document_id} "
+            "already OCRed"
+        )
+        return False
+
+    # leftovers of an interrupted run
+    shutil.rmtree(range_dir, ignore_errors=True)
+    os.makedirs(range_dir, exist_ok=True)
+
+    input_document = os.path.join(range_dir, 'input.pdf')
+    _extract_pages(
+        abs_path(doc_path.url),
+        input_document,
+        page_numbers=range(first_page, last_page + 1)
+    )
+
+    _run_ocrmypdf(
+        input_document=input_document,
+        output_document=os.path.join(range_dir, 'output.pdf'),
+        sidecars_dir=os.path.join(range_dir, 'pages'),
+        lang=lang,
+        preview_width=300
+    )
+    os.remove(input_document)
+    # page ranges may be stitched by another worker
+    storage.upload(range_dirname)
+
+    # checkpoint is created only after page range was successfully OCRed
+    open(os.path.join(range_dir, CHECKPOINT_FILE_NAME), 'w').close()
+    storage.upload(checkpoint_url)
+
+    return True
+
+
+def _extract_pages(src_path: str, dst_path: str, page_numbers):
+    """
+    Saves given pages (numbering starts with 1) of ``src_path`` PDF file
+    as new PDF file ``dst_path``
+    """
+    with Pdf.open(src_path) as src_pdf:
+        dst_pdf = Pdf.new()
+        for number in page_numbers:
+            dst_pdf.pages.append(src_pdf.pages[number - 1])
+        dst_pdf.save(dst_path)
+        dst_pdf.close()
+
+
+def _move_sidecars(src_dir: str, dst_dir: str, page_numbers=None):
+    """
+    Moves sidecars from ``src_dir`` to ``dst_dir``. Existing sidecars
+    are replaced i.e. never written in place.
+
+    Sidecars in ``src_dir`` are numbered 1, 2, 3, ... i.e. by page's
+    position in the OCRed (partial) PDF file. Page numbers in sidecars' file
+    and folder names are replaced with document's page numbers:
+    ``page_numbers[N - 1]`` is document's page number of the page N
+    (without ``page_numbers``, sidecars keep their names).
+    """
+    def renumber(match):
+        if page_numbers is None:
+            return match.group(1)
+
+        return f"{page_numbers[int(match.group(1)) - 1]:06d}"
+
+    for root, _, file_names in os.walk(src_dir):
+        relative_root = os.path.relpath(root, src_dir)
+        for file_name in file_names:
+            relative_path = os.path.normpath(
+                os.path.join(relative_root, file_name)
+            )
+            dst_path = os.path.join(
+                dst_dir,
+                SIDECAR_PAGE_NUMBER.sub(renumber, relative_path)
+            )
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            os.replace(os.path.join(root, file_name), dst_path)
+
+
+def stitch_page_ranges(
+    user_id,
+    document_id,
+    file_name,
+    lang,
+    version,
+    target_version,
+    page_ranges
+):
+    """
+    Joins results of all page ranges OCRed by ``ocr_page_range``: OCRed
+    PDFs are merged into the target document version's file and sidecars
+    are moved to target version's sidecars folder. Checkpoints are
+    removed afterwards.
+    """
+    lang = lang.lower()
+    doc_path = DocumentPath(
+        user_id=user_id,
+        document_id=document_id,
+        file_name=file_name,
+        version=version
+    )
+    target_doc_path = DocumentPath.copy_from(
+        doc_path,
+        version=target_version
+    )
+    sidecars_dir = abs_path(target_doc_path.dirname_sidecars())
+    output_document = abs_path(target_doc_path.path, download=False)
+    os.makedirs(os.path.dirname(output_document), exist_ok=True)
+
+    storage = get_storage_instance()
+    range_pdfs = []
+    dst_pdf = Pdf.new()
+    for first_page, last_page in page_ranges:
+        range_dirname = page_range_dirname(
+            target_doc_path, lang, first_page, last_page
+        )
+        storage.download(range_dirname)
+        range_dir = abs_path(range_dirname)
+        range_pdf = Pdf.open(os.path.join(range_dir, 'output.pdf'))
+        range_pdfs.append(range_pdf)
+        dst_pdf.pages.extend(range_pdf.pages)
+        _move_sidecars(
+            src_dir=os.path.join(range_dir, 'pages'),
+            dst_dir=sidecars_dir,
+            page_numbers=range(first_page, last_page + 1)
+        )
+
+    with replaced_file(output_document) as tmp_output_document:
+        dst_pdf.save(tmp_output_document)
+    dst_pdf.close()
+    for range_pdf in range_pdfs:
+        range_pdf.close()
+
+    shutil.rmtree(
+        abs_path(f"{target_doc_path.dirname_sidecars()}chunks/"),
+        ignore_errors=True
+    )
+    _upload_ocr_results(target_doc_path)
+
+
+def ocr_document_incremental(
+    user_id,
+    document_id,
+    file_name,
+    lang,
+    version,
+    target_version,
+    page_numbers
+):
+    """
+    OCRs only given pages (numbering starts with 1) of the PDF document.
+
+    Remaining pages are considered already OCRed: they are copied as they
+    are (i.e. without being rasterized again) from the document version
+    into target document version together with their sidecars.
+    """
+    lang = lang.lower()
+    doc_path = DocumentPath(
+        user_id=user_id,
+        document_id=document_id,
+        file_name=file_name,
+        version=version
+    )
+    target_doc_path = DocumentPath.copy_from(
+        doc_path,
+        version=target_version
+    )
+    sidecars_dir = abs_path(target_doc_path.dirname_sidecars())
+    work_dir = os.path.join(sidecars_dir, 'incremental')
+    input_document = os.path.join(work_dir, 'input.pdf')
+    ocred_document = os.path.join(work_dir, 'output.pdf')
+    output_document = abs_path(target_doc_path.path, download=False)
+    page_numbers = sorted(page_numbers)
+
+    if not page_numbers:
+        # all pages are already OCRed i.e. there is nothing to add
+        # into target document version
+        return
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(output_document), exist_ok=True)
+
+    _extract_pages(
+        abs_path(doc_path.url),
+        input_document,
+        page_numbers=page_numbers
+    )
+    _run_ocrmypdf(
+        input_document=input_document,
+        output_document=ocred_document,
+        sidecars_dir=os.path.join(work_dir, 'pages'),
+        lang=lang,
+        preview_width=300
+    )
+    _move_sidecars(
+        src_dir=os.path.join(work_dir, 'pages'),
+        dst_dir=sidecars_dir,
+        page_numbers=page_numbers
+    )
+
+    ocred_pages = {
+        number: index for index, number in enumerate(page_numbers)
+    }
+    reused_page_paths = []
+    with Pdf.open(abs_path(doc_path.url)) as src_pdf:
+        with Pdf.open(ocred_document) as ocred_pdf, Pdf.new() as dst_pdf:
+            for number, page in enumerate(src_pdf.pages, start=1):
+                if number in ocred_pages:
+                    dst_pdf.pages.append(ocred_pdf.pages[ocred_pages[number]])
+                else:
+                    dst_pdf.pages.append(page)
+                    reused_page_paths.append((
+                        PagePath(document_path=doc_path, page_num=number),
+                        PagePath(
+                            document_path=target_doc_path,
+                            page_num=number
+                        )
+                    ))
+            with replaced_file(output_document) as tmp_output_document:
+                dst_pdf.save(tmp_output_document)
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    _upload_ocr_results(target_doc_path)
+    get_storage_instance().copy_pages(reused_page_paths)
@@ -19,6 +19,16 @@ class ImageJpegRenderer(renderers.BaseRenderer):
         return data
 
 
+class ImageRenderer(renderers.BaseRenderer):
+    """Any image format (response sets actual content type)"""
+    media_type = 'image/*'
+    format = 'image'
+    render_style = 'binary'
+
+    def render(self, data, media_type=None, renderer_context=None):
+        return data
+
+
 class ImageSVGRenderer(renderers.BaseRenderer):
     media_type = 'image/svg+xml'
     format = 'svg'
@@ -33,3 +43,17 @@ class PDFRenderer(renderers.BaseRenderer):
 
     def render(self, data, media_type=None, renderer_context=None):
         return data
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Newline delimited JSON i.e. one JSON document per line. Views stream
+    the response themselves, renderer is used for content negotiation.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, media_type=None, renderer_context=None):
+        return data
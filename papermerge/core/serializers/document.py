@@ -8,6 +8,7 @@ from papermerge.core.models import Folder
 from papermerge.core.models import Document
 
 from .document_version import DocumentVersionSerializer
+from .mixins import BreadcrumbMixin
 from .tag import ColoredTagListSerializerField
 
 
@@ -22,7 +23,7 @@ class CurrentUserDefaultLang:
         return user.preferences['ocr__language']
 
 
-class DocumentSerializer(serializers.ModelSerializer):
+class DocumentSerializer(BreadcrumbMixin, serializers.ModelSerializer):
     size = serializers.IntegerField(required=False)
     page_count = serializers.IntegerField(required=False)
     parent = ResourceRelatedField(queryset=Folder.objects)
@@ -72,7 +73,7 @@ class DocumentSerializer(serializers.ModelSerializer):
     def get_breadcrumb(self, obj: Document) -> str:
         titles = [
             item.title
-            for item in obj.get_ancestors()
+            for item in self.get_ancestors(obj)
         ]
         return '/'.join(titles)
 
@@ -6,6 +6,7 @@ from rest_framework_json_api.relations import ResourceRelatedField
 from rest_framework_json_api.utils import get_resource_type_from_instance
 
 from papermerge.core.models import Folder
+from .mixins import BreadcrumbMixin
 from .tag import ColoredTagListSerializerField
 
 
@@ -32,7 +33,7 @@ class NodeRelatedField(ResourceRelatedField):
         ])
 
 
-class FolderSerializer(serializers.ModelSerializer):
+class FolderSerializer(BreadcrumbMixin, serializers.ModelSerializer):
 
     parent = ResourceRelatedField(queryset=Folder.objects)
     tags = ColoredTagListSerializerField(required=False)
@@ -58,7 +59,7 @@ class FolderSerializer(serializers.ModelSerializer):
         ]
 
     def get_breadcrumb(self, obj):
-        return [(item.title, item.id) for item in obj.get_ancestors()]
+        return [(item.title, item.id) for item in self.get_ancestors(obj)]
 
     def to_representation(self, instance):
         result = super().to_representation(instance)
@@ -0,0 +1,27 @@
+from papermerge.core.models import BaseTreeNode
+
+# serializer context key of the per-parent ancestors cache
+ANCESTORS_CACHE = 'ancestors_cache'
+
+
+class BreadcrumbMixin:
+    """
+    Looks up ancestors of the node (for its breadcrumb).
+
+    Ancestors of the parent are retrieved only once per parent and cached
+    in serializer context, thus listing of N children of the same folder
+    performs one query instead of N.
+    """
+
+    def get_ancestors(self, obj: BaseTreeNode) -> list:
+        if not obj.parent_id:
+            return list(obj.get_ancestors())
+
+        cache = self.context.setdefault(ANCESTORS_CACHE, {})
+        if obj.parent_id not in cache:
+            # (materialized path of the node lists all its ancestors)
+            cache[obj.parent_id] = list(
+                obj.get_ancestors(include_self=False)
+            )
+
+        return cache[obj.parent_id] + [obj]
@@ -17,6 +17,9 @@ ONLY_ORIGINAL = 'only_original'
 ONLY_LAST = 'only_last'
 ZIP = 'zip'
 TARGZ = 'targz'
+# nodes download modes
+SYNC = 'sync'
+ASYNC = 'async'
 
 
 class NodeSerializer(serializers.PolymorphicModelSerializer):
@@ -98,6 +101,24 @@ class NodesDownloadSerializer(rest_serializers.Serializer):
         ),
         default=ZIP
     )
+    # 'sync' - file is sent in response to the request
+    # 'async' - file is built by the worker, response contains
+    # only download's ID
+    mode = rest_serializers.ChoiceField(
+        choices=(
+            (SYNC, 'Synchronous'),
+            (ASYNC, 'Asynchronous')
+        ),
+        default=SYNC
+    )
+
+
+class NodesDownloadJobSerializer(rest_serializers.Serializer):
+    download_id = rest_serializers.UUIDField()
+    # one of 'pending', 'ready', 'failed'
+    status = rest_serializers.CharField()
+    # signed, expiring URL of the built file (when ready)
+    url = rest_serializers.CharField(required=False)
 
 
 class InboxCountSerializer(rest_serializers.Serializer):
@@ -8,6 +8,14 @@ Arguments:
 """
 node_post_move = Signal()
 
+"""
+Sent after multiple nodes were moved (in bulk) to the same new parent.
+Arguments:
+    node_ids - list of IDs of the moved nodes
+    new_parent - model instance of new parent of the nodes
+"""
+nodes_post_move = Signal()
+
 """
 Sent immediately after document upload complete.
 Arguments:
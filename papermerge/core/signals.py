@@ -1,4 +1,5 @@
 import logging
+import threading
 
 from kombu.exceptions import OperationalError
 from channels.layers import get_channel_layer
@@ -15,6 +16,7 @@ from celery.signals import (
     worker_shutdown
 )
 
+from django.db import transaction
 from django.dispatch import receiver
 from django.conf import settings
 from papermerge.core.models import (
@@ -25,6 +27,7 @@ from papermerge.core.models import (
 from papermerge.core.storage import get_storage_instance
 from .tasks import delete_user_data as delete_user_data_task
 from .tasks import (
+    delete_documents_data,
     ocr_document_task,
     post_ocr_document_task,
     generate_page_previews_task
@@ -37,32 +40,61 @@ logger = logging.getLogger(__name__)
 # Tasks that need to notify websocket clients
 MONITORED_TASKS = (
     'papermerge.core.tasks.ocr_document_task',
+    'papermerge.core.tasks.ocr_stitch_page_ranges_task',
+    'papermerge.core.tasks.build_nodes_download_task',
 )
 
+# Tasks which notify (websocket) group of another task
+TASK_GROUPS = {
+    # last task of document's OCR split into page ranges
+    'ocr_stitch_page_ranges_task': 'ocr_document_task',
+}
+
 HEARTBEAT_FILE = Path("/tmp/worker_heartbeat")
 READINESS_FILE = Path("/tmp/worker_ready")
 
+# documents (per thread) which files are waiting to be deleted
+_deleted_documents = threading.local()
+
 
 @receiver(pre_delete, sender=Document)
 def delete_files(sender, instance: Document, **kwargs):
     """
-    Deletes physical (e.g. pdf) file associated
+    Schedules deletion of physical (e.g. pdf) file associated
     with given (Document) instance.
 
     More exactly it will delete whatever it is inside
     associated folder in which original file was saved
     (e.g. all preview images).
+
+    Files are not deleted right away: all documents deleted within
+    current transaction are handed, as one batch, to
+    ``delete_documents_data`` task once the transaction commits.
     """
-    for document_version in instance.versions.all():
-        try:
-            get_storage_instance().delete_doc(
-                document_version.document_path
-            )
-        except IOError as error:
-            logger.error(
-                f"Error deleting associated file for document.pk={instance.pk}"
-                f" {error}"
-            )
+    if not hasattr(_deleted_documents, 'pending'):
+        _deleted_documents.pending = []
+
+    _deleted_documents.pending.append(
+        [str(instance.user_id), str(instance.pk)]
+    )
+
+    # Registered on each call, as Django discards callbacks of rolled
+    # back transaction (or savepoint); documents queued within it are
+    # sent with the next commit and skipped by the task, as they still
+    # exist. Once the batch is sent, remaining ``flush_delete_files``
+    # calls of the transaction are no-ops.
+    transaction.on_commit(flush_delete_files)
+
+
+def flush_delete_files():
+    """Sends all documents scheduled for files deletion to the worker"""
+    documents = getattr(_deleted_documents, 'pending', [])
+    _deleted_documents.pending = []
+
+    if len(documents) == 0:
+        return
+
+    delete_documents_data.apply_async(kwargs={'documents': documents})
 
 
 @receiver(post_delete, sender=User)
@@ -85,10 +117,17 @@ def user_init(sender, instance, created, **kwargs):
 
 def get_channel_data(task_name, type):
 
-    if task_name == 'papermerge.core.tasks.ocr_document_task':
+    if task_name in (
+        'papermerge.core.tasks.ocr_document_task',
+        'papermerge.core.tasks.ocr_stitch_page_ranges_task',
+    ):
         return {
             'type': f"ocrdocumenttask.{type}"
         }
+    elif task_name == 'papermerge.core.tasks.build_nodes_download_task':
+        return {
+            'type': f"nodesdownloadtask.{type}"
+        }
     else:
         raise ValueError(f"Task name not in {MONITORED_TASKS}")
 
@@ -102,14 +141,15 @@ def channel_group_notify(task_name, task_kwargs, type):
 
     channel_data.update(task_kwargs)
     task_short_name = task_name.split('.')[-1]
+    group_name = TASK_GROUPS.get(task_short_name, task_short_name)
 
     logger.debug(
-        f"channel_group_notify {task_short_name} {channel_data}"
+        f"channel_group_notify {group_name} {channel_data}"
     )
     async_to_sync(
         channel_layer.group_send
     )(
-        task_short_name, channel_data
+        group_name, channel_data
     )
 
 
@@ -141,6 +181,10 @@ def channel_group_notify_task_postrun(sender=None, **kwargs):
     if sender:
         if sender.name in MONITORED_TASKS:
             state = kwargs['state']
+            if state == 'IGNORED':
+                # task was replaced by other task(s) e.g. OCR of document
+                # split into page ranges; they will report the outcome
+                return
             if state == 'SUCCESS':
                 type = 'tasksucceeded'
             else:
@@ -1,4 +1,8 @@
 import logging
+import os
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.utils.module_loading import import_string
 from django.conf import settings as django_settings
 
@@ -7,6 +11,16 @@ from .app_settings import settings
 
 logger = logging.getLogger(__name__)
 
+# settings which storage instance is built from
+STORAGE_SETTINGS = (
+    'MEDIA_ROOT',
+    'PAPERMERGE_DEFAULT_FILE_STORAGE',
+    'PAPERMERGE_FILE_STORAGE_KWARGS',
+)
+
+# process id => storage instance
+_storage_instances = {}
+
 
 def get_storage_class(import_path=None):
     return import_string(
@@ -15,17 +29,67 @@ def get_storage_class(import_path=None):
 
 
 def get_storage_instance():
+    """
+    Returns storage instance configured with
+    ``PAPERMERGE_DEFAULT_FILE_STORAGE`` and ``PAPERMERGE_FILE_STORAGE_KWARGS``.
+
+    Instance is built once per process and reused by subsequent calls.
+    Cache is keyed by process id, thus forked processes (e.g. uwsgi or
+    celery prefork workers) never share (lazily opened connections of) the
+    parent's instance; it is also reset when storage related settings
+    change (e.g. ``override_settings`` in tests).
+    """
+    pid = os.getpid()
+    storage_instance = _storage_instances.get(pid)
+
+    if storage_instance is None:
+        storage_instance = _build_storage_instance()
+        _storage_instances.clear()
+        _storage_instances[pid] = storage_instance
+
+    return storage_instance
+
+
+def _build_storage_instance():
     storage_klass = get_storage_class()
-    storage_kwargs = settings.FILE_STORAGE_KWARGS or {}
+    storage_kwargs = dict(settings.FILE_STORAGE_KWARGS or {})
     storage_kwargs['location'] = django_settings.MEDIA_ROOT
 
     return storage_klass(**storage_kwargs)
 
 
-def abs_path(some_relative_path):
+def reset_storage_instance():
+    """
+    Drops cached storage instance; next ``get_storage_instance`` call
+    will build a new one
+    """
+    _storage_instances.clear()
+
+
+@receiver(setting_changed)
+def reset_storage_instance_on_setting_changed(setting, **kwargs):
+    if setting in STORAGE_SETTINGS:
+        reset_storage_instance()
+
+
+def abs_path(some_relative_path, download=True):
+    """
+    Returns absolute path of given relative path; pass ``download=False``
+    for files which are about to be written (see ``Storage.abspath``)
+    """
     storage_instance = get_storage_instance()
 
-    return storage_instance.abspath(some_relative_path)
+    return storage_instance.abspath(some_relative_path, download=download)
+
+
+def abs_paths(relative_paths):
+    """
+    Returns list of absolute paths of given relative paths
+    (vectorized ``abs_path``)
+    """
+    abspath = get_storage_instance().abspath
+
+    return [abspath(relative_path) for relative_path in relative_paths]
 
 
 # TODO: remove this code
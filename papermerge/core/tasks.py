@@ -1,12 +1,30 @@
 import io
 import os
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from django.core.cache import cache
 from django.utils.translation import gettext_lazy as _
 
-from celery import shared_task
-from papermerge.core.ocr.document import ocr_document
-from papermerge.core.storage import abs_path, get_storage_instance
+from celery import chord, shared_task
+from papermerge.core.app_settings import settings
+from papermerge.core.lib.path import DocumentPath, DownloadPath, PagePath
+from papermerge.core.nodes_download import get_nodes_download
+from papermerge.core.lib import mime
+from papermerge.core.ocr.document import (
+    get_page_ranges,
+    ocr_document,
+    ocr_document_incremental,
+    ocr_page_range,
+    stitch_page_ranges
+)
+from papermerge.core.serializers.node import ONLY_LAST, ZIP
+from papermerge.core.storage import (
+    abs_path,
+    abs_paths,
+    get_storage_instance
+)
 
 from .models import (
     Document,
@@ -17,6 +35,26 @@ from .models import (
 
 logger = logging.getLogger(__name__)
 
+# max number of page text sidecars read (i.e. opened) at once
+SIDECARS_BATCH_SIZE = 64
+# number of threads reading page text sidecars
+SIDECARS_READ_WORKERS = 8
+# seconds after which previews lock expires, if the task holding it
+# never ran (e.g. was lost by the broker)
+PREVIEWS_LOCK_TIMEOUT = 3600
+
+
+def previews_lock_key(document_version_id, page_number=None) -> str:
+    """
+    Returns cache key of the lock held while previews generation of
+    given document version (or only of its page) is scheduled or running
+    """
+    key = f"generate-previews-{document_version_id}"
+    if page_number:
+        key = f"{key}-{page_number}"
+
+    return key
+
 
 @shared_task
 def delete_user_data(user_id):
@@ -26,8 +64,58 @@ def delete_user_data(user_id):
     storage.delete_user_data(user_id=user_id)
 
 
-@shared_task(acks_late=True, reject_on_worker_lost=True)
+@shared_task
+def delete_documents_data(documents):
+    """
+    Delete associated storage data (files, previews, OCR data) of
+    given documents (invoked when documents are deleted)
+
+    ``documents`` is a list of ``[user_id, document_id]`` pairs. Documents
+    which are still present in the database are skipped (i.e. transaction
+    which deleted them was rolled back).
+    """
+    document_ids = [document_id for _, document_id in documents]
+    existing_ids = set(
+        str(pk) for pk in Document.objects.filter(
+            pk__in=document_ids
+        ).values_list('pk', flat=True)
+    )
+    logger.debug(f'Deleting storage data of {len(documents)} documents')
+    storage = get_storage_instance()
+
+    for user_id, document_id in documents:
+        if str(document_id) in existing_ids:
+            continue
+        try:
+            storage.delete_doc(
+                DocumentPath(
+                    user_id=user_id,
+                    document_id=document_id,
+                    file_name=None
+                )
+            )
+        except IOError as error:
+            logger.error(
+                f"Error deleting associated file for document.pk={document_id}"
+                f" {error}"
+            )
+
+
+@shared_task
+def collect_storage_garbage():
+    """
+    Removes storage data which is not referenced anymore (see
+    ``Storage.collect_garbage``). Deletes clean up after themselves,
+    thus this task is meant to be scheduled periodically
+    (e.g. with celery beat) as a safety net.
+    """
+    removed = get_storage_instance().collect_garbage()
+    logger.debug(f'Storage garbage collected: {removed} file(s)')
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
 def ocr_document_task(
+    self,
     document_id,
     lang,
     user_id,  # UUID of the user who initiated OCR of the document
@@ -37,7 +125,7 @@ def ocr_document_task(
     OCRs the document.
 
     On success returns ``document_id``
-    If something went wrong returns ``None``.
+    If something went wrong, or there was nothing to OCR, returns ``None``.
 
     Returning ``document_id`` on success crucial, as ``ocr_document_task``
     is chained with other celery tasks which will receive as
@@ -48,10 +136,63 @@ def ocr_document_task(
     However, if the worker process is killed the task is still acknowledged even
     if it wasn't completed. `reject_on_worker_lost` will re-queue the message
     if the above event happens so you won't lose the task.
+
+    PDF documents with more than ``PAPERMERGE_OCR_PAGES_PER_CHUNK`` pages
+    are split into page ranges: this task is replaced by a chord of
+    ``ocr_page_range_task`` tasks (one per page range) followed by
+    ``ocr_stitch_page_ranges_task``, which returns ``document_id``.
+
+    With ``PAPERMERGE_OCR_INCREMENTAL`` on, only PDF document's pages which
+    were not OCRed yet are OCRed (see ``get_ocred_page_numbers``); if all
+    pages were already OCRed, no new document version is created.
     """
     doc = Document.objects.get(pk=document_id)
     user_id = doc.user.id
     doc_version = doc.versions.last()
+    pages_per_chunk = settings.OCR_PAGES_PER_CHUNK
+    is_pdf = mime.Mime(abs_path(doc_version.document_path.url)).is_pdf()
+
+    if settings.OCR_INCREMENTAL and is_pdf:
+        ocred_page_numbers = get_ocred_page_numbers(doc_version, lang)
+        if len(ocred_page_numbers) == doc_version.page_count:
+            logger.debug(
+                'ocr_document_task: all pages are already OCRed '
+                f'document_id={document_id} namespace={namespace} '
+                f'lang={lang}'
+            )
+            # no new document version is created
+            return None
+        if ocred_page_numbers:
+            ocr_document_incremental(
+                user_id=user_id,
+                document_id=document_id,
+                file_name=doc_version.file_name,
+                lang=lang,
+                version=doc_version.number,
+                target_version=doc_version.number + 1,
+                page_numbers=[
+                    number
+                    for number in range(1, doc_version.page_count + 1)
+                    if number not in ocred_page_numbers
+                ]
+            )
+            logger.debug(
+                'ocr_document_task: incremental ocr complete'
+                f'document_id={document_id} namespace={namespace} '
+                f'lang={lang} reused_pages={len(ocred_page_numbers)}'
+            )
+            return document_id
+
+    if pages_per_chunk and doc_version.page_count > pages_per_chunk:
+        if is_pdf:
+            return self.replace(
+                _ocr_page_ranges_chord(
+                    doc_version,
+                    lang=lang,
+                    namespace=namespace,
+                    pages_per_chunk=pages_per_chunk
+                )
+            )
 
     logger.debug(
         'ocr_document_task: ocr start'
@@ -84,16 +225,146 @@ def ocr_document_task(
     return document_id
 
 
+def get_ocred_page_numbers(doc_version, lang):
+    """
+    Returns set of page numbers of the document version which were
+    already OCRed with given language i.e. pages with non empty text
+    whose txt, hocr and svg sidecars are present in the storage
+    """
+    pages = doc_version.pages.filter(lang__iexact=lang).exclude(text='')
+    result = set()
+    if not pages.exists():
+        return result
+
+    # one listing of all sidecars instead of three lookups per page
+    # (i.e. three requests per page with object storage)
+    files = get_storage_instance().list_files(
+        doc_version.document_path.dirname_sidecars()
+    )
+
+    for page in pages.only('number', 'text'):
+        if not page.stripped_text:
+            continue
+        page_path = PagePath(
+            document_path=doc_version.document_path,
+            page_num=page.number
+        )
+        sidecars = (page_path.txt_url, page_path.hocr_url, page_path.svg_url)
+        if all(os.path.normpath(url) in files for url in sidecars):
+            result.add(page.number)
+
+    return result
+
+
+def _ocr_page_ranges_chord(doc_version, lang, namespace, pages_per_chunk):
+    page_ranges = get_page_ranges(doc_version.page_count, pages_per_chunk)
+    document = doc_version.document
+    ocr_kwargs = dict(
+        user_id=str(document.user_id),
+        document_id=str(document.id),
+        file_name=doc_version.file_name,
+        lang=lang,
+        version=doc_version.number,
+        target_version=doc_version.number + 1
+    )
+    header = [
+        ocr_page_range_task.si(
+            first_page=first_page,
+            last_page=last_page,
+            **ocr_kwargs
+        )
+        for first_page, last_page in page_ranges
+    ]
+    body = ocr_stitch_page_ranges_task.si(
+        page_ranges=page_ranges,
+        namespace=namespace,
+        **ocr_kwargs
+    )
+
+    return chord(header, body)
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def ocr_page_range_task(
+    user_id,
+    document_id,
+    file_name,
+    lang,
+    version,
+    target_version,
+    first_page,
+    last_page
+):
+    """
+    OCRs pages ``first_page``..``last_page`` of the document version.
+
+    Page ranges OCRed by previous (failed) run of the chord are not
+    OCRed again (see ``ocr_page_range``).
+    """
+    ocr_page_range(
+        user_id=user_id,
+        document_id=document_id,
+        file_name=file_name,
+        lang=lang,
+        version=version,
+        target_version=target_version,
+        first_page=first_page,
+        last_page=last_page
+    )
+
+    return [first_page, last_page]
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def ocr_stitch_page_ranges_task(
+    user_id,
+    document_id,
+    file_name,
+    lang,
+    version,
+    target_version,
+    page_ranges,
+    namespace=None
+):
+    """
+    Joins OCRed page ranges into OCRed document version.
+
+    Returns ``document_id`` - exactly as ``ocr_document_task`` does - so that
+    tasks linked to ``ocr_document_task`` run once whole document is OCRed.
+    """
+    stitch_page_ranges(
+        user_id=user_id,
+        document_id=document_id,
+        file_name=file_name,
+        lang=lang,
+        version=version,
+        target_version=target_version,
+        page_ranges=page_ranges
+    )
+
+    logger.debug(
+        'ocr_stitch_page_ranges_task: successfully complete'
+        f'document_id={document_id} namespace={namespace} '
+        f'lang={lang}'
+    )
+
+    return document_id
+
+
 @shared_task
 def post_ocr_document_task(document_id, namespace=None):
     """
     Task to run immediately after document OCR is complete
 
     This task guarantees that `increment_document_version` will run
-    before `update_document_pages`.
+    before `update_document_pages`. It does nothing if `document_id` is
+    None i.e. if OCR did not produce new document version.
     """
     logger.debug(f'post_ocr_task_task doc_id={document_id}')
 
+    if document_id is None:
+        return None
+
     increment_document_version(document_id, namespace)
     update_document_pages(document_id, namespace)
 
@@ -107,17 +378,151 @@ def post_ocr_document_task(document_id, namespace=None):
 
 
 @shared_task
-def generate_page_previews_task(document_version_id):
-    document_version = DocumentVersion.objects.get(id=document_version_id)
+def generate_page_previews_task(document_version_id, page_number=None):
+    """
+    Generates previews of all pages of given document version (or only
+    of its ``page_number`` page). Releases the lock taken when the task
+    was scheduled (see ``previews_lock_key``).
+    """
+    try:
+        document_version = DocumentVersion.objects.get(
+            id=document_version_id
+        )
 
-    doc = document_version.document
-    logger.debug(f"Generating previews doc_id={doc.id}")
+        doc = document_version.document
+        logger.debug(f"Generating previews doc_id={doc.id}")
 
-    document_version.generate_previews()
+        document_version.generate_previews(page_number=page_number)
+    finally:
+        cache.delete(previews_lock_key(document_version_id, page_number))
 
     return document_version_id
 
 
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def build_nodes_download_task(
+    download_id,
+    user_id,
+    node_ids,
+    file_name=None,
+    include_version=ONLY_LAST,
+    archive_type=ZIP
+):
+    """
+    Builds downloadable file (archive or document file) of given nodes
+    into the storage i.e. asynchronous version of ``GET /nodes/download/``.
+
+    Progress is reported to websocket clients via channels
+    (``nodesdownloadtask.taskprogress`` events). Built file is available
+    for ``PAPERMERGE_DOWNLOAD_URL_EXPIRES`` seconds, after which it
+    is deleted. If building fails, failure marker is stored instead (see
+    ``DownloadPath.failed_url``), so that the job is reported as failed.
+    """
+    try:
+        _build_nodes_download(
+            download_id=download_id,
+            user_id=user_id,
+            node_ids=node_ids,
+            file_name=file_name,
+            include_version=include_version,
+            archive_type=archive_type
+        )
+    except Exception:
+        logger.exception(f"Building download {download_id} failed")
+        failed_path = DownloadPath(
+            user_id=user_id,
+            download_id=download_id,
+            file_name=''
+        )
+        failed_file_path = abs_path(failed_path.failed_url, download=False)
+        os.makedirs(os.path.dirname(failed_file_path), exist_ok=True)
+        open(failed_file_path, 'w').close()
+        get_storage_instance().upload(failed_path.failed_url)
+        raise
+    finally:
+        delete_nodes_download_task.apply_async(
+            kwargs={
+                'user_id': user_id,
+                'download_id': download_id
+            },
+            countdown=settings.DOWNLOAD_URL_EXPIRES
+        )
+
+    return download_id
+
+
+def _build_nodes_download(
+    download_id,
+    user_id,
+    node_ids,
+    file_name,
+    include_version,
+    archive_type
+):
+    """Builds the download of ``build_nodes_download_task``"""
+    # imported here to avoid circular import (signals module imports tasks)
+    from papermerge.core.signals import channel_group_notify
+
+    nodes_download = get_nodes_download(
+        node_ids=node_ids,
+        file_name=file_name,
+        include_version=include_version,
+        archive_type=archive_type
+    )
+    download_path = DownloadPath(
+        user_id=user_id,
+        download_id=download_id,
+        file_name=nodes_download.file_name
+    )
+
+    def on_progress(processed, total):
+        # at most ~100 notifications per download
+        if processed != total and processed % max(1, total // 100) != 0:
+            return
+        try:
+            channel_group_notify(
+                task_name='papermerge.core.tasks.build_nodes_download_task',
+                task_kwargs={
+                    'download_id': download_id,
+                    'user_id': user_id,
+                    'processed': processed,
+                    'total': total
+                },
+                type='taskprogress'
+            )
+        except Exception as exc:
+            # failed notification should not fail the download
+            logger.warning(f"Download progress not sent: {exc}")
+
+    logger.debug(f'Building download {download_path}')
+    part_file_path = abs_path(download_path.part_url, download=False)
+    os.makedirs(os.path.dirname(part_file_path), exist_ok=True)
+
+    with open(part_file_path, 'wb') as file_handle:
+        for chunk in nodes_download.stream(on_progress=on_progress):
+            file_handle.write(chunk)
+
+    # file is visible under its final name only when complete
+    os.replace(
+        part_file_path,
+        abs_path(download_path.url, download=False)
+    )
+    # web nodes don't necessarily share worker's disk
+    get_storage_instance().upload(download_path.url)
+
+
+@shared_task
+def delete_nodes_download_task(user_id, download_id):
+    """Deletes (expired) file built by ``build_nodes_download_task``"""
+    download_path = DownloadPath(
+        user_id=user_id,
+        download_id=download_id,
+        file_name=''
+    )
+    logger.debug(f'Deleting download {download_path}')
+    get_storage_instance().delete_dir(download_path.dirname)
+
+
 def increment_document_version(document_id, namespace=None):
     logger.debug(
         'increment_document_version: '
@@ -145,13 +550,7 @@ def increment_document_version(document_id, namespace=None):
         f'lang={lang}'
     )
 
-    for page_number in range(1, new_doc_version.page_count + 1):
-        Page.objects.create(
-            document_version=new_doc_version,
-            number=page_number,
-            page_count=new_doc_version.page_count,
-            lang=lang
-        )
+    new_doc_version.create_pages()
 
 
 def update_document_pages(document_id, namespace=None):
@@ -177,16 +576,46 @@ def update_document_pages(document_id, namespace=None):
 
     doc = Document.objects.get(pk=document_id)
     doc_version = doc.versions.last()
-    streams = []
+    paths = abs_paths(
+        page.txt_url for page in doc_version.pages.order_by('number')
+    )
+
+    started_at = time.perf_counter()
+    doc_version.update_text_field(read_text_sidecars(paths))
+    elapsed = time.perf_counter() - started_at
+
+    logger.info(
+        f'update_document_pages: ingested {len(paths)} page text(s) '
+        f'of document_id={document_id} in {elapsed:0.3f}s'
+    )
 
-    for page in doc_version.pages.order_by('number'):
-        url = abs_path(page.txt_url)
-        if os.path.exists(url):
-            streams.append(open(url))
-        else:
-            streams.append(io.StringIO(''))
 
-    doc_version.update_text_field(streams)
+def read_text_sidecar(path: str) -> str:
+    """
+    Returns content of given page text sidecar file or empty string
+    if file does not exist (e.g. no OCR was performed yet)
+    """
+    try:
+        with open(path) as file_handle:
+            return file_handle.read()
+    except FileNotFoundError:
+        return ''
+
+
+def read_text_sidecars(paths):
+    """
+    Yields, in order, an IO text stream with the content of each
+    of given page text sidecar files.
+
+    Files are read by a pool of ``SIDECARS_READ_WORKERS`` threads in batches
+    of ``SIDECARS_BATCH_SIZE``; each file is closed right after it
+    was read, thus at most one batch of files is open at once.
+    """
+    with ThreadPoolExecutor(max_workers=SIDECARS_READ_WORKERS) as executor:
+        for index in range(0, len(paths), SIDECARS_BATCH_SIZE):
+            batch = paths[index:index + SIDECARS_BATCH_SIZE]
+            for text in executor.map(read_text_sidecar, batch):
+                yield io.StringIO(text)
 
 
 def norm_pages_from_doc(document):
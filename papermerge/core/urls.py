@@ -68,6 +68,16 @@ urlpatterns = [
         'nodes/inboxcount/', views.InboxCountView.as_view(), name='inboxcount'
     ),
     path('nodes/download/', views.NodesDownloadView.as_view()),
+    path(
+        'nodes/download/<uuid:pk>/',
+        views.NodesDownloadJobView.as_view(),
+        name='nodes-download-job'
+    ),
+    path(
+        'nodes/download/file/<str:token>/',
+        views.NodesDownloadFileView.as_view(),
+        name='nodes-download-file'
+    ),
     path(
         'nodes/<uuid:pk>/tags/',
         views.NodeTagsView.as_view(),
@@ -99,6 +109,11 @@ urlpatterns = [
         views.PageView.as_view(),
         name='pages_page'
     ),
+    path(
+        'pages/<uuid:pk>/thumbnail/',
+        views.PageThumbnailView.as_view(),
+        name='pages_page_thumbnail'
+    ),
     path('content-types/<int:pk>/', views.ContentTypeRetrieve.as_view()),
     path(
         'permissions/',
@@ -11,6 +11,8 @@ from .nodes import (
     NodesViewSet,
     NodesMoveView,
     NodesDownloadView,
+    NodesDownloadJobView,
+    NodesDownloadFileView,
     InboxCountView,
     NodeTagsView,
 )
@@ -27,6 +29,7 @@ from .documents import DocumentDetailsViewSet
 from .folders import FoldersViewSet
 from .pages import (
     PageView,
+    PageThumbnailView,
     PagesView,
     PagesReorderView,
     PagesRotateView,
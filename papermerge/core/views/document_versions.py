@@ -15,6 +15,7 @@ from papermerge.core.serializers import (
 )
 from papermerge.core.renderers import PDFRenderer
 from .mixins import RequireAuthMixin
+from .utils import sendfile_response
 
 
 class DocumentVersionsDownloadView(RequireAuthMixin, GenericAPIView):
@@ -28,6 +29,14 @@ class DocumentVersionsDownloadView(RequireAuthMixin, GenericAPIView):
         file_abs_path = doc_ver.abs_file_path()
 
         mime_type = magic.from_file(file_abs_path, mime=True)
+        response = sendfile_response(
+            doc_ver.document_path.url,
+            content_type=mime_type,
+            file_name=doc_ver.document.title
+        )
+        if response:
+            return response
+
         try:
             file_handle = open(file_abs_path, "rb")
         except OSError:
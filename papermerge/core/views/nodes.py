@@ -1,12 +1,16 @@
 import logging
+import mimetypes
+import uuid
 
 from collections import OrderedDict
 
 from django.http import (
     Http404,
-    HttpResponse
+    StreamingHttpResponse
 )
+from django.core import signing
 from django.db.models.signals import post_save
+from django.urls import reverse
 from django.utils import encoding
 from rest_framework.generics import (
     GenericAPIView,
@@ -34,7 +38,11 @@ from drf_spectacular.utils import (
     OpenApiTypes
 )
 
-from papermerge.core.serializers.node import Data_NodeSerializer
+from papermerge.core.serializers.node import (
+    ASYNC,
+    Data_NodeSerializer,
+    NodesDownloadJobSerializer
+)
 from papermerge.core.serializers import (
     NodeSerializer,
     NodeMoveSerializer,
@@ -47,14 +55,29 @@ from papermerge.core.models import (
     BaseTreeNode,
     Document,
 )
-from papermerge.core.models.node import move_node
+from papermerge.core.models.node import move_nodes
+from papermerge.core.exceptions import APIBadRequest
 
-from papermerge.core.nodes_download import get_nodes_download
+from papermerge.core.nodes_download import (
+    get_nodes_download,
+    NodesDownloadDocument
+)
+from papermerge.core.app_settings import settings
+from papermerge.core.lib.path import DownloadPath
+from papermerge.core.storage import get_storage_instance
+from papermerge.core.tasks import build_nodes_download_task
+from papermerge.core.views.utils import (
+    ranged_file_response,
+    sendfile_response
+)
 
 from .mixins import RequireAuthMixin, GetClassSerializerMixin
 
 logger = logging.getLogger(__name__)
 
+# salt of signed nodes download URLs
+DOWNLOAD_SIGNING_SALT = 'papermerge.core.nodes-download'
+
 
 PER_PAGE = 30
 
@@ -139,7 +162,9 @@ class NodesViewSet(RequireAuthMixin, ModelViewSet):
         }
     )
     def retrieve(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
+        queryset = self.filter_queryset(
+            self.get_queryset()
+        ).with_listing_data()
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -246,13 +271,14 @@ class NodesMoveView(RequireAuthMixin, GenericAPIView):
             logger.error(exc, exc_info=True)
             return
 
-        for node in nodes:
-            try:
-                node_model = BaseTreeNode.objects.get(pk=node['id'])
-            except BaseTreeNode.DoesNotExist as exc:
-                logger.error(exc, exc_info=True)
-
-            move_node(node_model, target_model)
+        try:
+            move_nodes(
+                node_ids=[node['id'] for node in nodes],
+                target_node=target_model,
+                user=self.request.user
+            )
+        except ValueError as exc:
+            raise APIBadRequest(detail=str(exc)) from exc
 
 
 class InboxCountView(RequireAuthMixin, APIView, GetClassSerializerMixin):
@@ -269,6 +295,7 @@ class InboxCountView(RequireAuthMixin, APIView, GetClassSerializerMixin):
 class NodesDownloadView(RequireAuthMixin, GenericAPIView):
     """GET /nodes/download/"""
     parser_classes = [JSONParser]
+    renderer_classes = [JSONRenderer]
     serializer_class = NodesDownloadSerializer
 
     @extend_schema(
@@ -285,13 +312,30 @@ class NodesDownloadView(RequireAuthMixin, GenericAPIView):
     def get(self, request):
         serializer = NodesDownloadSerializer(data=request.query_params)
         if serializer.is_valid():
+            data = dict(serializer.data)
+            data['node_ids'] = self._own_node_ids(data['node_ids'])
+            if len(data['node_ids']) == 0:
+                raise Http404("Nodes do not exist")
+            if data.pop('mode') == ASYNC:
+                return self._enqueue_download(data)
+
             try:
-                nodes_download = get_nodes_download(**serializer.data)
+                nodes_download = get_nodes_download(**data)
             except Document.DoesNotExist as exc:
                 raise Http404 from exc
 
-            response = HttpResponse(
-                nodes_download.get_content(),
+            if isinstance(nodes_download, NodesDownloadDocument):
+                response = sendfile_response(
+                    nodes_download.url,
+                    content_type=nodes_download.content_type,
+                    file_name=nodes_download.file_name
+                )
+                if response:
+                    return response
+
+            # archive is built while it is being sent
+            response = StreamingHttpResponse(
+                nodes_download.stream(),
                 content_type=nodes_download.content_type
             )
             response['Content-Disposition'] = nodes_download.content_disposition
@@ -304,6 +348,40 @@ class NodesDownloadView(RequireAuthMixin, GenericAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    def _own_node_ids(self, node_ids):
+        """
+        Returns IDs (in given order) of the nodes which belong to
+        the current user; IDs of other nodes are dropped
+        """
+        own_ids = {
+            str(pk) for pk in BaseTreeNode.objects.filter(
+                pk__in=node_ids,
+                user=self.request.user
+            ).values_list('pk', flat=True)
+        }
+
+        return [node_id for node_id in node_ids if str(node_id) in own_ids]
+
+    def _enqueue_download(self, data):
+        """
+        Downloadable file is built by the worker. Its state can be
+        checked via ``GET /nodes/download/<download_id>/``
+        """
+        download_id = str(uuid.uuid4())
+        build_nodes_download_task.apply_async(
+            kwargs={
+                'download_id': download_id,
+                'user_id': str(self.request.user.id),
+                **data
+            }
+        )
+
+        return Response(
+            {'download_id': download_id, 'status': 'pending'},
+            content_type='application/json',
+            status=status.HTTP_202_ACCEPTED
+        )
+
     def get_queryset(self):
         # This is workaround warning issued when runnnig
         # `./manage.py generateschema`
@@ -314,6 +392,101 @@ class NodesDownloadView(RequireAuthMixin, GenericAPIView):
         return super().get_queryset()
 
 
+class NodesDownloadJobView(RequireAuthMixin, GenericAPIView):
+    """GET /nodes/download/<download_id>/"""
+    renderer_classes = [JSONRenderer]
+    serializer_class = NodesDownloadJobSerializer
+
+    def get(self, request, pk):
+        download_path = DownloadPath(
+            user_id=str(request.user.id),
+            download_id=str(pk),
+            file_name=''
+        )
+        file_names = [
+            name for name in get_storage_instance().listdir(
+                download_path.dirname
+            )
+            if not name.endswith('.part')
+        ]
+
+        result = {'download_id': str(pk), 'status': 'pending'}
+        if DownloadPath.FAILED_FILE_NAME in file_names:
+            result['status'] = 'failed'
+        elif len(file_names) > 0:
+            token = signing.dumps(
+                {
+                    'user_id': str(request.user.id),
+                    'download_id': str(pk),
+                    'file_name': file_names[0]
+                },
+                salt=DOWNLOAD_SIGNING_SALT
+            )
+            result['status'] = 'ready'
+            result['url'] = request.build_absolute_uri(
+                reverse('nodes-download-file', args=(token,))
+            )
+
+        return Response(NodesDownloadJobSerializer(result).data)
+
+
+class NodesDownloadFileView(APIView):
+    """
+    GET /nodes/download/file/<token>/
+
+    Serves file built by asynchronous nodes download. The URL is signed
+    (i.e. no authentication required) and expires after
+    ``PAPERMERGE_DOWNLOAD_URL_EXPIRES`` seconds. Range requests are
+    supported, so that interrupted downloads can be resumed.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    @extend_schema(
+        operation_id="nodes_download_file",
+        responses={
+            (200, 'application/octet-stream'): OpenApiTypes.BINARY,
+            (206, 'application/octet-stream'): OpenApiTypes.BINARY
+        }
+    )
+    def get(self, request, token):
+        try:
+            data = signing.loads(
+                token,
+                salt=DOWNLOAD_SIGNING_SALT,
+                max_age=settings.DOWNLOAD_URL_EXPIRES
+            )
+        except signing.BadSignature as exc:
+            # expired signature is a bad signature as well
+            raise Http404("Download does not exist or expired") from exc
+
+        download_path = DownloadPath(**data)
+        storage = get_storage_instance()
+        if not storage.exists(download_path.url):
+            raise Http404("Download does not exist or expired")
+
+        content_type, encoding = mimetypes.guess_type(download_path.file_name)
+        if encoding == 'gzip':
+            content_type = 'application/x-gtar'
+        content_type = content_type or 'application/octet-stream'
+
+        # proxy takes care of range requests as well
+        response = sendfile_response(
+            download_path.url,
+            content_type=content_type,
+            file_name=download_path.file_name
+        )
+        if response:
+            return response
+
+        return ranged_file_response(
+            request,
+            url=download_path.url,
+            content_type=content_type,
+            file_name=download_path.file_name
+        )
+
+
 class NodeTagsView(
     RequireAuthMixin,
     CreateAPIView,
@@ -1,7 +1,14 @@
+import hashlib
 import logging
+import os
 from uuid import uuid4
 
-from django.http import Http404
+from kombu.exceptions import OperationalError
+
+from django.core.cache import cache
+from django.http import FileResponse, Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 
 from rest_framework.generics import (
     RetrieveAPIView,
@@ -14,16 +21,25 @@ from rest_framework.response import Response
 from rest_framework_json_api.renderers import JSONRenderer
 from rest_framework.parsers import JSONParser
 
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import extend_schema, OpenApiParameter
 
 from papermerge.core.models import Page, Document, Folder
+from papermerge.core.app_settings import settings
+from papermerge.core.lib.path import AUX_DIR_THUMBNAILS
+from papermerge.core.lib.previews import FULL, JPEG, get_extension
+from papermerge.core.lib.thumbnails import ThumbnailCache
 from papermerge.core.lib.utils import (
     get_reordered_list,
     annotate_page_data
 )
 from papermerge.core.utils import clock
 
-from papermerge.core.storage import get_storage_instance
+from papermerge.core.storage import abs_path, get_storage_instance
+from papermerge.core.tasks import (
+    PREVIEWS_LOCK_TIMEOUT,
+    generate_page_previews_task,
+    previews_lock_key
+)
 from papermerge.core.serializers import (
     PageSerializer,
     PageDeleteSerializer,
@@ -35,6 +51,7 @@ from papermerge.core.serializers import (
 from papermerge.core.renderers import (
     PlainTextRenderer,
     ImageJpegRenderer,
+    ImageRenderer,
     ImageSVGRenderer
 )
 from papermerge.core.exceptions import APIBadRequest
@@ -57,6 +74,7 @@ from .utils import (
     reuse_text_field_multi,
     reorder_pdf_pages,
     rotate_pdf_pages,
+    sendfile_response,
     PageRecycleMap
 )
 from ..models.utils import OCR_STATUS_SUCCEEDED
@@ -73,6 +91,34 @@ def reuse_ocr_data_after_rotate(
     pass
 
 
+def schedule_previews(document_version_id, page_number=None):
+    """
+    Schedules generation of document version's previews (or only of its
+    ``page_number`` page). Nothing is scheduled while the same generation
+    is already scheduled or running i.e. not on every request for missing
+    preview; the task releases the lock once it is done.
+    """
+    version_id = str(document_version_id)
+    lock_key = previews_lock_key(version_id, page_number)
+    if not cache.add(lock_key, 1, timeout=PREVIEWS_LOCK_TIMEOUT):
+        return
+
+    try:
+        if page_number:
+            generate_page_previews_task.delay(
+                version_id,
+                page_number=page_number
+            )
+        else:
+            generate_page_previews_task.delay(version_id)
+    except OperationalError:
+        cache.delete(lock_key)
+        logger.warning(
+            "Operational error while scheduling previews of "
+            f"document version {version_id}"
+        )
+
+
 class PageView(RequireAuthMixin, RetrieveAPIView, DestroyAPIView):
     serializer_class = PageSerializer
     renderer_classes = [
@@ -114,32 +160,37 @@ class PageView(RequireAuthMixin, RetrieveAPIView, DestroyAPIView):
         # as html
         if request.accepted_renderer.format in ('html', 'jpeg', 'jpg'):
             logger.debug(f"Page ID={instance.id} requested as html/jpeg/jpg")
+            # preview tier e.g. ?size=thumbnail
+            tier = request.query_params.get('size', FULL)
+            if tier != FULL and tier not in settings.PREVIEW_SIZES:
+                raise APIBadRequest(detail=f'Unknown preview size {tier}')
             try:
-                jpeg_data = instance.get_jpeg()
+                return self._preview_response(instance, tier)
             except IOError as exc:
                 logger.error(exc)
                 raise Http404("Jpeg image not available")
-            return Response(jpeg_data)
 
         # as svg (which includes embedded jpeg and HOCRed text overlay)
         if request.accepted_renderer.format == 'svg':
             logger.debug(f"Page ID={instance.id} requested svg")
-            content_type = 'image/svg+xml'
+            response = sendfile_response(
+                instance.page_path.svg_url,
+                'image/svg+xml'
+            )
+            if response:
+                return response
             try:
-                data = instance.get_svg()
+                return Response(
+                    instance.get_svg(),
+                    content_type='image/svg+xml'
+                )
             except IOError:
                 # svg not available, try jpeg
                 try:
-                    data = instance.get_jpeg()
-                    content_type = 'image/jpeg'
+                    return self._preview_response(instance, FULL)
                 except IOError as exc:
                     logger.error(exc)
                     raise Http404("Neither JPEG nor SVG image not available")
-            return Response(
-                data,
-                # either image/jpeg or image/svg+xml
-                content_type=content_type
-            )
 
         # by default render page with json serializer
         serializer = self.get_serializer(instance)
@@ -147,6 +198,31 @@ class PageView(RequireAuthMixin, RetrieveAPIView, DestroyAPIView):
 
         return Response(serializer.data)
 
+    def _preview_response(self, page, tier):
+        """
+        Returns response with page's preview. If preview is not generated
+        yet, schedules previews generation (instead of rendering it while
+        client waits) and raises IOError.
+        """
+        try:
+            url, content_type = page.get_preview_url(tier)
+            if url == page.page_path.preview_url:
+                # legacy preview (document has no preview tiers yet)
+                schedule_previews(page.document_version_id)
+            response = sendfile_response(url, content_type)
+            if response:
+                return response
+            preview_path, content_type = page.get_preview(tier)
+        except IOError:
+            # only the missing page is rendered
+            schedule_previews(page.document_version_id, page.number)
+            raise
+
+        with open(preview_path, "rb") as f:
+            data = f.read()
+
+        return Response(data, content_type=content_type)
+
     @extend_schema(operation_id="Single page delete")
     def delete(self, request, *args, **kwargs):
         """
@@ -202,6 +278,107 @@ class PageView(RequireAuthMixin, RetrieveAPIView, DestroyAPIView):
         )
 
 
+class PageThumbnailView(RequireAuthMixin, GenericAPIView):
+    serializer_class = PageSerializer
+    renderer_classes = [ImageRenderer, JSONRenderer]
+
+    def get_queryset(self, *args, **kwargs):
+        if not self.request:
+            return Page.objects.none()
+
+        return Page.objects.filter(
+            document_version__document__user=self.request.user
+        ).select_related('document_version')
+
+    @extend_schema(
+        operation_id="Page thumbnail",
+        parameters=[
+            OpenApiParameter(
+                name='width',
+                type=int,
+                description='Thumbnail width in pixels'
+            )
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        """
+        Returns page's preview resized to given width.
+
+        Resized previews are served from size bounded disk cache. Response
+        carries ETag and Last-Modified headers, thus clients can revalidate
+        cached thumbnail (and get 304 Not Modified).
+        """
+        page = self.get_object()
+        document_version = page.document_version
+        manifest = document_version.previews_manifest()
+        sizes = manifest.get('sizes') or settings.PREVIEW_SIZES
+        width = self._get_width(request, sizes)
+        # smallest preview which is at least as wide as the thumbnail
+        tiers = sorted(sizes.items(), key=lambda item: item[1])
+        tier = next(
+            (name for name, size in tiers if size >= width),
+            tiers[-1][0]
+        )
+
+        try:
+            src_path, content_type = page.get_preview(tier, manifest)
+        except IOError as exc:
+            logger.error(exc)
+            schedule_previews(document_version.id)
+            raise Http404("Thumbnail not available")
+
+        src_stat = os.stat(src_path)
+        digest = hashlib.md5(
+            f"{src_path}:{document_version.number}:{width}:"
+            f"{src_stat.st_mtime_ns}".encode()
+        ).hexdigest()
+        etag = quote_etag(digest)
+        last_modified = int(src_stat.st_mtime)
+
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified
+        )
+        if response is None:
+            # legacy previews (of documents without manifest) are jpegs
+            fmt = manifest.get('format', JPEG)
+            extension = get_extension(fmt)
+            thumbnail_path = ThumbnailCache(
+                location=abs_path(AUX_DIR_THUMBNAILS),
+                max_size=settings.THUMBNAIL_CACHE_MAX_SIZE
+            ).get_or_create(
+                key=f"{page.pk}-{digest}.{extension}",
+                src_path=src_path,
+                width=width,
+                fmt=fmt
+            )
+            response = FileResponse(
+                open(thumbnail_path, 'rb'),
+                content_type=content_type
+            )
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'private, no-cache'
+
+        return response
+
+    def _get_width(self, request, sizes):
+        max_width = max(sizes.values())
+        try:
+            width = int(request.query_params.get('width', max_width))
+        except ValueError:
+            raise APIBadRequest(detail='width must be an integer')
+
+        if not 0 < width <= max_width:
+            raise APIBadRequest(
+                detail=f'width must be between 1 and {max_width}'
+            )
+
+        return width
+
+
 class PagesView(RequireAuthMixin, GenericAPIView):
     serializer_class = PageDeleteSerializer
 
@@ -383,7 +560,8 @@ class PagesRotateView(RequireAuthMixin, GenericAPIView):
             pages_data=annotate_page_data(pages, pages_data, 'angle')
         )
 
-        new_version.generate_previews()
+        # previews of rotated pages are rendered by the worker
+        schedule_previews(new_version.pk)
 
         # page mapping is 1 to 1 as rotation does not
         # add/remove any page
@@ -521,14 +699,13 @@ class PagesMoveToFolderView(RequireAuthMixin, GenericAPIView):
             range(1, pages.count() + 1),
             [page.number for page in pages.order_by('number')]
         )
-        for src_page, dst_page in zip(
-            pages.order_by('number'),
-            dst_version.pages.order_by('number'),
-        ):
-            get_storage_instance().copy_page(
-                src=src_page.page_path,
-                dst=dst_page.page_path
+        get_storage_instance().copy_pages(
+            (src_page.page_path, dst_page.page_path)
+            for src_page, dst_page in zip(
+                pages.order_by('number'),
+                dst_version.pages.order_by('number'),
             )
+        )
         reuse_text_field(
             old_version=first_page.document_version,
             new_version=dst_version,
@@ -1,15 +1,27 @@
 import io
 import os
+import re
 from typing import Optional, Union
+from urllib.parse import quote
 from pikepdf import Pdf
 from collections import abc, namedtuple
 
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.html import escape
 
+from papermerge.core.app_settings import settings
 from papermerge.core.lib.path import PagePath
 from papermerge.core.storage import abs_path, get_storage_instance
 from papermerge.core.models import DocumentVersion
 
+# size (in bytes) of file chunks streamed at once
+FILE_CHUNK_SIZE = 64 * 1024
+# single range of `Range` request header e.g. 'bytes=100-199' or 'bytes=-50'
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+NGINX = 'nginx'
+XSENDFILE = 'xsendfile'
+
 
 def sanitize_kvstore(kvstore_dict):
     """
@@ -195,35 +207,24 @@ def reuse_ocr_data_multi(
         position = 0
 
     storage = get_storage_instance()
-    page_map = [(pos, pos) for pos in range(1, position + 1)]
+    page_paths = []
 
-    if len(page_map) > 0 and dst_old_version is not None:
-        for src_page_number, dst_page_number in page_map:
-            src_page_path = PagePath(
-                document_path=dst_old_version.document_path,
-                page_num=src_page_number
-            )
-            dst_page_path = PagePath(
-                document_path=dst_new_version.document_path,
-                page_num=dst_page_number
+    if dst_old_version is not None:
+        page_paths.extend(
+            _page_paths(
+                dst_old_version,
+                dst_new_version,
+                [(pos, pos) for pos in range(1, position + 1)]
             )
-        storage.copy_page(src=src_page_path, dst=dst_page_path)
+        )
 
     page_map = zip(
         page_numbers,
         [pos for pos in range(position + 1, position + len(page_numbers) + 1)]
     )
-
-    for src_page_number, dst_page_number in page_map:
-        src_page_path = PagePath(
-            document_path=src_old_version.document_path,
-            page_num=src_page_number
-        )
-        dst_page_path = PagePath(
-            document_path=dst_new_version.document_path,
-            page_num=dst_page_number
-        )
-        storage.copy_page(src=src_page_path, dst=dst_page_path)
+    page_paths.extend(
+        _page_paths(src_old_version, dst_new_version, page_map)
+    )
 
     if dst_old_version is not None:
         dst_old_total_pages = dst_old_version.pages.count()
@@ -232,17 +233,28 @@ def reuse_ocr_data_multi(
             dst_old_total_pages + 1
         )
         page_map = [(pos, pos + len(page_numbers)) for pos in _range]
+        page_paths.extend(
+            _page_paths(dst_old_version, dst_new_version, page_map)
+        )
 
-        for src_page_number, dst_page_number in page_map:
-            src_page_path = PagePath(
-                document_path=dst_old_version.document_path,
-                page_num=src_page_number
-            )
-            dst_page_path = PagePath(
-                document_path=dst_new_version.document_path,
-                page_num=dst_page_number
-            )
-            storage.copy_page(src=src_page_path, dst=dst_page_path)
+    storage.copy_pages(page_paths)
+
+
+def _page_paths(src_version, dst_version, page_map):
+    """
+    Returns list of (src, dst) PagePath pairs for given
+    ``(src_page_number, dst_page_number)`` pairs
+    """
+    src_document_path = src_version.document_path
+    dst_document_path = dst_version.document_path
+
+    return [
+        (
+            PagePath(document_path=src_document_path, page_num=src_number),
+            PagePath(document_path=dst_document_path, page_num=dst_number)
+        )
+        for src_number, dst_number in page_map
+    ]
 
 
 def reuse_ocr_data(
@@ -250,21 +262,14 @@ def reuse_ocr_data(
     new_version: DocumentVersion,
     page_map: Union[PageRecycleMap, list]
 ) -> None:
-    storage_instance = get_storage_instance()
-
-    for new_number, old_number in page_map:
-        src_page_path = PagePath(
-            document_path=old_version.document_path,
-            page_num=old_number
-        )
-        dst_page_path = PagePath(
-            document_path=new_version.document_path,
-            page_num=new_number
-        )
-        storage_instance.copy_page(
-            src=src_page_path,
-            dst=dst_page_path
+    get_storage_instance().copy_pages(
+        _page_paths(
+            old_version,
+            new_version,
+            # pairs of (old_number, new_number)
+            [(old_number, new_number) for new_number, old_number in page_map]
         )
+    )
 
 
 def reuse_text_field(
@@ -375,10 +380,11 @@ def remove_pdf_pages(
         _deleted_count += 1
 
     dirname = os.path.dirname(
-        abs_path(new_version.document_path.url)
+        abs_path(new_version.document_path.url, download=False)
     )
     os.makedirs(dirname, exist_ok=True)
-    pdf.save(abs_path(new_version.document_path.url))
+    pdf.save(abs_path(new_version.document_path.url, download=False))
+    get_storage_instance().upload(new_version.document_path.url)
 
 
 def insert_pdf_pages(
@@ -426,12 +432,13 @@ def insert_pdf_pages(
         _inserted_count += 1
 
     dirname = os.path.dirname(
-        abs_path(dst_new_version.document_path.url)
+        abs_path(dst_new_version.document_path.url, download=False)
     )
     os.makedirs(dirname, exist_ok=True)
     dst_old_pdf.save(
-        abs_path(dst_new_version.document_path.url)
+        abs_path(dst_new_version.document_path.url, download=False)
     )
+    get_storage_instance().upload(dst_new_version.document_path.url)
 
 
 def total_merge(
@@ -559,10 +566,11 @@ def reorder_pdf_pages(
         dst.pages.append(page)
 
     dirname = os.path.dirname(
-        abs_path(new_version.document_path.url)
+        abs_path(new_version.document_path.url, download=False)
     )
     os.makedirs(dirname, exist_ok=True)
-    dst.save(abs_path(new_version.document_path.url))
+    dst.save(abs_path(new_version.document_path.url, download=False))
+    get_storage_instance().upload(new_version.document_path.url)
 
 
 def rotate_pdf_pages(
@@ -583,7 +591,100 @@ def rotate_pdf_pages(
         page.rotate(page_data['angle'], relative=True)
 
     dirname = os.path.dirname(
-        abs_path(new_version.document_path.url)
+        abs_path(new_version.document_path.url, download=False)
     )
     os.makedirs(dirname, exist_ok=True)
-    src.save(abs_path(new_version.document_path.url))
+    src.save(abs_path(new_version.document_path.url, download=False))
+    get_storage_instance().upload(new_version.document_path.url)
+
+
+def ranged_file_response(
+    request,
+    url: str,
+    content_type: str,
+    file_name: str
+):
+    """
+    Returns streaming response with content of given file (given by its
+    storage relative ``url``).
+
+    Single range ``Range`` requests are honored (i.e. response is
+    206 Partial Content) so that interrupted downloads can be resumed.
+    Malformed or multiple ranges are ignored and whole file is sent.
+    Only requested range is read from the storage i.e. file kept in
+    object storage is not fetched as whole.
+    """
+    storage = get_storage_instance()
+    size = storage.size(url)
+    start, end = 0, size - 1
+    status = 200
+
+    match = RANGE_RE.match(request.headers.get('Range', '').strip())
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first == '':
+            # suffix range i.e. last N bytes
+            start = max(0, size - int(last))
+        else:
+            start = int(first)
+            if last != '':
+                end = min(int(last), size - 1)
+
+        if start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        status = 206
+
+    response = StreamingHttpResponse(
+        storage.iter_range(url, start, end, chunk_size=FILE_CHUNK_SIZE),
+        status=status,
+        content_type=content_type
+    )
+    response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f"attachment; filename={file_name}"
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    return response
+
+
+def sendfile_response(
+    url: str,
+    content_type: str,
+    file_name: Optional[str] = None
+):
+    """
+    Returns response which delegates sending of the file (given by its
+    storage relative ``url``) to the front proxy (see
+    ``PAPERMERGE_SENDFILE_BACKEND``), thus application worker is not busy
+    while file is transferred.
+
+    Returns None if sendfile backend is not configured; in such case
+    caller is supposed to send the file itself.
+    """
+    backend = settings.SENDFILE_BACKEND
+    if not backend:
+        return None
+
+    # proxy reads the file from MEDIA_ROOT, thus file kept in object
+    # storage has to be fetched first (see ``ranged_file_response``)
+    file_path = abs_path(url)
+    if not os.path.isfile(file_path):
+        return None
+
+    response = HttpResponse(content_type=content_type)
+    if backend == NGINX:
+        prefix = settings.SENDFILE_URL_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = quote(f"{prefix}/{url}")
+    elif backend == XSENDFILE:
+        response['X-Sendfile'] = file_path
+    else:
+        raise ValueError(f"Unknown sendfile backend {backend}")
+
+    if file_name:
+        response['Content-Disposition'] = f"attachment; filename={file_name}"
+
+    return response
@@ -0,0 +1,46 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import JsonWebsocketConsumer
+
+from papermerge.notifications.mixins import RequireAuth
+
+logger = logging.getLogger(__name__)
+
+
+class NodesDownloadConsumer(RequireAuth, JsonWebsocketConsumer):
+    """
+    Notifies users about the state and progress of their asynchronous
+    nodes downloads (i.e. of `build_nodes_download_task`)
+    """
+    group_name = "build_nodes_download_task"
+
+    def disconnect(self, close_code):
+        async_to_sync(
+            self.channel_layer.group_discard
+        )(self.group_name, self.channel_name)
+
+    def nodesdownloadtask_taskreceived(self, event: dict):
+        self._nodes_download_event(event)
+
+    def nodesdownloadtask_taskstarted(self, event: dict):
+        self._nodes_download_event(event)
+
+    def nodesdownloadtask_taskprogress(self, event: dict):
+        self._nodes_download_event(event)
+
+    def nodesdownloadtask_tasksucceeded(self, event: dict):
+        self._nodes_download_event(event)
+
+    def nodesdownloadtask_taskfailed(self, event: dict):
+        self._nodes_download_event(event)
+
+    def _nodes_download_event(self, event):
+        if event['user_id'] != str(self.user.id):
+            # notification is intended only for user who initiated it
+            return
+
+        logger.debug(
+            f"Nodes download event={event} for user_id={self.user.id}"
+        )
+        self.send_json(event)
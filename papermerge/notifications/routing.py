@@ -2,6 +2,7 @@ from django.urls import re_path
 
 from .consumers import document as doc_consumer
 from .consumers import inbox_refresh as inbox_refresh_consumer
+from .consumers import nodes_download as nodes_download_consumer
 from .consumers import DefaultConsumer
 
 websocket_urlpatterns = [
@@ -13,6 +14,10 @@ websocket_urlpatterns = [
         r'ws/nodes/inbox-refresh/$',
         inbox_refresh_consumer.InboxRefreshConsumer.as_asgi()
     ),
+    re_path(
+        r'ws/nodes/download/$',
+        nodes_download_consumer.NodesDownloadConsumer.as_asgi()
+    ),
     re_path(
         r'ws/',
         DefaultConsumer.as_asgi()
@@ -0,0 +1,112 @@
+"""
+Cache of search results.
+
+Results are cached per user, keyed on normalized search parameters and
+on user's index generation i.e. a counter bumped (by the tasks in
+``papermerge.search.tasks``) each time the index of user's nodes
+changes. Results cached under previous generation are never looked up
+again, thus they can't be stale; they just expire.
+
+Index is updated by the workers, thus generations bumped by the workers
+have to be seen by the web processes i.e. Django's cache has to be
+shared between them (e.g. redis, memcached or database cache). With
+process local cache (``LocMemCache``, which is Django's default) results
+are not cached at all.
+"""
+import hashlib
+import json
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from papermerge.core.app_settings import settings
+
+
+GENERATION_KEY_PREFIX = 'papermerge.search.generation'
+RESULTS_KEY_PREFIX = 'papermerge.search.results'
+
+# cache backends not shared between processes
+PROCESS_LOCAL_BACKENDS = (LocMemCache, DummyCache)
+
+
+def is_shared() -> bool:
+    """Returns True if Django's cache is shared between processes"""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], PROCESS_LOCAL_BACKENDS)
+
+
+def is_enabled() -> bool:
+    """
+    Returns True if search results are cached i.e. if caching is
+    not disabled with ``SEARCH_CACHE_TIMEOUT`` and Django's cache is
+    shared between processes
+    """
+    return settings.SEARCH_CACHE_TIMEOUT > 0 and is_shared()
+
+
+def generation_key(user_id=None) -> str:
+    """
+    Cache key of user's index generation (or, without user, of
+    the generation of whole index)
+    """
+    if user_id is None:
+        return GENERATION_KEY_PREFIX
+
+    return f'{GENERATION_KEY_PREFIX}.{user_id}'
+
+
+def get_generation(user_id) -> str:
+    """
+    Returns current index generation of user's nodes
+
+    It is combined with the generation of whole index, which is bumped
+    when the whole index changes (e.g. is cleared).
+    """
+    keys = [generation_key(), generation_key(user_id)]
+    values = cache.get_many(keys)
+
+    for key in keys:
+        if key not in values:
+            # new (or evicted) counter starts at current time, so that
+            # it does not repeat any of its previous values
+            cache.add(key, time.time_ns(), timeout=None)
+            values[key] = cache.get(key, time.time_ns())
+
+    return '.'.join(str(values[key]) for key in keys)
+
+
+def bump_generation(user_ids=None):
+    """
+    Bumps index generation of given users (or, if `user_ids` is None,
+    of whole index) i.e. invalidates their cached search results
+    """
+    if user_ids is None:
+        keys = [generation_key()]
+    else:
+        keys = [generation_key(user_id) for user_id in set(user_ids)]
+
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # counter is not in the cache; it will be started again
+            # (from current time) on next lookup
+            pass
+
+
+def results_key(user_id, generation: str, **params) -> str:
+    """Cache key of search results with given parameters"""
+    digest = hashlib.sha1(
+        json.dumps(params, sort_keys=True).encode()
+    ).hexdigest()
+
+    return f'{RESULTS_KEY_PREFIX}.{user_id}.{generation}.{digest}'
+
+
+def get_results(key: str):
+    return cache.get(key)
+
+
+def set_results(key: str, value):
+    cache.set(key, value, timeout=settings.SEARCH_CACHE_TIMEOUT)
@@ -0,0 +1,76 @@
+import os
+
+from django.core.management import BaseCommand, CommandError
+
+from papermerge.search.cache import bump_generation
+from papermerge.search.reindex import MODEL_PATHS, reindex
+from papermerge.search.tasks import (
+    INDEX_BATCH_SIZE,
+    get_indexes,
+    get_model_class
+)
+
+
+class Command(BaseCommand):
+    help = """
+        Rebuilds search index of folders, documents and pages.
+
+        Instances are indexed in batches, by a pool of worker processes.
+        Progress (throughput and ETA) is reported after each batch.
+
+        Example of usage:
+
+        ./manage.py reindex --clear --workers 8
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models',
+            nargs='*',
+            help="Reindex only given models i.e. folder, document and/or page"
+            " (by default all are reindexed)"
+        )
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            default=INDEX_BATCH_SIZE,
+            help="Number of instances indexed at once"
+        )
+        parser.add_argument(
+            '-w',
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes. With 0, batches are"
+            " indexed in the current process"
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help="Remove given models from the index first"
+        )
+
+    def handle(self, *args, **options):
+        for name in options['models']:
+            if f"core.{name}" not in MODEL_PATHS:
+                raise CommandError(f"Unknown model '{name}'")
+        model_paths = [
+            f"core.{name}" for name in options['models']
+        ] or MODEL_PATHS
+
+        if options['clear']:
+            for model_path in model_paths:
+                model_class = get_model_class(model_path)
+                for current_index, using in get_indexes(model_class):
+                    current_index.clear(using=using)
+            # cached search results of all users are gone with the index
+            bump_generation()
+
+        total = reindex(
+            model_paths,
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            report=self.stdout.write
+        )
+        self.stdout.write(f"Indexed {total} instances")
@@ -0,0 +1,120 @@
+import base64
+import binascii
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(position: int, page_size: int) -> str:
+    return base64.urlsafe_b64encode(
+        f"{position}:{page_size}".encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Returns (position, page size) encoded in the cursor"""
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        position, page_size = [int(item) for item in value.split(':')]
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise NotFound("Invalid cursor")
+
+    if position < 0 or page_size <= 0:
+        raise NotFound("Invalid cursor")
+
+    return position, page_size
+
+
+class SearchCursorPagination(BasePagination):
+    """
+    Cursor pagination of haystack's ``SearchQuerySet``.
+
+    Only the requested slice of results is fetched from the search
+    backend (and thus only results of the visible page are highlighted).
+    Response body is the list of results of current page (same as of
+    unpaginated search), URL of the next page is sent in ``Link`` header::
+
+        Link: <https://.../search/?q=cat&cursor=...>; rel="next"
+
+    Cursor is opaque to the clients; currently it encodes position of the
+    first result of the page (and page size), as haystack does not expose
+    keyset ("search after") paging. Page size is kept for all pages
+    of the cursor, as some backends (e.g. whoosh) slice results only
+    in whole pages.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.set_page(request)
+
+        results = list(
+            queryset[self.position:self.position + self.page_size]
+        )
+        # full page means there might be more results
+        self.has_next = len(results) == self.page_size
+
+        return results
+
+    def set_page(self, request):
+        """Sets position and size of the requested page"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.position = 0
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            self.position, page_size = decode_cursor(cursor)
+            self.page_size = min(page_size, self.max_page_size)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(
+                request.query_params[self.page_size_query_param]
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+        if page_size <= 0:
+            return self.page_size
+
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            encode_cursor(self.position + self.page_size, self.page_size)
+        )
+
+    def get_paginated_response(self, data):
+        headers = {}
+        next_link = self.get_next_link()
+        if next_link:
+            headers['Link'] = f'<{next_link}>; rel="next"'
+
+        return Response(data, headers=headers)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor of the page (see `Link` header)',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results per page',
+                'schema': {'type': 'integer'},
+            },
+        ]
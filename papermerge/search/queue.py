@@ -0,0 +1,194 @@
+import logging
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+from papermerge.core.app_settings import settings
+from papermerge.search.cache import is_shared
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'papermerge.search.pending'
+# seconds a pending mark outlives the debounce window (i.e. how late the
+# worker may start the task before the same identifier is queued again)
+PENDING_MARK_GRACE = 60
+
+
+class IndexUpdateQueue:
+    """
+    Coalescing queue of search index updates.
+
+    One upload/OCR cycle saves same document (and its versions) many times.
+    Instead of enqueuing one index update task per each `post_save`,
+    identifiers are collected here and sent, as one batch, to
+    `papermerge.search.tasks.update_index_coalesced` task when current
+    transaction commits (or immediately, if there is no transaction).
+    Further updates of an identifier which is already queued are coalesced
+    i.e. dropped, because the task will index its latest state anyway.
+
+    The task is delayed by `debounce` seconds. When the batch is sent,
+    each of its identifiers is marked as pending (in Django's cache); until
+    the worker starts the task and removes the marks (see `release`),
+    identifiers committed by any other transaction or process are dropped
+    as well. Marks are set only after commit and removed before the worker
+    reads the database, thus the task always sees dropped changes. As
+    marks have to be seen by all processes, updates are debounced only
+    with a cache shared between web and worker processes.
+    """
+
+    def __init__(self, debounce=None):
+        self._debounce = debounce
+        self._local = threading.local()
+
+    @property
+    def debounce(self) -> int:
+        if self._debounce is None:
+            return settings.INDEX_UPDATE_DEBOUNCE
+
+        return self._debounce
+
+    @property
+    def pending(self) -> dict:
+        """
+        Identifiers not yet sent to the worker (per thread), mapped
+        to their owners
+        """
+        if not hasattr(self._local, 'pending'):
+            self._local.pending = {}
+
+        return self._local.pending
+
+    @property
+    def pending_pages(self) -> dict:
+        """
+        Pending identifiers of the documents whose pages are to be
+        reindexed as well (per thread; dict is used as ordered set)
+        """
+        if not hasattr(self._local, 'pending_pages'):
+            self._local.pending_pages = {}
+
+        return self._local.pending_pages
+
+    def cache_key(self, identifier: str) -> str:
+        return f'{CACHE_KEY_PREFIX}.{identifier}'
+
+    def pages_cache_key(self, identifier: str) -> str:
+        return f'{CACHE_KEY_PREFIX}.pages.{identifier}'
+
+    def add(self, identifier: str, user_id=None, pages=False) -> bool:
+        """
+        Queues index update of given identifier
+
+        `user_id` is the owner of the identifier; it is passed to the worker
+        so that, if the instance is deleted, owner's cached search results
+        are invalidated. With `pages`, index of document's pages is updated
+        as well (i.e. when their text or document's last version changed).
+
+        Returns False if update was coalesced with an already pending one,
+        True otherwise.
+        """
+        pending = self.pending
+        is_new = identifier not in pending
+        if is_new:
+            pending[identifier] = None
+        else:
+            logger.debug(f"Index update of {identifier} coalesced")
+        if user_id is not None:
+            pending[identifier] = str(user_id)
+        if pages:
+            self.pending_pages[identifier] = None
+
+        # Registered on each call, as Django discards callbacks of rolled
+        # back transaction (or savepoint); identifiers queued within it
+        # are sent with the next commit. Once the queue is flushed,
+        # remaining `flush` calls of the transaction are no-ops.
+        transaction.on_commit(self.flush)
+
+        return is_new
+
+    def flush(self):
+        """Sends all pending identifiers to the worker as one task"""
+        pending = self.pending
+        pending_pages = self.pending_pages
+        self._local.pending = {}
+        self._local.pending_pages = {}
+
+        if len(pending) == 0 and len(pending_pages) == 0:
+            return
+
+        debounce = self.debounce if is_shared() else 0
+        identifiers = list(pending)
+        reindex_pages = list(pending_pages)
+        if debounce > 0:
+            identifiers = self._mark(identifiers, self.cache_key, debounce)
+            reindex_pages = self._mark(
+                reindex_pages,
+                self.pages_cache_key,
+                debounce
+            )
+            if len(identifiers) == 0 and len(reindex_pages) == 0:
+                logger.debug(f"{len(pending)} index update(s) coalesced")
+                return
+
+        from papermerge.search.tasks import update_index_coalesced
+
+        logger.debug(f"Flushing {len(identifiers)} index update(s)")
+        kwargs = {'identifiers': identifiers}
+        user_ids = {
+            identifier: pending[identifier]
+            for identifier in identifiers
+            if pending[identifier] is not None
+        }
+        if len(user_ids) > 0:
+            kwargs['user_ids'] = user_ids
+        if len(reindex_pages) > 0:
+            kwargs['reindex_pages'] = reindex_pages
+        if debounce > 0:
+            update_index_coalesced.apply_async(
+                kwargs=kwargs,
+                countdown=debounce
+            )
+        else:
+            update_index_coalesced.apply_async(kwargs=kwargs)
+
+    def release(self, identifiers, reindex_pages=None):
+        """
+        Removes pending marks of given identifiers
+
+        Invoked by the worker right before the index update, so that any
+        later change of the same identifiers will queue a new update.
+        """
+        if self.debounce > 0 and is_shared():
+            cache.delete_many(
+                [self.cache_key(identifier) for identifier in identifiers] + [
+                    self.pages_cache_key(identifier)
+                    for identifier in reindex_pages or []
+                ]
+            )
+
+    def _mark(self, identifiers, get_key, debounce) -> list:
+        """
+        Marks given identifiers as pending. Returns those which were not
+        pending yet (i.e. identifiers without a queued task)
+        """
+        result = []
+        for identifier in identifiers:
+            if cache.add(
+                get_key(identifier),
+                True,
+                timeout=debounce + PENDING_MARK_GRACE
+            ):
+                result.append(identifier)
+            else:
+                logger.debug(f"Index update of {identifier} coalesced")
+
+        return result
+
+
+_queue = IndexUpdateQueue()
+
+
+def get_queue() -> IndexUpdateQueue:
+    return _queue
@@ -0,0 +1,218 @@
+"""
+Full (re)index of documents, folders and pages.
+
+Used by ``reindex`` management command. Unlike haystack's generic
+``update_index``, instances are loaded in keyset paginated batches with
+everything search indexes need (see ``index_queryset`` of each index)
+and with breadcrumbs computed for the whole batch, so indexing needs
+no per instance queries. Batches are indexed in parallel by a pool of
+worker processes.
+"""
+import logging
+import multiprocessing
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait
+)
+from datetime import timedelta
+
+from django.db import connections as db_connections
+
+from papermerge.core.models import BaseTreeNode, Document, Folder
+from papermerge.core.models.utils import uuid2raw_str
+from papermerge.search.tasks import (
+    INDEX_BATCH_SIZE,
+    get_indexes,
+    get_model_class,
+    update_index_instances
+)
+
+logger = logging.getLogger(__name__)
+
+# models indexed by `reindex`, in that order
+MODEL_PATHS = ('core.folder', 'core.document', 'core.page')
+
+# seconds worker processes wait for each other to start
+WORKERS_START_TIMEOUT = 60
+
+
+def iter_pk_batches(queryset, batch_size: int = INDEX_BATCH_SIZE):
+    """
+    Yields lists of (at most ``batch_size``) primary keys of
+    the queryset, in pk order.
+
+    Keyset pagination is used i.e. each batch is fetched with
+    ``pk > last pk of previous batch`` condition, which (unlike offset
+    pagination) costs the same no matter how deep into the table
+    the batch is.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+
+    while True:
+        batch_queryset = queryset
+        if last_pk is not None:
+            batch_queryset = queryset.filter(pk__gt=last_pk)
+
+        pks = list(batch_queryset.values_list('pk', flat=True)[:batch_size])
+        if len(pks) == 0:
+            return
+
+        yield [str(pk) for pk in pks]
+        last_pk = pks[-1]
+
+
+def set_breadcrumb_titles(nodes):
+    """
+    Sets ``breadcrumb_titles`` attribute of given nodes i.e. titles of
+    their ancestors (topmost first), looked up with one single query.
+    """
+    ancestor_ids = set()
+    for node in nodes:
+        ancestor_ids.update(node.ancestor_ids[:-1])
+
+    titles = {
+        uuid2raw_str(pk): title
+        for pk, title in BaseTreeNode.objects.filter(
+            id__in=ancestor_ids
+        ).values_list('id', 'title')
+    }
+
+    for node in nodes:
+        node.breadcrumb_titles = [
+            titles[ancestor_id]
+            for ancestor_id in node.ancestor_ids[:-1]
+            if ancestor_id in titles
+        ]
+
+
+def get_reindex_queryset(model_class):
+    """
+    Returns queryset of all instances of `model_class` which are indexed
+    """
+    current_index, _ = next(get_indexes(model_class))
+
+    return current_index.index_queryset()
+
+
+def index_batch(model_path: str, pks) -> int:
+    """
+    Indexes instances of the model with given pks. Returns number of
+    indexed instances.
+    """
+    model_class = get_model_class(model_path)
+    instances = list(get_reindex_queryset(model_class).filter(pk__in=pks))
+
+    if model_class in (Document, Folder):
+        set_breadcrumb_titles(instances)
+
+    update_index_instances(model_class, instances)
+
+    return len(instances)
+
+
+def format_progress(done: int, total: int, elapsed: float) -> str:
+    """
+    Returns progress message e.g.
+    "1000/4000 (25%), 50.0/s, ETA 0:01:00"
+    """
+    rate = done / elapsed if elapsed > 0 else 0
+    percent = done * 100 // total if total else 100
+    message = f"{done}/{total} ({percent}%), {rate:.1f}/s"
+
+    if rate > 0 and total > done:
+        eta = timedelta(seconds=round((total - done) / rate))
+        message += f", ETA {eta}"
+
+    return message
+
+
+def reindex(
+    model_paths=MODEL_PATHS,
+    batch_size: int = INDEX_BATCH_SIZE,
+    workers: int = 0,
+    report=None
+):
+    """
+    Indexes all instances of given models
+
+    ``workers`` is the number of worker processes indexing the batches;
+    with 0 workers, batches are indexed in current process.
+    ``report`` is called with progress message after each indexed batch.
+    Returns total number of indexed instances.
+    """
+    report = report or logger.info
+    total_done = 0
+
+    for model_path in model_paths:
+        queryset = get_reindex_queryset(get_model_class(model_path))
+        # (annotations are not needed for counting)
+        total = queryset.values('pk').count()
+        started = time.monotonic()
+        done = 0
+
+        for count in _index_batches(
+            model_path,
+            iter_pk_batches(queryset, batch_size),
+            workers
+        ):
+            done += count
+            report(
+                f"{model_path}: " + format_progress(
+                    done,
+                    total,
+                    time.monotonic() - started
+                )
+            )
+
+        total_done += done
+
+    return total_done
+
+
+def _wait_for_workers(barrier):
+    """
+    Initializer of worker processes: blocks until all workers are started
+    """
+    barrier.wait(timeout=WORKERS_START_TIMEOUT)
+
+
+def _index_batches(model_path: str, batches, workers: int):
+    """Yields number of indexed instances as each batch is done"""
+    if workers == 0:
+        for pks in batches:
+            yield index_batch(model_path, pks)
+        return
+
+    # Worker processes have to be forked while parent has no open database
+    # connection, otherwise they would share its socket.
+    db_connections.close_all()
+    mp_context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context,
+        initializer=_wait_for_workers,
+        initargs=(mp_context.Barrier(workers),)
+    ) as executor:
+        # Depending on Python version, workers are forked either all at
+        # first submit or one per submit while none of them is idle. As
+        # workers wait for each other (see `_wait_for_workers`), none is
+        # idle until all are forked i.e. all are forked here, before
+        # parent queries the database again.
+        for future in [executor.submit(int) for _ in range(workers)]:
+            future.result()
+
+        # at most two batches per worker are queued, as there may be
+        # (too) many batches to keep their pks in memory at once
+        pending = set()
+        for pks in batches:
+            pending.add(executor.submit(index_batch, model_path, pks))
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield future.result()
+
+        for future in pending:
+            yield future.result()
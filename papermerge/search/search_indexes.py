@@ -1,11 +1,49 @@
+import json
+import os
+
+from django.db.models import F, OuterRef, Subquery
 from haystack import indexes
-from papermerge.core.models import Document, Folder
+
+from papermerge.core.lib import extract_words_from
+from papermerge.core.models import Document, DocumentVersion, Folder, Page
+from papermerge.core.storage import abs_path
+
+
+def last_version_text():
+    """Subquery of the text of document's last version"""
+    return Subquery(
+        DocumentVersion.objects.filter(
+            document_id=OuterRef('pk')
+        ).order_by('-number').values('text')[:1]
+    )
+
+
+def last_version_pages(queryset):
+    """
+    Narrows down queryset of pages to the pages of documents' last versions
+    """
+    last_version_number = DocumentVersion.objects.filter(
+        document_id=OuterRef('document_version__document_id')
+    ).order_by('-number').values('number')[:1]
+
+    return queryset.annotate(
+        last_version_number=Subquery(last_version_number)
+    ).filter(
+        document_version__number=F('last_version_number')
+    )
 
 
 class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
+    """
+    Besides instances with no extra data, ``prepare_*`` methods accept
+    instances of ``index_queryset`` (last version's text is annotated)
+    and instances with ``breadcrumb_titles`` attribute (precomputed for
+    the whole batch by ``papermerge.search.reindex``). This way indexing
+    needs no per instance queries.
+    """
     indexed_content = indexes.CharField(document=True, use_template=True)
     id = indexes.CharField(model_attr='id')
-    user = indexes.CharField(model_attr='document__user')
+    user = indexes.CharField(model_attr='user')
     title = indexes.CharField(model_attr='title')
     last_version_text = indexes.CharField()
     text = indexes.CharField()  # alias for `last_version_text`
@@ -15,6 +53,9 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
     node_type = indexes.CharField()
 
     def prepare_last_version_text(self, obj):
+        if hasattr(obj, 'last_version_text_value'):
+            return obj.last_version_text_value or ''
+
         last_document_version = obj.versions.last()
         if last_document_version:
             return last_document_version.text
@@ -22,6 +63,9 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
         return ''
 
     def prepare_breadcrumb(self, instance):
+        if hasattr(instance, 'breadcrumb_titles'):
+            return instance.breadcrumb_titles
+
         list_of_titles = [
             item.title for item in instance.get_ancestors(include_self=False)
         ]
@@ -37,6 +81,11 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
     def prepare_tags(self, obj):
         return [tag.name for tag in obj.tags.all()]
 
+    def index_queryset(self, using=None):
+        return Document.objects.select_related('user').prefetch_related(
+            'tags'
+        ).annotate(last_version_text_value=last_version_text())
+
     def get_model(self):
         return Document
 
@@ -51,6 +100,9 @@ class FolderIndex(indexes.SearchIndex, indexes.Indexable):
     tags = indexes.MultiValueField()
 
     def prepare_breadcrumb(self, instance):
+        if hasattr(instance, 'breadcrumb_titles'):
+            return instance.breadcrumb_titles
+
         breadcrumb_items = [
             item.title
             for item in instance.get_ancestors(include_self=False)
@@ -63,5 +115,45 @@ class FolderIndex(indexes.SearchIndex, indexes.Indexable):
     def prepare_tags(self, obj):
         return [tag.name for tag in obj.tags.all()]
 
+    def index_queryset(self, using=None):
+        return Folder.objects.select_related('user').prefetch_related('tags')
+
     def get_model(self):
         return Folder
+
+
+class PageIndex(indexes.SearchIndex, indexes.Indexable):
+    """
+    Page level index i.e. tells which pages of the document matched
+    and where exactly (hocr word boxes) on the page.
+
+    Only pages of the last document version are indexed. Document's title
+    is not indexed, so that renaming (or moving) the document does not
+    require reindexing of all its pages.
+    """
+    indexed_content = indexes.CharField(document=True, use_template=True)
+    user = indexes.CharField(model_attr='document_version__document__user')
+    document_id = indexes.CharField(model_attr='document_version__document_id')
+    document_version_id = indexes.CharField(model_attr='document_version_id')
+    number = indexes.IntegerField(model_attr='number')
+    text = indexes.CharField(model_attr='text')
+    # JSON list of [word, x1, y1, x2, y2] (stored only, not searchable)
+    words = indexes.CharField(indexed=False)
+
+    def prepare_words(self, obj):
+        hocr_path = abs_path(obj.page_path.hocr_url)
+        if not os.path.exists(hocr_path):
+            return '[]'
+
+        return json.dumps([
+            [word['text'], word['x1'], word['y1'], word['x2'], word['y2']]
+            for word in extract_words_from(hocr_path)
+        ])
+
+    def index_queryset(self, using=None):
+        return last_version_pages(
+            Page.objects.select_related('document_version__document__user')
+        )
+
+    def get_model(self):
+        return Page
@@ -1,3 +1,5 @@
+import json
+
 from rest_framework_json_api import serializers
 
 from papermerge.core.serializers.tag import ColoredTagListSerializerField
@@ -14,3 +16,31 @@ class SearchResultSerializer(serializers.Serializer):
     )
     node_type = serializers.ChoiceField(choices=['document', 'folder'])
     user_id = serializers.UUIDField()
+
+
+class PageSearchResultSerializer(serializers.Serializer):
+    """
+    Page matching the search. ``boxes`` are hocr bounding boxes
+    (``[x1, y1, x2, y2]``) of the matching words; search terms are given
+    via ``terms`` serializer context, titles of the documents (document ID
+    => title) via ``titles`` serializer context.
+    """
+    page_id = serializers.UUIDField(source='pk')
+    document_id = serializers.UUIDField()
+    document_version_id = serializers.UUIDField()
+    number = serializers.IntegerField()
+    title = serializers.SerializerMethodField()
+    boxes = serializers.SerializerMethodField()
+
+    def get_title(self, obj) -> str:
+        return self.context.get('titles', {}).get(str(obj.document_id), '')
+
+    def get_boxes(self, obj) -> list:
+        terms = self.context.get('terms', [])
+        boxes = []
+        for word, *box in json.loads(obj.words or '[]'):
+            word = word.lower()
+            if any(term in word for term in terms):
+                boxes.append(box)
+
+        return boxes
@@ -1,5 +1,5 @@
 import logging
-from django.db import models
+from django.db import models, transaction
 
 from haystack import signals
 from haystack.utils import get_identifier
@@ -10,8 +10,13 @@ from papermerge.core.models import (
     Folder,
     BaseTreeNode
 )
-from papermerge.core.signal_definitions import node_post_move
-from papermerge.search.tasks import update_index
+from papermerge.core.models.node import NODE_TYPE_FOLDER, NODE_TYPE_DOCUMENT
+from papermerge.core.signal_definitions import (
+    node_post_move,
+    nodes_post_move
+)
+from papermerge.search.queue import get_queue
+from papermerge.search.tasks import update_index_subtrees
 
 
 logger = logging.getLogger(__name__)
@@ -30,6 +35,9 @@ class SignalProcessor(signals.BaseSignalProcessor):
         node_post_move.connect(
             self.after_node_moved, sender=BaseTreeNode
         )
+        nodes_post_move.connect(
+            self.after_nodes_moved, sender=BaseTreeNode
+        )
 
     def teardown(self):
         for klass in (DocumentVersion, Document, Folder, BaseTreeNode):
@@ -41,6 +49,9 @@ class SignalProcessor(signals.BaseSignalProcessor):
         node_post_move.disconnect(
             self.after_node_moved
         )
+        nodes_post_move.disconnect(
+            self.after_nodes_moved
+        )
 
     def after_node_moved(self, instance, new_parent, **kwargs):
         """
@@ -75,11 +86,29 @@ class SignalProcessor(signals.BaseSignalProcessor):
         The results are correct, but their breadcrumb is wrong (outdated).
 
         In order to solve above described problem, we need to update index
-        (which in turn will update breadcrumbs) of all descendant nodes
-        of the new parent - which include newly moved nodes as well.
+        (which in turn will update breadcrumbs) of the moved node and of all
+        its descendants. Other descendants of the new parent are not
+        affected by the move and are left as they are.
+        """
+        self.after_nodes_moved(
+            node_ids=[instance.pk],
+            new_parent=new_parent,
+            **kwargs
+        )
+
+    def after_nodes_moved(self, node_ids, new_parent, **kwargs):
         """
-        for node in new_parent.get_descendants():  # includes newly moved nodes
-            self.enqueue('save', node, **kwargs)
+        Same as `after_node_moved`, but for nodes moved in bulk.
+
+        One single task is enqueued for all moved subtrees, once the
+        move is committed (i.e. the worker never reads nodes' old parent
+        nor indexes rolled back move).
+        """
+        logger.debug(f"Update index of {len(node_ids)} moved subtree(s)")
+        kwargs = {'node_ids': [str(node_id) for node_id in node_ids]}
+        transaction.on_commit(
+            lambda: update_index_subtrees.apply_async(kwargs=kwargs)
+        )
 
     def enqueue_save(self, sender, instance, **kwargs):
         return self.enqueue('save', instance, **kwargs)
@@ -89,31 +118,40 @@ class SignalProcessor(signals.BaseSignalProcessor):
 
     def enqueue(self, action, instance, **kwargs):
         identifier = get_identifier(instance)
+        # pages are reindexed only if their text or document's
+        # last version could have changed
+        pages = False
 
         # We index only Document and Folder models, however when
         # new DocumentVersion is saved/deleted we need to update its
         # associated Document
         if isinstance(instance, DocumentVersion):
-            identifier = get_identifier(instance.document)
+            # built from foreign key value (i.e. without extra query),
+            # associated document might be already deleted
+            identifier = f"core.document.{instance.document_id}"
+            pages = True
         elif 'basetreenode' in identifier:   # i.e. is this core.BaseTreeNode ?
-            try:
-                identifier = get_identifier(instance.document_or_folder)
-            except Document.DoesNotExist:
-                # this scenario occurs because associated folder
-                # was deleted before
-                logger.debug(
-                    f"{instance} does not have associated document"
-                )
-                # don't continue with index update
-                return
-            except Folder.DoesNotExist:
-                # this scenario occurs because associated folder
-                # was deleted before
-                logger.debug(
-                    f"{instance} does have associated folder"
-                )
-                # don't continue with index update
-                return
+            if instance.ctype in (NODE_TYPE_FOLDER, NODE_TYPE_DOCUMENT):
+                identifier = f"core.{instance.ctype}.{instance.pk}"
+            else:
+                try:
+                    identifier = get_identifier(instance.document_or_folder)
+                except Document.DoesNotExist:
+                    # this scenario occurs because associated folder
+                    # was deleted before
+                    logger.debug(
+                        f"{instance} does not have associated document"
+                    )
+                    # don't continue with index update
+                    return
+                except Folder.DoesNotExist:
+                    # this scenario occurs because associated folder
+                    # was deleted before
+                    logger.debug(
+                        f"{instance} does have associated folder"
+                    )
+                    # don't continue with index update
+                    return
 
         logger.debug(
             "Update index action={}, identifier={}".format(
@@ -121,7 +159,13 @@ class SignalProcessor(signals.BaseSignalProcessor):
                 identifier
             )
         )
-        update_index.apply_async(kwargs={
-            'action': action,
-            'identifier': identifier
-        })
+        # Action itself is not queued: whether to update or to remove
+        # the identifier is decided by the worker, based on the state of
+        # the database at the time when coalesced update runs.
+        # (DocumentVersion has no owner of its own; owner of the document
+        # is not looked up, to save a query)
+        get_queue().add(
+            identifier,
+            user_id=getattr(instance, 'user_id', None),
+            pages=pages
+        )
@@ -0,0 +1,806 @@
+"""
+Embedded haystack search backend built on SQLite FTS5.
+
+Search index is kept in one single SQLite database file, so that small
+and medium installations do not need to run extra search service::
+
+    HAYSTACK_CONNECTIONS = {
+        'default': {
+            'ENGINE': 'papermerge.search.sqlite_backend.SQLiteEngine',
+            'PATH': '/var/lib/papermerge/search.sqlite3',
+        },
+    }
+
+Index consists of three tables:
+
+* ``documents`` - one row per indexed object, stored fields (except
+  text fields) are kept as JSON
+* ``fulltext`` - FTS5 inverted index with one column per single valued
+  text field; shares rowid with ``documents``
+* ``keywords`` - ``(document, field, value)`` rows of all other indexed
+  fields i.e. numbers, dates, multi valued fields (e.g. tags) and
+  short text values
+
+Haystack filters are compiled by ``SQLiteSearchQuery`` into SQL ``WHERE``
+clause; filter values are always passed as SQL parameters.
+"""
+import json
+import logging
+import os
+import sqlite3
+import warnings
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_str
+
+from haystack import connections
+from haystack.backends import (
+    BaseEngine,
+    BaseSearchBackend,
+    BaseSearchQuery,
+    log_query
+)
+from haystack.constants import (
+    DEFAULT_ALIAS,
+    DJANGO_CT,
+    DJANGO_ID,
+    DOCUMENT_FIELD,
+    ID
+)
+from haystack.exceptions import SearchBackendError, SkipDocument
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+from haystack.utils.app_loading import haystack_get_model
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER = 'unicode61 remove_diacritics 2'
+# longer text values are searchable only via full text index
+MAX_KEYWORD_LENGTH = 256
+# number of tokens in highlighted snippet
+SNIPPET_TOKENS = 32
+TEXT_FIELD_TYPES = ('string', 'edge_ngram', 'ngram')
+# filters which, for text values of text fields, use full text index
+TEXT_FILTERS = ('content', 'contains', 'startswith', 'exact', 'fuzzy', 'in')
+KEYWORD_OPERATORS = {
+    'content': '=',
+    'exact': '=',
+    'fuzzy': '=',
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+}
+LIKE_PATTERNS = {
+    'contains': '%{}%',
+    'startswith': '{}%',
+    'endswith': '%{}',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    identifier TEXT NOT NULL UNIQUE,
+    django_ct TEXT NOT NULL,
+    django_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_django_ct ON documents (django_ct);
+CREATE TABLE IF NOT EXISTS keywords (
+    document INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    value
+);
+CREATE INDEX IF NOT EXISTS keywords_field_value ON keywords (field, value);
+CREATE INDEX IF NOT EXISTS keywords_document ON keywords (document);
+CREATE VIRTUAL TABLE IF NOT EXISTS fulltext USING fts5 (
+    {columns},
+    tokenize = '{tokenizer}',
+    prefix = '2 3'
+);
+"""
+
+
+def quote_term(term: str) -> str:
+    """Quotes term as FTS5 string i.e. term is never parsed as FTS5 syntax"""
+    return '"%s"' % term.replace('"', '""')
+
+
+def escape_like(value: str) -> str:
+    return value.replace(
+        '\\', '\\\\'
+    ).replace('%', '\\%').replace('_', '\\_')
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    # values are passed as SQL parameters or quoted as FTS5 strings i.e.
+    # nothing needs to be escaped
+    RESERVED_WORDS = ()
+    RESERVED_CHARACTERS = ()
+
+    def __init__(self, connection_alias, **connection_options):
+        super().__init__(connection_alias, **connection_options)
+        self.setup_complete = False
+        self.path = connection_options.get('PATH')
+
+        if not self.path:
+            raise ImproperlyConfigured(
+                "You must specify a 'PATH' in your settings for connection "
+                f"'{connection_alias}'."
+            )
+
+    def setup(self):
+        """
+        Creates index tables. If indexed fields changed since the
+        index was created, index is emptied (and needs to be rebuilt).
+        """
+        unified_index = connections[self.connection_alias].get_unified_index()
+        (
+            self.content_field_name,
+            self.text_fields,
+            self.keyword_fields,
+            self.stored_fields
+        ) = self.build_schema(unified_index.all_searchfields())
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            # readers do not block writer (and vice versa)
+            connection.execute('PRAGMA journal_mode=WAL')
+            columns = [
+                row[1] for row in connection.execute(
+                    'PRAGMA table_info(fulltext)'
+                )
+            ]
+            if columns and columns != self.text_fields:
+                logger.warning(
+                    f"Fields of the search index {self.path} changed, "
+                    "index was cleared and needs to be rebuilt"
+                )
+                connection.executescript(
+                    'DROP TABLE fulltext;'
+                    'DROP TABLE keywords;'
+                    'DROP TABLE documents;'
+                )
+            connection.executescript(
+                SCHEMA.format(
+                    columns=', '.join(
+                        f'"{name}"' for name in self.text_fields
+                    ),
+                    tokenizer=TOKENIZER
+                )
+            )
+        finally:
+            connection.close()
+
+        self.setup_complete = True
+
+    def build_schema(self, fields):
+        """
+        Returns tuple (content_field_name, text_fields, keyword_fields,
+        stored_fields) where ``text_fields`` are names of the
+        ``fulltext`` table columns.
+        """
+        content_field_name = ''
+        text_fields = []
+        keyword_fields = set()
+        stored_fields = set()
+
+        for field in fields.values():
+            name = field.index_fieldname
+            if field.document:
+                content_field_name = name
+            if field.stored:
+                stored_fields.add(name)
+            if not field.indexed:
+                continue
+            if (
+                field.field_type in TEXT_FIELD_TYPES
+                and not field.is_multivalued
+            ):
+                text_fields.append(name)
+            if not field.document:
+                keyword_fields.add(name)
+
+        if not text_fields:
+            # FTS5 table needs at least one column
+            text_fields.append(content_field_name or DOCUMENT_FIELD)
+
+        return (
+            content_field_name,
+            sorted(text_fields),
+            keyword_fields,
+            stored_fields
+        )
+
+    @contextmanager
+    def connect(self):
+        """Yields connection; changes are committed on exit"""
+        if not self.setup_complete:
+            self.setup()
+
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def update(self, index, iterable, commit=True):
+        with self.connect() as connection:
+            for obj in iterable:
+                try:
+                    doc = index.full_prepare(obj)
+                except SkipDocument:
+                    logger.debug(f"Indexing for object `{obj}` skipped")
+                    continue
+
+                identifier = get_identifier(obj)
+                try:
+                    self._remove_document(connection, identifier)
+                    self._insert_document(connection, identifier, doc)
+                except sqlite3.Error as exc:
+                    if not self.silently_fail:
+                        raise
+
+                    logger.error(
+                        f"{exc.__class__.__name__} while preparing object "
+                        f"{identifier} for update",
+                        exc_info=True
+                    )
+
+    def remove(self, obj_or_string, commit=True):
+        identifier = get_identifier(obj_or_string)
+
+        try:
+            with self.connect() as connection:
+                self._remove_document(connection, identifier)
+        except sqlite3.Error as exc:
+            if not self.silently_fail:
+                raise
+
+            logger.error(
+                f"Failed to remove document '{identifier}': {exc}",
+                exc_info=True
+            )
+
+    def clear(self, models=None, commit=True):
+        if models is not None:
+            assert isinstance(models, (list, tuple))
+
+        try:
+            with self.connect() as connection:
+                if models is None:
+                    connection.execute('DELETE FROM fulltext')
+                    connection.execute('DELETE FROM keywords')
+                    connection.execute('DELETE FROM documents')
+                    return
+
+                model_cts = [get_model_ct(model) for model in models]
+                documents = (
+                    'SELECT id FROM documents WHERE django_ct IN (%s)'
+                    % ', '.join('?' * len(model_cts))
+                )
+                connection.execute(
+                    f'DELETE FROM fulltext WHERE rowid IN ({documents})',
+                    model_cts
+                )
+                connection.execute(
+                    f'DELETE FROM keywords WHERE document IN ({documents})',
+                    model_cts
+                )
+                connection.execute(
+                    f'DELETE FROM documents WHERE id IN ({documents})',
+                    model_cts
+                )
+        except sqlite3.Error as exc:
+            if not self.silently_fail:
+                raise
+
+            logger.error(f"Failed to clear search index: {exc}", exc_info=True)
+
+    def optimize(self):
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO fulltext (fulltext) VALUES ('optimize')"
+            )
+
+    @log_query
+    def search(
+        self,
+        query_string,
+        sort_by=None,
+        start_offset=0,
+        end_offset=None,
+        fields='',
+        highlight=False,
+        facets=None,
+        date_facets=None,
+        query_facets=None,
+        narrow_queries=None,
+        spelling_query=None,
+        within=None,
+        dwithin=None,
+        distance_point=None,
+        models=None,
+        limit_to_registered_models=None,
+        result_class=None,
+        params=None,
+        match=None,
+        **kwargs
+    ):
+        """
+        ``query_string`` is SQL condition built by ``SQLiteSearchQuery``
+        (with ``params`` as its parameters). ``match`` is FTS5 query
+        of all searched terms, used to rank and highlight the results.
+        """
+        if facets or date_facets or query_facets:
+            warnings.warn(
+                "SQLite backend does not handle faceting.",
+                Warning,
+                stacklevel=2
+            )
+        if narrow_queries:
+            warnings.warn(
+                "SQLite backend does not handle narrow queries.",
+                Warning,
+                stacklevel=2
+            )
+
+        if limit_to_registered_models is None:
+            limit_to_registered_models = getattr(
+                settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True
+            )
+
+        if models and len(models):
+            model_choices = sorted(get_model_ct(model) for model in models)
+        elif limit_to_registered_models:
+            model_choices = self.build_models_list()
+        else:
+            model_choices = []
+
+        params = dict(params or {})
+        conditions = [f'({query_string})']
+        if model_choices:
+            names = []
+            for number, model_ct in enumerate(model_choices):
+                params[f'ct{number}'] = model_ct
+                names.append(f':ct{number}')
+            conditions.append(f"d.django_ct IN ({', '.join(names)})")
+        where = ' AND '.join(conditions)
+
+        try:
+            with self.connect() as connection:
+                hits = connection.execute(
+                    f'SELECT count(*) FROM documents AS d WHERE {where}',
+                    params
+                ).fetchone()[0]
+                if hits == 0:
+                    return {'results': [], 'hits': 0}
+
+                page = self._search_page(
+                    connection,
+                    where=where,
+                    params=params,
+                    match=match,
+                    sort_by=sort_by,
+                    start_offset=start_offset,
+                    end_offset=end_offset
+                )
+                rows = self._load_documents(
+                    connection,
+                    [rowid for rowid, _ in page]
+                )
+                snippets = {}
+                if highlight and match:
+                    snippets = self._highlight(
+                        connection,
+                        [rowid for rowid, _ in page],
+                        match
+                    )
+        except sqlite3.Error as exc:
+            if not self.silently_fail:
+                raise SearchBackendError(str(exc)) from exc
+
+            logger.error(f"Failed to query search index: {exc}", exc_info=True)
+            return {'results': [], 'hits': 0}
+
+        return self._process_results(
+            page,
+            rows,
+            hits=hits,
+            snippets=snippets if highlight else None,
+            result_class=result_class
+        )
+
+    def _search_page(
+        self,
+        connection,
+        where,
+        params,
+        match,
+        sort_by,
+        start_offset,
+        end_offset
+    ):
+        """Returns list of (rowid, score) of requested page of results"""
+        params = dict(params)
+        rank_join = ''
+        score = '0'
+        if match:
+            params['match'] = match
+            # bm25() is "the lower the better"
+            rank_join = (
+                'LEFT JOIN (SELECT rowid, bm25(fulltext) AS score '
+                'FROM fulltext WHERE fulltext MATCH :match) AS r '
+                'ON r.rowid = d.id'
+            )
+            score = 'coalesce(-r.score, 0)'
+
+        order_by = []
+        for number, field in enumerate(sort_by or []):
+            direction = 'DESC' if field.startswith('-') else 'ASC'
+            name = field.lstrip('-')
+            if name in self.text_fields:
+                expression = (
+                    f'(SELECT "{name}" FROM fulltext WHERE rowid = d.id)'
+                )
+            elif name in self.stored_fields:
+                params[f'sort{number}'] = f'$."{name}"'
+                expression = f'json_extract(d.data, :sort{number})'
+            else:
+                raise SearchBackendError(f"Unable to sort by field '{name}'")
+            order_by.append(f'{expression} {direction}')
+        order_by += ['score DESC', 'd.id']
+
+        params['offset'] = start_offset or 0
+        params['limit'] = -1
+        if end_offset is not None:
+            params['limit'] = max(end_offset - params['offset'], 0)
+
+        return connection.execute(
+            f'SELECT d.id, {score} AS score FROM documents AS d {rank_join} '
+            f'WHERE {where} ORDER BY {", ".join(order_by)} '
+            'LIMIT :limit OFFSET :offset',
+            params
+        ).fetchall()
+
+    def _load_documents(self, connection, rowids):
+        """Returns dictionary rowid => row with stored fields"""
+        columns = ', '.join(f'f."{name}"' for name in self.text_fields)
+        rows = connection.execute(
+            f'SELECT d.id, d.django_ct, d.django_id, d.data, {columns} '
+            'FROM documents AS d LEFT JOIN fulltext AS f ON f.rowid = d.id '
+            'WHERE d.id IN (%s)' % ', '.join('?' * len(rowids)),
+            rowids
+        )
+
+        return {row[0]: row[1:] for row in rows}
+
+    def _highlight(self, connection, rowids, match):
+        """
+        Returns dictionary rowid => highlighted snippet of the best
+        matching text field
+        """
+        rows = connection.execute(
+            "SELECT rowid, snippet(fulltext, -1, '<em>', '</em>', '...', ?) "
+            'FROM fulltext WHERE fulltext MATCH ? AND rowid IN (%s)'
+            % ', '.join('?' * len(rowids)),
+            [SNIPPET_TOKENS, match, *rowids]
+        )
+
+        return dict(rows)
+
+    def _process_results(
+        self,
+        page,
+        rows,
+        hits,
+        snippets=None,
+        result_class=None
+    ):
+        if result_class is None:
+            result_class = SearchResult
+
+        results = []
+        unified_index = connections[self.connection_alias].get_unified_index()
+        indexed_models = unified_index.get_indexed_models()
+
+        for rowid, score in page:
+            django_ct, django_id, data, *texts = rows[rowid]
+            app_label, model_name = django_ct.split('.')
+            model = haystack_get_model(app_label, model_name)
+
+            if not model or model not in indexed_models:
+                hits -= 1
+                continue
+
+            index = unified_index.get_index(model)
+            stored = json.loads(data)
+            for name, text in zip(self.text_fields, texts):
+                if name in self.stored_fields and text is not None:
+                    stored[name] = text
+
+            additional_fields = {}
+            for key, value in stored.items():
+                if key in index.fields and hasattr(
+                    index.fields[key], 'convert'
+                ):
+                    additional_fields[key] = index.fields[key].convert(value)
+                else:
+                    additional_fields[key] = value
+
+            if snippets is not None:
+                additional_fields['highlighted'] = {
+                    self.content_field_name: [snippets.get(rowid, '')]
+                }
+
+            results.append(
+                result_class(
+                    app_label,
+                    model_name,
+                    django_id,
+                    score,
+                    **additional_fields
+                )
+            )
+
+        return {
+            'results': results,
+            'hits': hits,
+            'facets': {},
+            'spelling_suggestion': None,
+        }
+
+    def _insert_document(self, connection, identifier, doc):
+        stored = {
+            key: value for key, value in doc.items()
+            if key not in self.text_fields and (
+                key in self.stored_fields or key == ID
+            )
+        }
+        cursor = connection.execute(
+            'INSERT INTO documents (identifier, django_ct, django_id, data) '
+            'VALUES (?, ?, ?, ?)',
+            (
+                identifier,
+                doc[DJANGO_CT],
+                doc[DJANGO_ID],
+                json.dumps(stored, default=str)
+            )
+        )
+        rowid = cursor.lastrowid
+
+        columns = ', '.join(f'"{name}"' for name in self.text_fields)
+        connection.execute(
+            f'INSERT INTO fulltext (rowid, {columns}) VALUES (?%s)'
+            % (', ?' * len(self.text_fields)),
+            [rowid] + [
+                None if doc.get(name) is None else force_str(doc[name])
+                for name in self.text_fields
+            ]
+        )
+        connection.executemany(
+            'INSERT INTO keywords (document, field, value) VALUES (?, ?, ?)',
+            self._keywords(rowid, doc)
+        )
+
+    def _keywords(self, rowid, doc):
+        for name in self.keyword_fields:
+            values = doc.get(name)
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+
+            for value in values:
+                if value is None:
+                    continue
+                value = self._from_python(value)
+                if isinstance(value, str) and len(value) > MAX_KEYWORD_LENGTH:
+                    continue
+                yield rowid, name, value
+
+    def _remove_document(self, connection, identifier):
+        row = connection.execute(
+            'SELECT id FROM documents WHERE identifier = ?',
+            (identifier,)
+        ).fetchone()
+        if row is None:
+            return
+
+        connection.execute('DELETE FROM fulltext WHERE rowid = ?', row)
+        connection.execute('DELETE FROM keywords WHERE document = ?', row)
+        connection.execute('DELETE FROM documents WHERE id = ?', row)
+
+    def _from_python(self, value):
+        """Converts python value to the value stored in ``keywords`` table"""
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, (int, float)):
+            return value
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+
+        return force_str(value)
+
+
+class SQLiteSearchQuery(BaseSearchQuery):
+    """
+    Compiles haystack filters into SQL condition.
+
+    For text values of (single valued) text fields, full text index is
+    used:
+
+    * ``content`` (default) and ``fuzzy`` - all words must match
+    * ``contains`` and ``startswith`` - all words must match as prefixes
+      (FTS5 has no infix search)
+    * ``exact`` - whole value must match as phrase
+    * ``in`` - any of the values must match as phrase
+
+    Everything else is compared with values of ``keywords`` table i.e.
+    ``content``/``exact`` is plain equality. Note that non text
+    values (e.g. model instances like in ``filter(user=request.user)``)
+    are compared by equality of their string form, even for text fields.
+    """
+
+    def __init__(self, using=DEFAULT_ALIAS):
+        super().__init__(using=using)
+        self._params = {}
+        self._match_terms = []
+
+    def build_query(self):
+        self._params = {}
+        self._match_terms = []
+
+        return super().build_query()
+
+    def build_params(self, spelling_query=None):
+        kwargs = super().build_params(spelling_query=spelling_query)
+        kwargs['params'] = self._params
+        if self._match_terms:
+            kwargs['match'] = ' OR '.join(self._match_terms)
+
+        return kwargs
+
+    def run_raw(self, **kwargs):
+        raise NotImplementedError(
+            "SQLite search backend does not support raw queries"
+        )
+
+    def matching_all_fragment(self):
+        return '1'
+
+    def boost_fragment(self, boost_word, boost_value):
+        # boosting is not supported
+        return ''
+
+    def clean(self, query_fragment):
+        if not isinstance(query_fragment, str):
+            return query_fragment
+
+        return ' '.join(quote_term(word) for word in query_fragment.split())
+
+    def build_exact_query(self, query_string):
+        if query_string.startswith('"'):
+            # already quoted by `clean`
+            return query_string
+
+        return quote_term(query_string)
+
+    def build_query_fragment(self, field, filter_type, value):
+        if not self.backend.setup_complete:
+            self.backend.setup()
+
+        if field == 'content':
+            field_name = self.backend.content_field_name
+        else:
+            field_name = connections[
+                self._using
+            ].get_unified_index().get_index_fieldname(field)
+
+        if hasattr(value, 'values_list'):
+            value = list(value)
+
+        negated = False
+        if hasattr(value, 'input_type_name'):
+            if value.post_process is False:
+                # e.g. ``Raw`` or ``AutoQuery`` i.e. FTS5 query
+                return self._text_fragment(field_name, value.prepare(self))
+            if value.input_type_name == 'exact':
+                filter_type = 'exact'
+            negated = value.input_type_name == 'not'
+            value = value.query_string
+
+        if (
+            field_name in self.backend.text_fields
+            and filter_type in TEXT_FILTERS
+            and self._is_text(value)
+        ):
+            fragment = self._text_fragment(
+                field_name,
+                self._text_query(filter_type, value)
+            )
+        else:
+            fragment = self._keyword_fragment(field_name, filter_type, value)
+
+        if negated:
+            return f'NOT {fragment}'
+
+        return fragment
+
+    def _is_text(self, value):
+        if isinstance(value, (list, tuple, set)):
+            return all(isinstance(item, str) for item in value)
+
+        return isinstance(value, str)
+
+    def _text_query(self, filter_type, value):
+        """Returns FTS5 query (or None, when there is nothing to match)"""
+        if filter_type == 'in':
+            terms = [quote_term(item) for item in value]
+            self._match_terms.extend(terms)
+            return ' OR '.join(terms) or None
+
+        if filter_type == 'exact':
+            terms = [quote_term(value)]
+        elif filter_type in ('contains', 'startswith'):
+            terms = [quote_term(word) + '*' for word in value.split()]
+        else:
+            terms = [quote_term(word) for word in value.split()]
+
+        self._match_terms.extend(terms)
+
+        return ' AND '.join(terms) or None
+
+    def _text_fragment(self, field_name, query):
+        if not query:
+            return '0'
+
+        name = self._param(f'{{{field_name}}} : ({query})')
+
+        return (
+            f'd.id IN (SELECT rowid FROM fulltext WHERE fulltext MATCH {name})'
+        )
+
+    def _keyword_fragment(self, field_name, filter_type, value):
+        to_python = self.backend._from_python
+
+        if filter_type == 'in':
+            names = [self._param(to_python(item)) for item in value]
+            if not names:
+                return '0'
+            condition = f"IN ({', '.join(names)})"
+        elif filter_type == 'range':
+            start, end = value
+            condition = 'BETWEEN {} AND {}'.format(
+                self._param(to_python(start)),
+                self._param(to_python(end))
+            )
+        elif filter_type in LIKE_PATTERNS:
+            pattern = LIKE_PATTERNS[filter_type].format(
+                escape_like(force_str(to_python(value)))
+            )
+            condition = f"LIKE {self._param(pattern)} ESCAPE '\\'"
+        else:
+            condition = '{} {}'.format(
+                KEYWORD_OPERATORS[filter_type],
+                self._param(to_python(value))
+            )
+
+        return (
+            'd.id IN (SELECT document FROM keywords '
+            f'WHERE field = {self._param(field_name)} AND value {condition})'
+        )
+
+    def _param(self, value):
+        """Adds SQL parameter, returns its placeholder"""
+        name = f'p{len(self._params)}'
+        self._params[name] = value
+
+        return f':{name}'
+
+
+class SQLiteEngine(BaseEngine):
+    backend = SQLiteSearchBackend
+    query = SQLiteSearchQuery
@@ -1,15 +1,30 @@
 import logging
+from collections import defaultdict
 
 from django.core.exceptions import ImproperlyConfigured
 from django.apps import apps
 
+from django.db.models import Q
+
 from celery import shared_task
 from haystack.exceptions import NotHandled as IndexNotFoundException
 from haystack import connections, connection_router
+from haystack.query import SearchQuerySet
+
+from papermerge.core.models import BaseTreeNode, Page
+from papermerge.search.cache import bump_generation
+from papermerge.search.queue import get_queue
+from papermerge.search.search_indexes import last_version_pages
+from papermerge.core.models.node import NODE_TYPE_FOLDER, NODE_TYPE_DOCUMENT
 
 
 logger = logging.getLogger(__name__)
 
+# max number of subtrees looked up with one query
+SUBTREES_BATCH_SIZE = 100
+# max number of instances passed to search backend in one call
+INDEX_BATCH_SIZE = 500
+
 
 def split_identifier(identifier):
     """
@@ -81,7 +96,15 @@ def get_model_class(object_path):
 def update_index(
     action,
     identifier,
+    user_id=None
 ):
+    """
+    Updates index of one instance
+
+    `user_id` is the owner of the instance; for 'delete' action (when
+    the instance is gone) it is used to invalidate owner's cached search
+    results.
+    """
     logger.debug("Update Index")
     object_path, pk = split_identifier(identifier)
     if object_path is None or pk is None:
@@ -107,6 +130,7 @@ def update_index(
                 msg = ("Deleted '%s' (with %s)" %
                        (identifier, current_index_name))
                 logger.debug(msg)
+                invalidate_removed([identifier], {identifier: user_id})
         elif action == 'save':
             # and the instance of the model class with the pk
             instance = get_instance(model_class, pk)
@@ -125,6 +149,281 @@ def update_index(
                 msg = ("Updated '%s' (with %s)" %
                        (identifier, current_index_name))
                 logger.debug(msg)
+                invalidate_updated([instance])
         else:
             logger.error("Unrecognized action '%s'. Moving on..." % action)
             raise ValueError("Unrecognized action %s" % action)
+
+
+def group_identifiers(identifiers):
+    """
+    Groups identifiers by their object path.
+
+    Converts ['core.folder.1', 'core.document.2', 'core.folder.3'] into
+    {'core.folder': ['1', '3'], 'core.document': ['2']}.
+    Identifiers which cannot be parsed are skipped.
+    """
+    result = defaultdict(list)
+    for identifier in identifiers:
+        object_path, pk = split_identifier(identifier)
+        if object_path is None or pk is None:
+            continue
+        if pk not in result[object_path]:
+            result[object_path].append(pk)
+
+    return result
+
+
+def load_instances(model_class, pks):
+    """
+    Loads instances of `model_class` with given `pks` in one single query
+
+    Returns a tuple (instances, missing_pks) where `missing_pks` are pks
+    of the instances which were not found (e.g. deleted in meantime).
+    """
+    found = model_class._default_manager.in_bulk(pks)
+    found_pks = set(str(pk) for pk in found.keys())
+    missing_pks = [pk for pk in pks if str(pk) not in found_pks]
+
+    return list(found.values()), missing_pks
+
+
+def update_index_instances(model_class, instances):
+    """Updates index of given instances with one call per search backend"""
+    for current_index, using in get_indexes(model_class):
+        instances_to_update = [
+            instance for instance in instances
+            if current_index.should_update(instance)
+        ]
+        if len(instances_to_update) == 0:
+            continue
+
+        backend = current_index.get_backend(using)
+        if backend is None:
+            continue
+
+        try:
+            backend.update(current_index, instances_to_update)
+        except Exception as exc:
+            logger.exception(exc)
+        else:
+            logger.debug(
+                f"Updated {len(instances_to_update)} of {model_class}"
+            )
+            invalidate_updated(instances_to_update)
+
+
+def invalidate_updated(instances):
+    """Invalidates cached search results of the owners of given instances"""
+    user_ids = [
+        instance.user_id for instance in instances
+        if getattr(instance, 'user_id', None) is not None
+    ]
+    if len(user_ids) > 0:
+        bump_generation(user_ids)
+
+
+def invalidate_removed(identifiers, user_ids=None):
+    """
+    Invalidates cached search results of the owners of given identifiers
+    (removed from the index)
+
+    `user_ids` maps identifiers to the IDs of their owners. If owner of
+    any identifier is unknown, cached results of all users are invalidated.
+    """
+    if len(identifiers) == 0:
+        return
+
+    user_ids = user_ids or {}
+
+    if any(user_ids.get(identifier) is None for identifier in identifiers):
+        bump_generation()
+    else:
+        bump_generation([user_ids[identifier] for identifier in identifiers])
+
+
+def remove_index_identifiers(model_class, identifiers):
+    """Removes given identifiers from the index"""
+    for current_index, using in get_indexes(model_class):
+        for identifier in identifiers:
+            try:
+                current_index.remove_object(identifier, using=using)
+            except Exception as exc:
+                logger.exception(exc)
+
+
+@shared_task
+def update_index_batch(
+    action,
+    identifiers,
+    user_ids=None
+):
+    """
+    Batch version of `update_index`
+
+    For 'save' action, instances of each model are loaded with one single
+    query and handed to search backend's `update` in one call; for 'delete'
+    action, each identifier is removed from the index (together with
+    pages of removed documents).
+    `user_ids` maps identifiers to the IDs of their owners
+    (see `invalidate_removed`).
+    """
+    logger.debug(
+        f"Update Index batch: action={action} count={len(identifiers)}"
+    )
+    if action not in ('save', 'delete'):
+        logger.error("Unrecognized action '%s'. Moving on..." % action)
+        raise ValueError("Unrecognized action %s" % action)
+
+    for object_path, pks in group_identifiers(identifiers).items():
+        model_class = get_model_class(object_path)
+
+        if action == 'delete':
+            removed = [f"{object_path}.{pk}" for pk in pks]
+            remove_index_identifiers(model_class, removed)
+            invalidate_removed(removed, user_ids)
+            continue
+
+        instances, missing_pks = load_instances(model_class, pks)
+        if len(missing_pks) > 0:
+            logger.debug(
+                f"{len(missing_pks)} of {object_path} "
+                "instances went missing before index update"
+            )
+        update_index_instances(model_class, instances)
+
+    if action == 'delete':
+        update_pages_index(get_document_ids(identifiers))
+
+
+@shared_task
+def update_index_coalesced(identifiers, user_ids=None, reindex_pages=None):
+    """
+    Brings index of given identifiers in sync with the database
+
+    Used by `papermerge.search.queue.IndexUpdateQueue`: by the time this
+    task runs (i.e. after the debounce window), identifiers may have been
+    saved and/or deleted several times. Which action to perform is decided
+    here, based on the current state: instances still present in
+    the database are (re)indexed, missing ones are removed from the index.
+    `user_ids` maps identifiers to the IDs of their owners
+    (see `invalidate_removed`).
+
+    Pages are (re)indexed only for the documents listed
+    in `reindex_pages` i.e. documents whose last version or pages' text
+    changed; pages of removed documents are removed from the index.
+    """
+    logger.debug(f"Update Index coalesced: count={len(identifiers)}")
+    # before the database is read: changes committed from now on
+    # will queue a new update
+    get_queue().release(identifiers, reindex_pages)
+    removed = []
+    for object_path, pks in group_identifiers(identifiers).items():
+        model_class = get_model_class(object_path)
+        instances, missing_pks = load_instances(model_class, pks)
+        update_index_instances(model_class, instances)
+        model_removed = [f"{object_path}.{pk}" for pk in missing_pks]
+        remove_index_identifiers(model_class, model_removed)
+        invalidate_removed(model_removed, user_ids)
+        removed.extend(model_removed)
+
+    update_pages_index(get_document_ids(list(reindex_pages or []) + removed))
+
+
+def get_document_ids(identifiers):
+    """Returns IDs of the documents among given identifiers"""
+    return group_identifiers(identifiers).get('core.document', [])
+
+
+def update_pages_index(document_ids):
+    """
+    Brings page level index of given documents in sync with the database
+
+    Pages of documents' last versions are (re)indexed, all other indexed
+    pages of these documents (i.e. pages of older versions or of deleted
+    documents) are removed from the index.
+    """
+    if len(document_ids) == 0:
+        return
+
+    pages = list(
+        last_version_pages(
+            Page.objects.filter(
+                document_version__document_id__in=document_ids
+            )
+        ).select_related('document_version__document__user')
+    )
+    page_ids = set(str(page.pk) for page in pages)
+
+    for index in range(0, len(pages), INDEX_BATCH_SIZE):
+        update_index_instances(Page, pages[index:index + INDEX_BATCH_SIZE])
+
+    stale_identifiers = set()
+    for _, using in get_indexes(Page):
+        indexed = SearchQuerySet(using=using).models(Page).filter(
+            document_id__in=[str(doc_id) for doc_id in document_ids]
+        )
+        position = 0
+        while True:
+            # (whole pages of results, some backends can't slice otherwise)
+            results = list(indexed[position:position + INDEX_BATCH_SIZE])
+            stale_identifiers.update(
+                f"core.page.{result.pk}" for result in results
+                if result.pk not in page_ids
+            )
+            if len(results) < INDEX_BATCH_SIZE:
+                break
+            position += INDEX_BATCH_SIZE
+
+    remove_index_identifiers(Page, sorted(stale_identifiers))
+
+
+def get_subtree_identifiers(node_ids):
+    """
+    Returns identifiers of all nodes in the subtrees of given nodes
+
+    Nodes themselves are included. Subtrees are looked up via
+    materialized path (`BaseTreeNode.tree_path`) i.e. no per-node queries
+    are performed.
+    """
+    tree_paths = list(
+        BaseTreeNode.objects.filter(
+            pk__in=node_ids
+        ).values_list('tree_path', flat=True)
+    )
+    result = []
+
+    for index in range(0, len(tree_paths), SUBTREES_BATCH_SIZE):
+        condition = Q()
+        for tree_path in tree_paths[index:index + SUBTREES_BATCH_SIZE]:
+            condition |= Q(tree_path__startswith=tree_path)
+
+        for node in BaseTreeNode.objects.filter(condition).only('id', 'ctype'):
+            if node.ctype in (NODE_TYPE_FOLDER, NODE_TYPE_DOCUMENT):
+                ctype = node.ctype
+            else:
+                ctype = node._type
+            result.append(f"core.{ctype}.{node.pk}")
+
+    return result
+
+
+@shared_task
+def update_index_subtrees(node_ids):
+    """
+    Updates index of all nodes in the subtrees of given nodes
+
+    Used after nodes were moved: breadcrumb of each node in moved subtrees
+    changes. Only one task is enqueued per move operation, no matter how
+    many nodes were moved.
+    """
+    identifiers = get_subtree_identifiers(node_ids)
+    logger.debug(
+        f"Update index of {len(identifiers)} nodes in "
+        f"{len(node_ids)} subtree(s)"
+    )
+    for index in range(0, len(identifiers), INDEX_BATCH_SIZE):
+        update_index_batch(
+            action='save',
+            identifiers=identifiers[index:index + INDEX_BATCH_SIZE]
+        )
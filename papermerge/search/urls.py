@@ -5,4 +5,5 @@ from papermerge.search import views
 
 urlpatterns = [
     path('', views.SearchView.as_view(), name='search'),
+    path('pages/', views.SearchPagesView.as_view(), name='search-pages'),
 ]
@@ -1,7 +1,9 @@
+import json
+
 from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
 
 from rest_framework.generics import GenericAPIView
-from rest_framework.response import Response
 from rest_framework.renderers import JSONRenderer
 
 from drf_spectacular.utils import (
@@ -9,13 +11,24 @@ from drf_spectacular.utils import (
     OpenApiParameter
 )
 from haystack.query import SearchQuerySet, SQ
+from papermerge.core.models import Document, Folder, Page
+from papermerge.core.renderers import NDJSONRenderer
+from papermerge.core.exceptions import APIBadRequest
 from papermerge.core.views.mixins import RequireAuthMixin
-from papermerge.search.serializers import SearchResultSerializer
+from papermerge.search import cache
+from papermerge.search.pagination import SearchCursorPagination
+from papermerge.search.serializers import (
+    PageSearchResultSerializer,
+    SearchResultSerializer
+)
 from papermerge.search.constants import (
     TAGS_OP_ALL,
     TAGS_OP_ANY
 )
 
+# number of results fetched from search backend at once while streaming
+STREAM_CHUNK_SIZE = 500
+
 
 class SearchView(RequireAuthMixin, GenericAPIView):
     """
@@ -23,10 +36,18 @@ class SearchView(RequireAuthMixin, GenericAPIView):
 
     Folders are matched by their title and assigned tags.
     Documents are matched by title, OCRed text and assigned tags.
+
+    Results are paginated (see ``SearchCursorPagination``). Export clients
+    may instead get all results, streamed as newline delimited JSON
+    (``Accept: application/x-ndjson`` or ``?format=ndjson``).
+
+    With shared Django cache, pages of results are cached (see
+    ``papermerge.search.cache``) until index of user's nodes changes.
     """
     resource_name = 'search'
     serializer_class = SearchResultSerializer
-    renderer_classes = [JSONRenderer]
+    renderer_classes = [JSONRenderer, NDJSONRenderer]
+    pagination_class = SearchCursorPagination
 
     @extend_schema(
         operation_id="Search",
@@ -110,7 +131,8 @@ class SearchView(RequireAuthMixin, GenericAPIView):
         }
     )
     def get(self, request):
-        query_text = request.query_params.get('q', '')
+        # (whitespace only query is same as no query)
+        query_text = ' '.join(request.query_params.get('q', '').split())
         if len(query_text) == 0:
             query_text = '*'
         query_tags = request.query_params.get('tags', '')
@@ -119,7 +141,32 @@ class SearchView(RequireAuthMixin, GenericAPIView):
         if tags_op not in (TAGS_OP_ALL, TAGS_OP_ANY):
             tags_op = TAGS_OP_ALL
 
-        query_all = SearchQuerySet().filter(user=request.user)
+        cache_key = None
+        if cache.is_enabled() and (
+            request.accepted_renderer.format != NDJSONRenderer.format
+        ):
+            # generation is read before the search, so that results of
+            # the search running concurrently with index update are
+            # cached under the generation which is about to be bumped
+            self.paginator.set_page(request)
+            cache_key = cache.results_key(
+                request.user.pk,
+                cache.get_generation(request.user.pk),
+                q=query_text.lower(),
+                tags=sorted(set(query_tags.split(','))) if query_tags else [],
+                tags_op=tags_op,
+                position=self.paginator.position,
+                page_size=self.paginator.page_size
+            )
+            cached = cache.get_results(cache_key)
+            if cached is not None:
+                data, self.paginator.has_next = cached
+                return self.get_paginated_response(data)
+
+        query_all = SearchQuerySet().models(
+            Document,
+            Folder
+        ).filter(user=request.user)
 
         query_all = self.add_filter_by_tags(
             query=query_all,
@@ -133,10 +180,38 @@ class SearchView(RequireAuthMixin, GenericAPIView):
                 query_text=query_text
             )
 
-        query_all = query_all.highlight()
-        serializer = SearchResultSerializer(query_all, many=True)
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return self.stream(query_all)
+
+        # lazy i.e. only results of the current page are fetched
+        # (and highlighted)
+        page = self.paginate_queryset(query_all.highlight())
+        data = list(SearchResultSerializer(page, many=True).data)
+        if cache_key is not None:
+            cache.set_results(cache_key, (data, self.paginator.has_next))
+
+        return self.get_paginated_response(data)
+
+    def stream(self, query: SearchQuerySet) -> StreamingHttpResponse:
+        """
+        Streams all results, one JSON document per line. Results are
+        fetched from the search backend in chunks of ``STREAM_CHUNK_SIZE``
+        while response is being sent.
+        """
+        def lines():
+            position = 0
+            while True:
+                chunk = list(query[position:position + STREAM_CHUNK_SIZE])
+                for item in SearchResultSerializer(chunk, many=True).data:
+                    yield json.dumps(item, default=str) + '\n'
+                if len(chunk) < STREAM_CHUNK_SIZE:
+                    break
+                position += STREAM_CHUNK_SIZE
 
-        return Response(serializer.data)
+        return StreamingHttpResponse(
+            lines(),
+            content_type=NDJSONRenderer.media_type
+        )
 
     def add_filter_by_content(
         self,
@@ -187,3 +262,73 @@ class SearchView(RequireAuthMixin, GenericAPIView):
             # Ensure queryset is re-evaluated on each request.
             queryset = queryset.all()
         return queryset
+
+
+class SearchPagesView(RequireAuthMixin, GenericAPIView):
+    """
+    Performs full text search on the pages of documents (of their last
+    versions).
+
+    Returns matching pages together with bounding boxes of matching
+    words, so that document viewer can jump straight to the page and
+    highlight the hits.
+    """
+    resource_name = 'search-pages'
+    serializer_class = PageSearchResultSerializer
+    renderer_classes = [JSONRenderer]
+    pagination_class = SearchCursorPagination
+
+    @extend_schema(
+        operation_id="Search pages",
+        parameters=[
+            OpenApiParameter(
+                name='q',
+                description='text to search',
+                required=True,
+                type=str,
+            ),
+            OpenApiParameter(
+                name='document_id',
+                description='search only pages of this document',
+                required=False,
+                type=str,
+            )
+        ]
+    )
+    def get(self, request):
+        query_text = request.query_params.get('q', '').strip()
+        if len(query_text) == 0:
+            raise APIBadRequest(detail='q parameter is required')
+
+        query = SearchQuerySet().models(Page).filter(
+            user=request.user
+        ).filter(
+            SQ(text__contains=query_text) | SQ(text=query_text)
+        )
+
+        document_id = request.query_params.get('document_id')
+        if document_id:
+            # pages of one document are listed in order
+            query = query.filter(document_id=document_id).order_by('number')
+
+        page = self.paginate_queryset(query)
+        titles = {
+            str(document_id): title
+            for document_id, title in Document.objects.filter(
+                pk__in=set(item.document_id for item in page)
+            ).values_list('id', 'title')
+        }
+        serializer = PageSearchResultSerializer(
+            page,
+            many=True,
+            context={
+                'terms': query_text.lower().split(),
+                'titles': titles
+            }
+        )
+
+        return self.get_paginated_response(serializer.data)
+
+    def get_queryset(self):
+        # workaround for `./manage.py generateschema`, same as in SearchView
+        return None
@@ -0,0 +1,16 @@
+from ..base import *   # noqa
+
+INSTALLED_APPS += [
+    'papermerge.search.apps.SearchConfig',
+]
+
+ROOT_URLCONF = 'tests.config.search.urls'
+
+HAYSTACK_CONNECTIONS = {
+    'default': {
+        'ENGINE': 'papermerge.search.sqlite_backend.SQLiteEngine',
+        'PATH': os.path.join(BASE_DIR, 'search_index.sqlite3'),
+    },
+}
+
+HAYSTACK_DOCUMENT_FIELD = 'indexed_content'
@@ -0,0 +1,290 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import pytest
+
+# S3 storage needs `s3` extra (boto3) and moto (dev dependency)
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from papermerge.core.lib.object_storage import (  # noqa: E402
+    CACHE_MIN_AGE,
+    S3Storage
+)
+from papermerge.core.lib.path import (  # noqa: E402
+    DocumentPath,
+    DownloadPath,
+    PagePath
+)
+
+BUCKET_NAME = 'papermerge-test'
+
+
+@moto.mock_aws
+class TestS3Storage(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._uploads = tempfile.TemporaryDirectory()
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET_NAME)
+        self.storage = S3Storage(
+            location=self._tmp.name,
+            bucket_name=BUCKET_NAME,
+            prefix='media',
+            # small parts, so that multipart upload/download is used
+            multipart_chunksize=5 * 1024 * 1024,
+            client_kwargs={'region_name': 'us-east-1'}
+        )
+        self.doc_path = DocumentPath(
+            user_id='1',
+            document_id='a',
+            file_name='doc.pdf',
+            version=1
+        )
+
+    def tearDown(self):
+        self._tmp.cleanup()
+        self._uploads.cleanup()
+
+    def upload_doc(self, content: bytes):
+        upload_path = os.path.join(self._uploads.name, 'doc.pdf')
+        with open(upload_path, 'wb') as f:
+            f.write(content)
+        self.storage.copy_doc(src=upload_path, dst=self.doc_path)
+
+    def evict(self, _path):
+        os.remove(self.storage.local_path(_path))
+
+    def make_old(self, local_path, age=CACHE_MIN_AGE + 10):
+        """Sets modification time of given file ``age`` seconds back"""
+        mtime = time.time() - age
+        os.utime(local_path, (mtime, mtime))
+
+    def write_file(self, url, content=b'data', upload=False):
+        local_path = self.storage.local_path(url)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, 'wb') as f:
+            f.write(content)
+        if upload:
+            self.storage.upload(url)
+        return local_path
+
+    def test_read_through_cache(self):
+        # bigger than one part i.e. multipart upload
+        content = os.urandom(6 * 1024 * 1024)
+        self.upload_doc(content)
+        self.evict(self.doc_path)
+
+        with open(self.storage.abspath(self.doc_path), 'rb') as f:
+            assert f.read() == content
+
+    def test_read_range(self):
+        self.upload_doc(b'0123456789')
+        self.evict(self.doc_path)
+
+        assert self.storage.read_range(self.doc_path, 2, 5) == b'2345'
+        # ranged read does not fetch the file
+        assert not os.path.exists(self.storage.local_path(self.doc_path))
+
+    def test_iter_range_streams_chunks(self):
+        self.upload_doc(b'0123456789')
+        self.evict(self.doc_path)
+
+        chunks = list(
+            self.storage.iter_range(self.doc_path, 1, 8, chunk_size=3)
+        )
+
+        assert b''.join(chunks) == b'12345678'
+        assert max(len(chunk) for chunk in chunks) <= 3
+        assert self.storage.size(self.doc_path) == 10
+        assert not os.path.exists(self.storage.local_path(self.doc_path))
+
+    def test_abspath_without_download(self):
+        self.upload_doc(b'0123456789')
+        self.evict(self.doc_path)
+
+        with mock.patch.object(self.storage, 'download') as download_mock:
+            self.storage.abspath(self.doc_path, download=False)
+
+        download_mock.assert_not_called()
+
+    def test_download_of_missing_object(self):
+        assert self.storage.download(self.doc_path) is None
+
+    def test_download_raises_on_other_errors(self):
+        error = ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': 'denied'}},
+            'GetObject'
+        )
+        with mock.patch.object(
+            self.storage.client,
+            'download_file',
+            side_effect=error
+        ):
+            with pytest.raises(ClientError):
+                self.storage.download(self.doc_path)
+
+        # no leftovers of the download
+        doc_dir = os.path.dirname(self.storage.local_path(self.doc_path))
+        assert os.listdir(doc_dir) == []
+
+    def test_copy_pages(self):
+        src = PagePath(document_path=self.doc_path, page_num=1)
+        dst_doc_path = DocumentPath.copy_from(self.doc_path, version=2)
+        dst = PagePath(document_path=dst_doc_path, page_num=1)
+        txt_path = self.storage.local_path(src.txt_url)
+        os.makedirs(os.path.dirname(txt_path), exist_ok=True)
+        with open(txt_path, 'w') as f:
+            f.write('page text')
+        self.storage.upload(self.doc_path.dirname_sidecars())
+
+        self.storage.copy_pages([(src, dst)])
+
+        assert self.storage.exists(dst.txt_url)
+        assert not self.storage.exists(dst.hocr_url)
+        with open(self.storage.abspath(dst.txt_url)) as f:
+            assert f.read() == 'page text'
+
+    def test_copy_pages_copies_previews(self):
+        src = PagePath(document_path=self.doc_path, page_num=1)
+        dst_doc_path = DocumentPath.copy_from(self.doc_path, version=2)
+        dst = PagePath(document_path=dst_doc_path, page_num=1)
+        preview_url = src.preview_tier_url('full')
+        preview_path = self.storage.local_path(preview_url)
+        os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+        with open(preview_path, 'w') as f:
+            f.write('preview')
+        self.storage.upload(src.preview_dirname)
+        self.storage.write_previews_manifest(self.doc_path, {
+            'format': 'jpeg',
+            'sizes': {'full': 900},
+            'pages': {'1': {'full': preview_url}}
+        })
+
+        self.storage.copy_pages([(src, dst)])
+
+        self.evict(dst_doc_path.previews_manifest_url)
+        manifest = self.storage.read_previews_manifest(dst_doc_path)
+        assert manifest['pages'] == {
+            '1': {'full': dst.preview_tier_url('full')}
+        }
+        with open(self.storage.abspath(dst.preview_tier_url('full'))) as f:
+            assert f.read() == 'preview'
+
+    def test_delete_doc(self):
+        self.upload_doc(b'%PDF-1.4')
+
+        self.storage.delete_doc(self.doc_path)
+
+        assert not self.storage.exists(self.doc_path)
+
+    def test_listdir_and_delete_dir(self):
+        download_path = DownloadPath(
+            user_id='1',
+            download_id='b',
+            file_name='nodes.zip'
+        )
+        local_path = self.storage.local_path(download_path.url)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, 'wb') as f:
+            f.write(b'PK')
+        self.storage.upload(download_path.url)
+        # i.e. file is listed by a node which does not have it
+        self.evict(download_path.url)
+
+        assert self.storage.listdir(download_path.dirname) == ['nodes.zip']
+
+        self.storage.delete_dir(download_path.dirname)
+
+        assert self.storage.listdir(download_path.dirname) == []
+        assert not self.storage.exists(download_path.url)
+
+    def test_list_files(self):
+        page_path = PagePath(document_path=self.doc_path, page_num=1)
+        for url in (page_path.txt_url, page_path.hocr_url):
+            local_path = self.storage.local_path(url)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, 'w') as f:
+                f.write('text')
+            self.storage.upload(url)
+        # i.e. file is listed by a node which does not have it
+        self.evict(page_path.txt_url)
+
+        files = self.storage.list_files(
+            self.doc_path.dirname_sidecars()
+        )
+
+        assert files == {
+            os.path.normpath(page_path.txt_url),
+            os.path.normpath(page_path.hocr_url)
+        }
+
+    def test_collect_garbage_evicts_cache(self):
+        self.storage.cache_max_size = 5
+        self.upload_doc(b'0123456789')
+        self.make_old(self.storage.local_path(self.doc_path))
+
+        assert self.storage.collect_garbage() == 1
+        # evicted file is still in the bucket
+        assert self.storage.exists(self.doc_path)
+
+    def test_collect_garbage_evicts_least_recently_used(self):
+        page_path = PagePath(document_path=self.doc_path, page_num=1)
+        self.upload_doc(b'0123456789')
+        txt_path = self.write_file(page_path.txt_url, upload=True)
+        self.make_old(self.storage.local_path(self.doc_path), age=2 * 3600)
+        self.make_old(txt_path)
+        # document is used i.e. it becomes the most recently used file
+        self.storage.abspath(self.doc_path)
+        self.make_old(self.storage.local_path(self.doc_path))
+        self.storage.cache_max_size = 12
+
+        assert self.storage.collect_garbage() == 1
+        assert os.path.exists(self.storage.local_path(self.doc_path))
+        assert not os.path.exists(txt_path)
+
+    def test_collect_garbage_keeps_files_not_in_bucket(self):
+        self.storage.cache_max_size = 1
+        sidecars = self.doc_path.dirname_sidecars()
+        not_uploaded = [
+            self.write_file(f"{sidecars}ocr/page-1.pdf"),
+            self.write_file(f"{sidecars}chunks/1-2/page-1.pdf"),
+            self.write_file(f"{sidecars}incremental/input.pdf"),
+            self.write_file('thumbnails/1/a.jpg'),
+            self.write_file(DownloadPath(
+                user_id='1',
+                download_id='b',
+                file_name='x.zip'
+            ).part_url),
+            self.write_file(self.doc_path.url + '.abc.download'),
+        ]
+        # recently written i.e. maybe not uploaded yet
+        recent = self.write_file(f"{sidecars}pages/page_1.txt")
+        for path in not_uploaded:
+            self.make_old(path)
+
+        assert self.storage.collect_garbage() == 0
+        for path in not_uploaded + [recent]:
+            assert os.path.exists(path)
+
+    def test_download_collects_garbage(self):
+        self.upload_doc(b'0123456789')
+        page_path = PagePath(document_path=self.doc_path, page_num=1)
+        txt_path = self.write_file(page_path.txt_url, upload=True)
+        self.make_old(txt_path)
+        self.evict(self.doc_path)
+        self.storage.cache_max_size = 12
+        # size of the cache is known (i.e. 4 bytes)
+        self.storage.collect_garbage()
+
+        # cache grows over the max size with the fetched document
+        self.storage.abspath(self.doc_path)
+
+        assert not os.path.exists(txt_path)
+        assert os.path.exists(self.storage.local_path(self.doc_path))
@@ -0,0 +1,348 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from PIL import Image
+
+from papermerge.core.lib import storage as storage_module
+from papermerge.core.lib.path import DocumentPath, PagePath
+from papermerge.core.lib.previews import _save_tiers
+from papermerge.core.lib.storage import (
+    BlobFileSystemStorage,
+    FileSystemStorage,
+    LINK,
+    link_file,
+    replaced_file
+)
+
+
+class TestBlobFileSystemStorage(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._uploads = tempfile.TemporaryDirectory()
+        self.storage = BlobFileSystemStorage(location=self._tmp.name)
+        self.upload_path = os.path.join(self._uploads.name, 'upload.pdf')
+        with open(self.upload_path, 'wb') as f:
+            f.write(b'%PDF-1.4 same content')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+        self._uploads.cleanup()
+
+    def doc_path(self, document_id, version=0):
+        return DocumentPath(
+            user_id='1',
+            document_id=document_id,
+            file_name='upload.pdf',
+            version=version
+        )
+
+    def test_identical_documents_are_stored_once(self):
+        self.storage.copy_doc(src=self.upload_path, dst=self.doc_path('a'))
+        self.storage.copy_doc(src=self.upload_path, dst=self.doc_path('b'))
+
+        stat_a = os.stat(self.storage.abspath(self.doc_path('a')))
+        stat_b = os.stat(self.storage.abspath(self.doc_path('b')))
+
+        assert stat_a.st_ino == stat_b.st_ino
+        # blob itself + two documents
+        assert stat_a.st_nlink == 3
+
+    def test_copy_page_links_sidecars(self):
+        src = PagePath(document_path=self.doc_path('a'), page_num=1)
+        dst = PagePath(document_path=self.doc_path('a', 1), page_num=1)
+        os.makedirs(
+            os.path.dirname(self.storage.abspath(src.txt_url)),
+            exist_ok=True
+        )
+        with open(self.storage.abspath(src.txt_url), 'w') as f:
+            f.write('page text')
+
+        self.storage.copy_page(src=src, dst=dst)
+
+        assert os.path.samefile(
+            self.storage.abspath(src.txt_url),
+            self.storage.abspath(dst.txt_url)
+        )
+
+    def blobs(self):
+        return [
+            file_name
+            for _, _, file_names in os.walk(self.storage.abspath('blobs'))
+            for file_name in file_names
+        ]
+
+    def test_delete_doc_removes_unused_blobs(self):
+        self.storage.copy_doc(src=self.upload_path, dst=self.doc_path('a'))
+        self.storage.copy_doc(src=self.upload_path, dst=self.doc_path('b'))
+
+        self.storage.delete_doc(self.doc_path('a'))
+        # blob is still used by document 'b'
+        assert len(self.blobs()) == 1
+
+        self.storage.delete_doc(self.doc_path('b'))
+        assert self.blobs() == []
+
+    def test_delete_doc_checks_only_its_blobs(self):
+        self.storage.copy_doc(src=self.upload_path, dst=self.doc_path('a'))
+
+        with patch.object(
+            self.storage,
+            'collect_garbage',
+            side_effect=AssertionError('full sweep')
+        ), patch.object(
+            self.storage,
+            'collect_blobs',
+            wraps=self.storage.collect_blobs
+        ) as collect_blobs_mock:
+            self.storage.delete_doc(self.doc_path('a'))
+
+        assert self.blobs() == []
+        collect_blobs_mock.assert_called_once()
+        (blobs,), _ = collect_blobs_mock.call_args
+        assert len(blobs) == 1
+
+    def test_delete_user_data_removes_unused_blobs(self):
+        self.storage.copy_doc(src=self.upload_path, dst=self.doc_path('a'))
+
+        self.storage.delete_user_data('1')
+
+        assert self.blobs() == []
+
+    def test_collect_garbage(self):
+        self.storage.copy_doc(src=self.upload_path, dst=self.doc_path('a'))
+        # removed outside of the storage i.e. blob is not collected
+        os.remove(self.storage.abspath(self.doc_path('a')))
+
+        assert self.storage.collect_garbage() == 1
+        assert self.blobs() == []
+
+
+class TestFileSystemStorageLinkMode(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.storage = FileSystemStorage(
+            location=self._tmp.name,
+            copy_mode=LINK
+        )
+        self.src_doc_path = DocumentPath(
+            user_id='1',
+            document_id='a',
+            file_name='doc.pdf',
+            version=1
+        )
+        self.dst_doc_path = DocumentPath.copy_from(
+            self.src_doc_path,
+            version=2
+        )
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def make_page_files(self, page_num):
+        page_path = PagePath(
+            document_path=self.src_doc_path,
+            page_num=page_num
+        )
+        for url in (page_path.txt_url, page_path.jpg_url):
+            os.makedirs(
+                os.path.dirname(self.storage.abspath(url)),
+                exist_ok=True
+            )
+            with open(self.storage.abspath(url), 'w') as f:
+                f.write(f'page {page_num}')
+
+    def test_copy_pages(self):
+        page_paths = []
+        for page_num in range(1, 4):
+            self.make_page_files(page_num)
+            page_paths.append((
+                PagePath(document_path=self.src_doc_path, page_num=page_num),
+                PagePath(document_path=self.dst_doc_path, page_num=page_num)
+            ))
+
+        with patch.object(
+            storage_module,
+            'listdir',
+            wraps=storage_module.listdir
+        ) as listdir_mock, patch.object(
+            self.storage,
+            'list_files',
+            wraps=self.storage.list_files
+        ) as list_files_mock:
+            self.storage.copy_pages(page_paths)
+
+        # pages folder of source version is listed once, as a whole
+        list_files_mock.assert_called_once_with(
+            self.src_doc_path.dirname_sidecars()
+        )
+        listdir_mock.assert_not_called()
+
+        for src, dst in page_paths:
+            for url in (src.txt_url, src.jpg_url):
+                dst_url = url.replace('/v1/', '/v2/')
+                # sidecars and images are linked
+                assert os.path.samefile(
+                    self.storage.abspath(url),
+                    self.storage.abspath(dst_url)
+                )
+
+    def test_copy_pages_links_preview_tiers(self):
+        src = PagePath(document_path=self.src_doc_path, page_num=1)
+        dst = PagePath(document_path=self.dst_doc_path, page_num=1)
+        url = src.preview_tier_url('full', 'webp')
+        os.makedirs(
+            os.path.dirname(self.storage.abspath(url)),
+            exist_ok=True
+        )
+        with open(self.storage.abspath(url), 'w') as f:
+            f.write('preview')
+        self.storage.write_previews_manifest(self.src_doc_path, {
+            'format': 'webp',
+            'sizes': {'full': 900},
+            'pages': {'1': {'full': url}}
+        })
+
+        self.storage.copy_pages([(src, dst)])
+
+        assert os.path.samefile(
+            self.storage.abspath(url),
+            self.storage.abspath(dst.preview_tier_url('full', 'webp'))
+        )
+
+    def test_regenerated_preview_leaves_its_links_untouched(self):
+        src = PagePath(document_path=self.src_doc_path, page_num=1)
+        dst = PagePath(document_path=self.dst_doc_path, page_num=1)
+        src_path = self.storage.abspath(src.preview_tier_url('full'))
+        dst_path = self.storage.abspath(dst.preview_tier_url('full'))
+        os.makedirs(os.path.dirname(src_path), exist_ok=True)
+        with open(src_path, 'w') as f:
+            f.write('preview')
+        self.storage.copy_file(src_path, dst_path)
+
+        # e.g. previews of new version are regenerated
+        _save_tiers(
+            Image.new('RGB', (20, 20), 'white'),
+            page_number=1,
+            sizes={'full': 10},
+            tier_path=lambda number, tier: dst_path,
+            fmt='jpeg'
+        )
+
+        with open(src_path) as f:
+            assert f.read() == 'preview'
+        assert not os.path.samefile(src_path, dst_path)
+
+    def test_replaced_linked_sidecar_leaves_its_links_untouched(self):
+        self.make_page_files(1)
+        src = PagePath(document_path=self.src_doc_path, page_num=1)
+        dst = PagePath(document_path=self.dst_doc_path, page_num=1)
+        self.storage.copy_page(src=src, dst=dst)
+
+        # e.g. new version is OCRed again
+        with replaced_file(self.storage.abspath(dst.txt_url)) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                f.write('new text')
+
+        with open(self.storage.abspath(dst.txt_url)) as f:
+            assert f.read() == 'new text'
+        with open(self.storage.abspath(src.txt_url)) as f:
+            assert f.read() == 'page 1'
+
+    def test_link_file_from_multiple_threads(self):
+        src_paths = []
+        for name in ('a.txt', 'b.txt'):
+            src_paths.append(os.path.join(self._tmp.name, name))
+            with open(src_paths[-1], 'w') as f:
+                f.write(name)
+        dst_path = os.path.join(self._tmp.name, 'linked.txt')
+
+        # threads replace the link with link of the other file
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda index: link_file(src_paths[index % 2], dst_path),
+                range(400)
+            ))
+
+        assert sorted(os.listdir(self._tmp.name)) == [
+            'a.txt', 'b.txt', 'linked.txt'
+        ]
+
+
+class TestCopyPagePreviews(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.storage = FileSystemStorage(location=self._tmp.name)
+        self.src_doc_path = DocumentPath(
+            user_id='1',
+            document_id='a',
+            file_name='doc.pdf',
+            version=1
+        )
+        self.dst_doc_path = DocumentPath.copy_from(
+            self.src_doc_path,
+            version=2
+        )
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def write(self, url, content):
+        path = self.storage.abspath(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def read(self, url):
+        with open(self.storage.abspath(url)) as f:
+            return f.read()
+
+    def test_copy_pages_copies_preview_tiers(self):
+        manifest = {
+            'format': 'webp',
+            'sizes': {'thumbnail': 150, 'full': 900},
+            'pages': {}
+        }
+        for page_num in (1, 2):
+            page_path = PagePath(
+                document_path=self.src_doc_path,
+                page_num=page_num
+            )
+            manifest['pages'][str(page_num)] = {}
+            for tier in ('thumbnail', 'full'):
+                url = page_path.preview_tier_url(tier, 'webp')
+                self.write(url, f'{tier} {page_num}')
+                manifest['pages'][str(page_num)][tier] = url
+        self.storage.write_previews_manifest(self.src_doc_path, manifest)
+
+        # page 2 becomes page 1 (e.g. page 1 was deleted)
+        self.storage.copy_pages([(
+            PagePath(document_path=self.src_doc_path, page_num=2),
+            PagePath(document_path=self.dst_doc_path, page_num=1)
+        )])
+
+        dst_manifest = self.storage.read_previews_manifest(self.dst_doc_path)
+        assert dst_manifest['format'] == 'webp'
+        assert dst_manifest['sizes'] == manifest['sizes']
+        assert set(dst_manifest['pages'].keys()) == {'1'}
+        dst = PagePath(document_path=self.dst_doc_path, page_num=1)
+        for tier in ('thumbnail', 'full'):
+            url = dst_manifest['pages']['1'][tier]
+            assert url == dst.preview_tier_url(tier, 'webp')
+            assert self.read(url) == f'{tier} 2'
+
+    def test_copy_pages_copies_legacy_preview(self):
+        src = PagePath(document_path=self.src_doc_path, page_num=1)
+        dst = PagePath(document_path=self.dst_doc_path, page_num=1)
+        # document created before preview tiers i.e. without manifest
+        self.write(src.preview_url, 'legacy preview')
+
+        self.storage.copy_pages([(src, dst)])
+
+        assert self.read(dst.preview_url) == 'legacy preview'
+        assert self.storage.read_previews_manifest(self.dst_doc_path) == {}
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+from papermerge.core.lib import thumbnails
+from papermerge.core.lib.thumbnails import ThumbnailCache
+
+
+class TestThumbnailCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.src_path = os.path.join(self._tmp.name, 'preview.jpg')
+        Image.new('RGB', (200, 400), 'white').save(self.src_path)
+        self.cache = ThumbnailCache(
+            location=os.path.join(self._tmp.name, 'thumbnails'),
+            max_size=10 * 1024 * 1024
+        )
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def get_thumbnail(self, key, width=100):
+        return self.cache.get_or_create(
+            key=key,
+            src_path=self.src_path,
+            width=width,
+            fmt='jpeg'
+        )
+
+    def test_get_or_create(self):
+        path = self.get_thumbnail('abc.jpg')
+
+        with Image.open(path) as image:
+            assert image.size == (100, 200)
+        # cache hit returns the same file
+        assert self.get_thumbnail('abc.jpg') == path
+
+    def test_evict_least_recently_used(self):
+        old_path = self.get_thumbnail('old.jpg')
+        new_path = self.get_thumbnail('new.jpg')
+        os.utime(old_path, (0, 0))
+        self.cache.max_size = os.path.getsize(new_path)
+
+        assert self.cache.evict() == 1
+        assert not os.path.exists(old_path)
+        assert os.path.exists(new_path)
+
+    def test_cache_is_scanned_only_when_it_grows_over_max_size(self):
+        with patch.object(
+            thumbnails.os,
+            'walk',
+            wraps=os.walk
+        ) as walk_mock:
+            first_path = self.get_thumbnail('first.jpg')
+            self.get_thumbnail('second.jpg')
+            self.get_thumbnail('third.jpg')
+            # size is measured once, then only tracked
+            assert walk_mock.call_count == 1
+
+            self.cache.max_size = 2 * os.path.getsize(first_path)
+            self.get_thumbnail('fourth.jpg')
+
+            assert walk_mock.call_count == 2
+
+        # evicted below max size (i.e. to low watermark)
+        thumbnail_sizes = [
+            os.path.getsize(os.path.join(root, file_name))
+            for root, _, file_names in os.walk(self.cache.location)
+            for file_name in file_names
+        ]
+        assert sum(thumbnail_sizes) <= self.cache.max_size
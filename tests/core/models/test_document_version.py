@@ -1,7 +1,12 @@
 import io
+import os
+from unittest.mock import patch
+
+from PIL import Image
 
 from papermerge.test import TestCase
 from papermerge.core.models import (User, Document)
+from papermerge.core.storage import abs_path
 from papermerge.test import maker
 
 
@@ -227,3 +232,101 @@ class TestDocumentVersionModel(TestCase):
         # string as result
         expected = ""
         assert expected == actual
+
+    def test_create_pages_number_of_queries(self):
+        """
+        Pages are created with one INSERT no matter how many pages
+        document version has. One more query updates version's page count.
+        """
+        with self.assertNumQueries(2):
+            self.doc_version.create_pages(page_count=50)
+
+        assert self.doc_version.page_count == 50
+        assert list(
+            self.doc_version.pages.values_list('number', flat=True)
+        ) == list(range(1, 51))
+
+    def test_update_text_field_number_of_queries(self):
+        """
+        All pages are updated with one query, no matter how many
+        pages document version has
+        """
+        self.doc_version.create_pages(page_count=20)
+        streams = [io.StringIO(f'page {number}') for number in range(1, 21)]
+
+        # select pages, bulk update pages, update document version
+        with self.assertNumQueries(3):
+            has_combined_text = self.doc_version.update_text_field(streams)
+
+        assert has_combined_text
+        assert self.doc_version.text == ' '.join(
+            f'page {number}' for number in range(1, 21)
+        )
+        assert self.doc_version.pages.get(number=20).text == 'page 20'
+
+
+def fake_convert_from_path(pdf_path, first_page, last_page, size, **_):
+    return [
+        Image.new('RGB', (size[0], size[0] * 2), 'white')
+        for _ in range(first_page, last_page + 1)
+    ]
+
+
+@patch(
+    'papermerge.core.lib.previews.convert_from_path',
+    side_effect=fake_convert_from_path
+)
+class TestDocumentVersionPreviews(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.doc = Document.objects.create_document(
+            title="invoice.pdf",
+            lang="deu",
+            user_id=self.user.pk,
+            parent=self.user.home_folder
+        )
+        self.doc_version = self.doc.versions.last()
+        self.doc_version.page_count = 3
+        self.doc_version.save()
+
+    def test_generate_previews(self, convert_mock):
+        sizes = {'thumbnail': 100, 'full': 300}
+        with self.settings(
+            PAPERMERGE_PREVIEW_SIZES=sizes,
+            PAPERMERGE_PREVIEW_FORMAT='webp',
+            PAPERMERGE_PREVIEW_BATCH_SIZE=2
+        ):
+            self.doc_version.generate_previews()
+
+        # 3 pages in batches of 2 pages, each rendered once (at max width)
+        assert convert_mock.call_count == 2
+        manifest = self.doc_version.previews_manifest()
+        assert manifest['format'] == 'webp'
+        assert set(manifest['pages'].keys()) == {'1', '2', '3'}
+
+        for tier, width in sizes.items():
+            url = manifest['pages']['2'][tier]
+            assert url.endswith('.webp')
+            with Image.open(abs_path(url)) as image:
+                assert image.format == 'WEBP'
+                assert image.width == width
+
+    def test_generate_previews_of_one_page(self, convert_mock):
+        self.doc_version.generate_previews()
+        full_url = self.doc_version.previews_manifest()['pages']['2']['full']
+        os.remove(abs_path(full_url))
+
+        self.doc_version.generate_previews(page_number=2)
+
+        convert_mock.assert_called_with(
+            abs_path(self.doc_version.document_path.url),
+            first_page=2,
+            last_page=2,
+            size=(900,),
+            thread_count=4
+        )
+        manifest = self.doc_version.previews_manifest()
+        # previews of other pages are still in the manifest
+        assert set(manifest['pages'].keys()) == {'1', '2', '3'}
+        assert os.path.exists(abs_path(full_url))
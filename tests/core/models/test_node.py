@@ -1,12 +1,22 @@
 import pytest
+from unittest.mock import patch
+
+from django.db import DatabaseError, transaction
 
 from papermerge.test import TestCase
 from papermerge.test.baker_recipes import (
     folder_recipe,
+    document_recipe,
     user_recipe, make_folders
 )
 from papermerge.core.models import User, Folder, BaseTreeNode, Document
-from papermerge.core.models.node import NODE_TYPE_FOLDER, NODE_TYPE_DOCUMENT
+from papermerge.core.tasks import delete_documents_data
+from papermerge.core.models.node import (
+    NODE_TYPE_FOLDER,
+    NODE_TYPE_DOCUMENT,
+    move_node,
+    move_nodes
+)
 
 
 class TestNodeModel(TestCase):
@@ -39,6 +49,92 @@ class TestNodeModel(TestCase):
         # Now retrieve tags via Node (BaseTreeNode) model
         assert node.tags.count() == 2
 
+    def test_prefetch_tags_of_folders(self):
+        folder = Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.inbox_folder
+        )
+        folder.tags.set(
+            ['folder_a', 'folder_b'],
+            tag_kwargs={"user": self.user}
+        )
+
+        folders = list(
+            Folder.objects.filter(user=self.user).prefetch_related('tags')
+        )
+
+        with self.assertNumQueries(0):
+            tags = {
+                item.title: sorted(tag.name for tag in item.tags.all())
+                for item in folders
+            }
+        assert tags['My Documents'] == ['folder_a', 'folder_b']
+        assert tags[Folder.INBOX_TITLE] == []
+
+    @patch('papermerge.core.signals.delete_documents_data')
+    def test_delete_schedules_one_files_cleanup_task(self, task_mock):
+        """
+        Files of all documents deleted together with their folders
+        are removed by one single background task
+        """
+        folder_b = make_folders(".home/A/B", user=self.user)
+        folder_a = Folder.objects.get(title="A", user=self.user)
+        doc_a = document_recipe.make(user=self.user, parent=folder_a)
+        doc_b = document_recipe.make(user=self.user, parent=folder_b)
+        doc_c = document_recipe.make(
+            user=self.user,
+            parent=self.user.inbox_folder
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BaseTreeNode.objects.filter(
+                pk__in=[folder_a.pk, doc_c.pk]
+            ).delete()
+
+        task_mock.apply_async.assert_called_once()
+        documents = task_mock.apply_async.call_args.kwargs['kwargs'][
+            'documents'
+        ]
+        assert sorted(documents) == sorted([
+            [str(self.user.pk), str(doc.pk)]
+            for doc in (doc_a, doc_b, doc_c)
+        ])
+
+    @patch('papermerge.core.signals.delete_documents_data')
+    def test_rolled_back_deletes_are_skipped(self, task_mock):
+        """
+        Documents of rolled back delete are sent with the next commit,
+        but their files are not deleted, as documents still exist
+        """
+        inbox = self.user.inbox_folder
+        doc_a = document_recipe.make(user=self.user, parent=inbox)
+        doc_b = document_recipe.make(user=self.user, parent=inbox)
+
+        with self.assertRaises(DatabaseError):
+            with transaction.atomic():
+                doc_a.delete()
+                raise DatabaseError()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            doc_b.delete()
+
+        task_mock.apply_async.assert_called_once()
+        documents = task_mock.apply_async.call_args.kwargs['kwargs'][
+            'documents'
+        ]
+        assert [str(self.user.pk), str(doc_b.pk)] in documents
+        assert Document.objects.filter(pk=doc_a.pk).exists()
+
+        with patch('papermerge.core.tasks.get_storage_instance') as storage:
+            delete_documents_data(documents)
+
+        deleted = [
+            call.args[0].document_id
+            for call in storage.return_value.delete_doc.call_args_list
+        ]
+        assert deleted == [str(doc_b.pk)]
+
     def test_node_ctype_for_folder(self):
         """
         assert that node's ctype field is set correctly.
@@ -325,3 +421,139 @@ def test_get_by_breadcrumb_non_existing_path():
     user = user_recipe.make()
     with pytest.raises(Folder.DoesNotExist):
         Folder.objects.get_by_breadcrumb(".home/My Documents/", user)
+
+
+@pytest.mark.django_db
+def test_tree_path_of_descendants_is_updated_after_move():
+    """
+    When node is moved to another parent, materialized path of all
+    its descendants is updated as well.
+
+    Initial structure:
+
+        .home > A > B > C
+
+    After moving A under .inbox, breadcrumb of C is expected to
+    be .inbox/A/B/C/
+    """
+    user = user_recipe.make()
+    folder_c = make_folders(".home/A/B/C", user=user)
+    folder_a = Folder.objects.get(title="A", user=user)
+
+    move_node(folder_a, user.inbox_folder)
+
+    folder_c.refresh_from_db()
+    assert folder_c.breadcrumb == ".inbox/A/B/C/"
+    assert folder_c.tree_path.startswith(user.inbox_folder.tree_path)
+
+    inbox_descendants = [
+        node.title
+        for node in user.inbox_folder.get_descendants(include_self=False)
+    ]
+    assert sorted(inbox_descendants) == ["A", "B", "C"]
+    assert user.home_folder.get_descendants(include_self=False).count() == 0
+
+
+@pytest.mark.django_db
+def test_tree_path_is_not_affected_by_title_rename():
+    user = user_recipe.make()
+    folder_b = make_folders(".home/A/B", user=user)
+    folder_a = Folder.objects.get(title="A", user=user)
+    old_tree_path = folder_b.tree_path
+
+    folder_a.title = "A renamed"
+    folder_a.save()
+
+    folder_b.refresh_from_db()
+    assert folder_b.tree_path == old_tree_path
+    assert folder_b.breadcrumb == ".home/A renamed/B/"
+
+
+@pytest.mark.django_db
+def test_move_nodes_rewrites_path_of_all_moved_subtrees():
+    """
+    Initial structure:
+
+        .home > A > A1 > A2
+        .home > B > B1
+
+    After moving A and B under .inbox, breadcrumbs of A2 and B1 are expected
+    to be .inbox/A/A1/A2/ and .inbox/B/B1/
+    """
+    user = user_recipe.make()
+    folder_a2 = make_folders(".home/A/A1/A2", user=user)
+    folder_b1 = make_folders(".home/B/B1", user=user)
+    folder_a = Folder.objects.get(title="A", user=user)
+    folder_b = Folder.objects.get(title="B", user=user)
+
+    move_nodes(
+        node_ids=[folder_a.pk, folder_b.pk],
+        target_node=user.inbox_folder
+    )
+
+    folder_a2.refresh_from_db()
+    folder_b1.refresh_from_db()
+    assert folder_a2.breadcrumb == ".inbox/A/A1/A2/"
+    assert folder_b1.breadcrumb == ".inbox/B/B1/"
+    assert user.home_folder.get_descendants(include_self=False).count() == 0
+
+
+@pytest.mark.django_db
+def test_move_nodes_node_and_its_descendant():
+    """
+    Moving both a node and one of its descendants to the same target
+    places both of them directly under the target.
+    """
+    user = user_recipe.make()
+    folder_c = make_folders(".home/A/B/C", user=user)
+    folder_a = Folder.objects.get(title="A", user=user)
+    folder_b = Folder.objects.get(title="B", user=user)
+
+    move_nodes(
+        node_ids=[folder_a.pk, folder_b.pk],
+        target_node=user.inbox_folder
+    )
+
+    folder_c.refresh_from_db()
+    folder_a.refresh_from_db()
+    assert folder_c.breadcrumb == ".inbox/B/C/"
+    assert folder_a.breadcrumb == ".inbox/A/"
+
+
+@pytest.mark.django_db
+def test_move_nodes_inside_own_subtree_is_not_allowed():
+    user = user_recipe.make()
+    folder_b = make_folders(".home/A/B", user=user)
+    folder_a = Folder.objects.get(title="A", user=user)
+
+    with pytest.raises(ValueError):
+        move_nodes(node_ids=[folder_a.pk], target_node=folder_b)
+
+    folder_b.refresh_from_db()
+    assert folder_b.breadcrumb == ".home/A/B/"
+
+
+@pytest.mark.django_db
+def test_delete_removes_whole_subtrees():
+    """
+    Deleting a queryset removes its nodes together with all their
+    descendants, even when queryset contains both a node and
+    one of its descendants
+    """
+    user = user_recipe.make()
+    make_folders(".home/A/B/C", user=user)
+    make_folders(".home/D/E", user=user)
+    folder_a = Folder.objects.get(title="A", user=user)
+    folder_b = Folder.objects.get(title="B", user=user)
+    document_recipe.make(user=user, parent=folder_b)
+
+    total, per_model = BaseTreeNode.objects.filter(
+        pk__in=[folder_a.pk, folder_b.pk]
+    ).delete()
+
+    left_titles = set(
+        BaseTreeNode.objects.filter(user=user).values_list('title', flat=True)
+    )
+    assert left_titles == {Folder.INBOX_TITLE, Folder.HOME_TITLE, "D", "E"}
+    assert per_model['core.Document'] == 1
+    assert per_model['core.Folder'] == 3
@@ -1,8 +1,9 @@
 from unittest.mock import patch
 from django.contrib.auth.models import Permission
 
-from papermerge.core.models import User
+from papermerge.core.models import User, BaseTreeNode
 from papermerge.test import TestCase
+from papermerge.test.baker_recipes import make_folders
 from model_bakery import baker
 
 
@@ -82,3 +83,15 @@ class TestUserModel(TestCase):
         user = baker.make('core.user')
         baker.make('core.Document', user=user)
         user.delete()
+
+    @patch('papermerge.core.signals.delete_user_data_task')
+    def test_user_delete_removes_all_his_nodes(self, _):
+        user = baker.make('core.user')
+        folder = make_folders(".home/A/B", user=user)
+        baker.make('core.Document', user=user, parent=folder)
+        baker.make('core.Document', user=user, parent=user.inbox_folder)
+
+        user.delete()
+
+        assert User.objects.filter(pk=user.pk).count() == 0
+        assert BaseTreeNode.objects.filter(user=user).count() == 0
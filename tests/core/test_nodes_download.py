@@ -1,6 +1,13 @@
+import io
+import os
+import tarfile
+import tempfile
+import zipfile
+from unittest.mock import patch
+
 from django.test import TestCase
 
-from papermerge.core.models import Document, User
+from papermerge.core.models import Document, Folder, User
 from papermerge.core.serializers.node import (
     NodesDownloadSerializer,
     TARGZ
@@ -9,8 +16,10 @@ from papermerge.core.nodes_download import (
     get_nodes_download,
     NodesDownloadDocument,
     NodesDownloadZip,
-    NodesDownloadTarGz
+    NodesDownloadTarGz,
+    StreamBuffer
 )
+from papermerge.test import maker
 
 
 class TestNodesDownload(TestCase):
@@ -83,3 +92,132 @@ class TestNodesDownload(TestCase):
             # should never reach this place as serialized data is
             # expected to be valid
             self.assertTrue(False)
+
+
+@patch('papermerge.core.signals.ocr_document_task')
+@patch('papermerge.core.signals.generate_page_previews_task')
+@patch('papermerge.core.nodes_download.CHUNK_SIZE', 4096)
+class TestNodesDownloadArchiveStream(TestCase):
+    """
+    Archives are streamed in chunks bounded by CHUNK_SIZE
+    (plus archive's own headers)
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1")
+        self.folder = Folder.objects.create(
+            title="invoices",
+            user=self.user,
+            parent=self.user.home_folder
+        )
+
+    def _make_documents(self):
+        doc_1 = maker.document("s3.pdf", user=self.user)
+        doc_2 = maker.document("d3.pdf", user=self.user)
+        doc_2.parent = self.folder
+        doc_2.save()
+
+        return doc_1, doc_2
+
+    def test_zip_stream(self, *_):
+        doc_1, doc_2 = self._make_documents()
+        download = NodesDownloadZip(node_ids=[doc_1.pk, self.folder.pk])
+
+        chunks = list(download.stream())
+
+        assert len(chunks) > 2
+        assert max(len(chunk) for chunk in chunks) < 2 * 4096
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        names = set(archive.namelist())
+        assert names == {
+            doc_1.idified_title,
+            f"{self.folder.idified_title}/{doc_2.idified_title}"
+        }
+        doc_1_path = doc_1.versions.last().abs_file_path()
+        with open(doc_1_path, 'rb') as f:
+            assert archive.read(doc_1.idified_title) == f.read()
+
+    def test_targz_stream(self, *_):
+        doc_1, doc_2 = self._make_documents()
+        download = NodesDownloadTarGz(node_ids=[doc_1.pk, self.folder.pk])
+
+        chunks = list(download.stream())
+
+        # gzip compressor keeps its own (fixed size) buffer, thus
+        # chunks' size is not bounded as strictly as in zip's case
+        assert len(chunks) > 1
+        archive = tarfile.open(
+            fileobj=io.BytesIO(b''.join(chunks)),
+            mode='r:gz'
+        )
+        names = set(archive.getnames())
+        assert names == {
+            doc_1.idified_title,
+            f"{self.folder.idified_title}/{doc_2.idified_title}"
+        }
+        doc_2_path = doc_2.versions.last().abs_file_path()
+        arcname = f"{self.folder.idified_title}/{doc_2.idified_title}"
+        with open(doc_2_path, 'rb') as f:
+            assert archive.extractfile(arcname).read() == f.read()
+
+    def test_targz_stream_buffers_at_most_one_chunk(self, *_):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'big.pdf')
+            # i.e. (like scanned PDF) barely compresses
+            content = os.urandom(64 * 4096)
+            with open(file_path, 'wb') as f:
+                f.write(content)
+            download = NodesDownloadTarGz(node_ids=[])
+            drained = []
+            original_drain = StreamBuffer.drain
+
+            def drain(buffer):
+                data = original_drain(buffer)
+                drained.append(len(data))
+                return data
+
+            with patch.object(
+                download,
+                '_archive_entries',
+                return_value=[(file_path, 'big.pdf')]
+            ), patch.object(
+                StreamBuffer,
+                'drain',
+                autospec=True,
+                side_effect=drain
+            ):
+                chunks = list(download.stream())
+
+        assert len(chunks) > 8
+        # gzip's own buffer (tarfile.RECORDSIZE) on top of one chunk
+        assert max(drained) < 4096 + 2 * tarfile.RECORDSIZE
+        archive = tarfile.open(
+            fileobj=io.BytesIO(b''.join(chunks)),
+            mode='r:gz'
+        )
+        assert archive.extractfile('big.pdf').read() == content
+
+    def test_archive_entries_number_of_queries(self, *_):
+        """
+        Number of queries performed to walk requested subtrees does not
+        depend on the depth of the subtrees nor on the number of documents
+        """
+        doc_1, doc_2 = self._make_documents()
+        sub_folder = Folder.objects.create(
+            title="2022",
+            user=self.user,
+            parent=self.folder
+        )
+        doc_3 = maker.document("living-things.pdf", user=self.user)
+        doc_3.parent = sub_folder
+        doc_3.save()
+        download = NodesDownloadZip(node_ids=[doc_1.pk, self.folder.pk])
+
+        with self.assertNumQueries(3):
+            entries = list(download._archive_entries())
+
+        assert set(arcname for _, arcname in entries) == {
+            doc_1.idified_title,
+            f"{self.folder.idified_title}/{doc_2.idified_title}",
+            f"{self.folder.idified_title}/{sub_folder.idified_title}/"
+            f"{doc_3.idified_title}"
+        }
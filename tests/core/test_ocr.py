@@ -0,0 +1,287 @@
+import os
+import shutil
+from unittest.mock import patch
+
+from pikepdf import Pdf
+
+from papermerge.test import TestCase, maker
+from papermerge.core import tasks
+from papermerge.core.lib.path import PagePath
+from papermerge.core.ocr.document import (
+    get_page_ranges,
+    ocr_document,
+    ocr_page_range,
+    stitch_page_ranges
+)
+from papermerge.core.storage import abs_path, get_storage_instance
+
+
+def fake_ocrmypdf(input_document, output_document, sidecar_dir, **_):
+    """
+    Mimics ``ocrmypdf.ocr`` with papermerge plugin: output document is
+    a copy of the input and one text sidecar is created per page
+    """
+    shutil.copy(input_document, output_document)
+    with Pdf.open(input_document) as pdf:
+        page_count = len(pdf.pages)
+
+    for number in range(1, page_count + 1):
+        page_dir = os.path.join(sidecar_dir, f'{number:06d}')
+        os.makedirs(page_dir, exist_ok=True)
+        txt_path = os.path.join(page_dir, f'{number:06d}_ocr_hocr.txt')
+        with open(txt_path, 'w') as f:
+            f.write(f'text of page {number}')
+
+
+class TestGetPageRanges(TestCase):
+
+    def test_get_page_ranges(self):
+        assert get_page_ranges(10, 4) == [(1, 4), (5, 8), (9, 10)]
+        assert get_page_ranges(3, 3) == [(1, 3)]
+        assert get_page_ranges(1, 5) == [(1, 1)]
+
+
+@patch('papermerge.core.signals.ocr_document_task')
+@patch('papermerge.core.signals.generate_page_previews_task')
+class TestOCRPageRanges(TestCase):
+
+    def ocr_kwargs(self, doc):
+        doc_version = doc.versions.last()
+        return dict(
+            user_id=str(self.user.pk),
+            document_id=str(doc.pk),
+            file_name=doc_version.file_name,
+            lang='deu',
+            version=doc_version.number,
+            target_version=doc_version.number + 1
+        )
+
+    @patch('papermerge.core.ocr.document.ocrmypdf.ocr')
+    def test_ocred_page_range_is_skipped(self, ocr_mock, *_):
+        doc = maker.document("living-things.pdf", user=self.user)
+        ocr_mock.side_effect = fake_ocrmypdf
+
+        assert ocr_page_range(
+            first_page=1, last_page=1, **self.ocr_kwargs(doc)
+        )
+        # checkpoint of the page range exists, thus it is not OCRed again
+        assert not ocr_page_range(
+            first_page=1, last_page=1, **self.ocr_kwargs(doc)
+        )
+        assert ocr_mock.call_count == 1
+
+    @patch('papermerge.core.ocr.document.ocrmypdf.ocr')
+    def test_stitch_page_ranges(self, ocr_mock, *_):
+        doc = maker.document("living-things.pdf", user=self.user)
+        doc_version = doc.versions.last()
+        ocr_kwargs = self.ocr_kwargs(doc)
+        page_ranges = get_page_ranges(doc_version.page_count, 1)
+        ocr_mock.side_effect = fake_ocrmypdf
+
+        for first_page, last_page in page_ranges:
+            ocr_page_range(
+                first_page=first_page, last_page=last_page, **ocr_kwargs
+            )
+        stitch_page_ranges(page_ranges=page_ranges, **ocr_kwargs)
+
+        target_path = doc_version.document_path
+        target_path.version = doc_version.number + 1
+        with Pdf.open(abs_path(target_path.url)) as pdf:
+            assert len(pdf.pages) == doc_version.page_count
+
+        # sidecars are renumbered from page range's to document's numbering
+        for number in range(1, doc_version.page_count + 1):
+            page_path = PagePath(document_path=target_path, page_num=number)
+            with open(abs_path(page_path.txt_url)) as f:
+                assert f.read() == 'text of page 1'
+
+        chunks_dir = abs_path(f'{target_path.dirname_sidecars()}chunks/')
+        assert not os.path.exists(chunks_dir)
+
+    @patch('papermerge.core.tasks.ocr_document')
+    @patch('papermerge.core.tasks.ocr_document_task.replace')
+    def test_ocr_document_task_splits_document(
+        self,
+        replace_mock,
+        ocr_document_mock,
+        *_
+    ):
+        doc = maker.document("living-things.pdf", user=self.user)
+        doc_version = doc.versions.last()
+
+        with self.settings(PAPERMERGE_OCR_PAGES_PER_CHUNK=1):
+            tasks.ocr_document_task(
+                document_id=str(doc.pk),
+                lang='deu',
+                user_id=str(self.user.pk)
+            )
+
+        ocr_document_mock.assert_not_called()
+        ocr_chord = replace_mock.call_args.args[0]
+        assert len(ocr_chord.tasks) == doc_version.page_count
+        assert ocr_chord.body.kwargs['page_ranges'] == get_page_ranges(
+            doc_version.page_count, 1
+        )
+
+    @patch('papermerge.core.tasks.ocr_document')
+    def test_ocr_document_task_without_splitting(self, ocr_document_mock, *_):
+        doc = maker.document("living-things.pdf", user=self.user)
+
+        tasks.ocr_document_task(
+            document_id=str(doc.pk),
+            lang='deu',
+            user_id=str(self.user.pk)
+        )
+
+        ocr_document_mock.assert_called_once()
+
+
+@patch('papermerge.core.signals.ocr_document_task')
+@patch('papermerge.core.signals.generate_page_previews_task')
+class TestOCRLinkedFiles(TestCase):
+
+    @patch('papermerge.core.ocr.document.ocrmypdf.ocr')
+    def test_ocr_does_not_write_linked_files_in_place(self, ocr_mock, *_):
+        """
+        Target version's files may be hard links of other versions' files
+        (e.g. with ``link`` copy mode); OCR replaces them instead of
+        writing them in place
+        """
+        doc = maker.document("living-things.pdf", user=self.user)
+        doc_version = doc.versions.last()
+        ocr_mock.side_effect = fake_ocrmypdf
+        target_path = doc_version.document_path
+        target_path.version = doc_version.number + 1
+        linked = {}
+        for url in (
+            target_path.url,
+            PagePath(document_path=target_path, page_num=1).txt_url
+        ):
+            shared_path = abs_path(f'{url}.shared')
+            os.makedirs(os.path.dirname(shared_path), exist_ok=True)
+            with open(shared_path, 'w') as f:
+                f.write('shared')
+            os.link(shared_path, abs_path(url))
+            self.addCleanup(os.remove, shared_path)
+            linked[url] = shared_path
+
+        ocr_document(
+            user_id=str(self.user.pk),
+            document_id=str(doc.pk),
+            file_name=doc_version.file_name,
+            lang='deu',
+            version=doc_version.number,
+            target_version=target_path.version
+        )
+
+        for url, shared_path in linked.items():
+            assert not os.path.samefile(abs_path(url), shared_path)
+            with open(shared_path) as f:
+                assert f.read() == 'shared'
+        with open(abs_path(PagePath(
+            document_path=target_path,
+            page_num=1
+        ).txt_url)) as f:
+            assert f.read() == 'text of page 1'
+
+
+@patch('papermerge.core.signals.ocr_document_task')
+@patch('papermerge.core.signals.generate_page_previews_task')
+class TestIncrementalOCR(TestCase):
+
+    def make_ocred(self, doc_version, number):
+        page = doc_version.pages.get(number=number)
+        page.text = f'old text of page {number}'
+        page.save()
+        page_path = PagePath(
+            document_path=doc_version.document_path,
+            page_num=number
+        )
+        for url in (page_path.txt_url, page_path.hocr_url, page_path.svg_url):
+            os.makedirs(os.path.dirname(abs_path(url)), exist_ok=True)
+            with open(abs_path(url), 'w') as f:
+                f.write(f'old text of page {number}')
+
+    @patch('papermerge.core.tasks.ocr_document')
+    @patch('papermerge.core.ocr.document.ocrmypdf.ocr')
+    def test_only_pages_without_ocr_data_are_ocred(
+        self,
+        ocr_mock,
+        ocr_document_mock,
+        *_
+    ):
+        doc = maker.document("living-things.pdf", user=self.user)
+        doc_version = doc.versions.last()
+        page_count = doc_version.page_count
+        self.make_ocred(doc_version, 1)
+        ocred_page_counts = []
+
+        def fake_ocr(input_document, *args, **kwargs):
+            with Pdf.open(input_document) as pdf:
+                ocred_page_counts.append(len(pdf.pages))
+            fake_ocrmypdf(input_document, *args, **kwargs)
+
+        ocr_mock.side_effect = fake_ocr
+
+        with self.settings(PAPERMERGE_OCR_INCREMENTAL=True):
+            tasks.ocr_document_task(
+                document_id=str(doc.pk),
+                lang='deu',
+                user_id=str(self.user.pk)
+            )
+
+        ocr_document_mock.assert_not_called()
+        assert ocred_page_counts == [page_count - 1]
+
+        target_path = doc_version.document_path
+        target_path.version = doc_version.number + 1
+        with Pdf.open(abs_path(target_path.url)) as pdf:
+            assert len(pdf.pages) == page_count
+
+        texts = []
+        for number in range(1, page_count + 1):
+            page_path = PagePath(document_path=target_path, page_num=number)
+            with open(abs_path(page_path.txt_url)) as f:
+                texts.append(f.read())
+
+        # first page's sidecars are reused, remaining pages are
+        # renumbered from OCRed PDF's to document's page numbers
+        assert texts[0] == 'old text of page 1'
+        assert texts[1:] == [
+            f'text of page {number}' for number in range(1, page_count)
+        ]
+
+    @patch('papermerge.core.tasks.ocr_document')
+    @patch('papermerge.core.ocr.document.ocrmypdf.ocr')
+    def test_no_new_version_when_all_pages_are_ocred(
+        self,
+        ocr_mock,
+        ocr_document_mock,
+        *_
+    ):
+        doc = maker.document("living-things.pdf", user=self.user)
+        doc_version = doc.versions.last()
+        for number in range(1, doc_version.page_count + 1):
+            self.make_ocred(doc_version, number)
+
+        with self.settings(PAPERMERGE_OCR_INCREMENTAL=True):
+            with patch.object(
+                get_storage_instance(),
+                'exists',
+                side_effect=AssertionError('sidecars are listed at once')
+            ):
+                result = tasks.ocr_document_task(
+                    document_id=str(doc.pk),
+                    lang='deu',
+                    user_id=str(self.user.pk)
+                )
+            # linked task
+            tasks.post_ocr_document_task(result)
+
+        assert result is None
+        ocr_mock.assert_not_called()
+        ocr_document_mock.assert_not_called()
+        assert doc.versions.count() == 1
+        target_path = doc_version.document_path
+        target_path.version = doc_version.number + 1
+        assert not os.path.exists(abs_path(target_path.url))
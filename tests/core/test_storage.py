@@ -0,0 +1,39 @@
+import os
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from papermerge.core.lib.storage import LINK
+from papermerge.core.storage import (
+    abs_path,
+    abs_paths,
+    get_storage_instance
+)
+
+
+class TestGetStorageInstance(TestCase):
+
+    def test_storage_instance_is_reused(self):
+        assert get_storage_instance() is get_storage_instance()
+
+    def test_storage_instance_is_rebuilt_when_settings_change(self):
+        storage = get_storage_instance()
+
+        with override_settings(
+            PAPERMERGE_FILE_STORAGE_KWARGS={'copy_mode': LINK}
+        ):
+            assert get_storage_instance() is not storage
+            assert get_storage_instance().copy_mode == LINK
+
+        assert get_storage_instance().copy_mode != LINK
+
+    def test_abs_paths(self):
+        relative_paths = ['docs/a.pdf', 'sidecars/b.txt']
+
+        assert abs_paths(relative_paths) == [
+            os.path.join(settings.MEDIA_ROOT, 'docs/a.pdf'),
+            os.path.join(settings.MEDIA_ROOT, 'sidecars/b.txt'),
+        ]
+        assert abs_paths(iter(relative_paths)) == [
+            abs_path(relative_path) for relative_path in relative_paths
+        ]
@@ -0,0 +1,62 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from papermerge.test import TestCase, maker
+from papermerge.core import tasks
+from papermerge.core.storage import abs_path
+
+
+class TestReadTextSidecars(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp_dir = self._tmp.name
+
+    def tearDown(self):
+        super().tearDown()
+        self._tmp.cleanup()
+
+    def test_sidecars_are_read_in_order(self):
+        paths = []
+        for number in range(1, 6):
+            path = os.path.join(self.tmp_dir, f'{number}.txt')
+            with open(path, 'w') as f:
+                f.write(f'page {number}')
+            paths.append(path)
+        # sidecar of the last page is missing
+        paths.append(os.path.join(self.tmp_dir, 'missing.txt'))
+
+        with patch.object(tasks, 'SIDECARS_BATCH_SIZE', 2):
+            texts = [
+                stream.read() for stream in tasks.read_text_sidecars(paths)
+            ]
+
+        assert texts == [
+            'page 1', 'page 2', 'page 3', 'page 4', 'page 5', ''
+        ]
+
+
+@patch('papermerge.core.signals.ocr_document_task')
+@patch('papermerge.core.signals.generate_page_previews_task')
+class TestUpdateDocumentPages(TestCase):
+
+    def test_update_document_pages(self, *_):
+        doc = maker.document("d3.pdf", user=self.user)
+        doc_version = doc.versions.last()
+        pages = list(doc_version.pages.order_by('number'))
+        first_page = pages[0]
+        os.makedirs(
+            os.path.dirname(abs_path(first_page.txt_url)),
+            exist_ok=True
+        )
+        with open(abs_path(first_page.txt_url), 'w') as f:
+            f.write('Text of the first page')
+
+        tasks.update_document_pages(str(doc.pk))
+
+        first_page.refresh_from_db()
+        doc_version.refresh_from_db()
+        assert first_page.text == 'Text of the first page'
+        assert doc_version.text == 'Text of the first page'
@@ -84,3 +84,20 @@ class DownloadDocumentVersionOnlyOwner(TestCase):
             expected_content = file.read()
             # entire document was downloaded
             assert len(response.content) == len(expected_content)
+
+    @patch('papermerge.core.signals.ocr_document_task')
+    @patch('papermerge.core.signals.generate_page_previews_task')
+    def test_download_document_version_via_xsendfile(self, _1, _2):
+        doc = maker.document(
+            "s3.pdf",
+            user=self.owner
+        )
+        doc_ver = doc.versions.last()
+        url = reverse('download-document-version', args=(doc_ver.pk,))
+
+        with self.settings(PAPERMERGE_SENDFILE_BACKEND='xsendfile'):
+            response = self.client_owner.get(url)
+
+        assert response.status_code == 200
+        assert response.content == b''
+        assert response['X-Sendfile'] == abs_path(doc_ver.document_path.url)
@@ -1,8 +1,18 @@
+import io
 import json
+import tempfile
+import zipfile
+from unittest.mock import patch
 
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from papermerge.test import TestCase
+from model_bakery import baker
+
+from papermerge.test import TestCase, maker
+from papermerge.core.tasks import build_nodes_download_task
 from papermerge.core.models import (
     Folder,
     Document,
@@ -278,6 +288,46 @@ class NodesViewTestCase(TestCase):
         assert set(['doc_a', 'doc_b']) == set(doc_tag_names)
         assert set(['folder_a', 'folder_b']) == set(folder_tag_names)
 
+    def test_home_listing_query_count_does_not_depend_on_page_size(self):
+        """
+        Listing of folder's children performs the same number of queries
+        no matter how many (tagged) children folder has
+        """
+        home = self.user.home_folder
+        url = reverse('node-detail', args=(home.pk, ))
+
+        def add_children(start, stop):
+            for index in range(start, stop):
+                folder = Folder.objects.create(
+                    title=f'folder-{index}',
+                    user=self.user,
+                    parent=home
+                )
+                folder.tags.set(['a'], tag_kwargs={"user": self.user})
+                doc = Document.objects.create(
+                    title=f'doc-{index}.pdf',
+                    user=self.user,
+                    parent=home
+                )
+                doc.tags.set(['b'], tag_kwargs={"user": self.user})
+
+        add_children(0, 1)
+        with CaptureQueriesContext(connection) as two_children:
+            self.client.get(url)
+
+        add_children(1, 5)
+        with CaptureQueriesContext(connection) as ten_children:
+            response = self.client.get(url)
+
+        assert len(response.data['results']) == 10
+        assert len(ten_children) == len(two_children)
+        doc = [
+            item for item in response.data['results']
+            if item['title'] == 'doc-3.pdf'
+        ][0]
+        assert doc['breadcrumb'] == f'{home.title}/doc-3.pdf'
+        assert [tag['name'] for tag in doc['tags']] == ['b']
+
     def test_nodes_move(self):
         doc = Document.objects.create(
             title='doc.pdf',
@@ -303,6 +353,71 @@ class NodesViewTestCase(TestCase):
 
         assert response.status_code == 200, response.data
 
+    def test_nodes_move_multiple_nodes(self):
+        folder = Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.inbox_folder
+        )
+        sub_folder = Folder.objects.create(
+            title='Invoices',
+            user=self.user,
+            parent=folder
+        )
+        doc = Document.objects.create(
+            title='doc.pdf',
+            user=self.user,
+            parent=self.user.inbox_folder
+        )
+
+        url = reverse('nodes-move')
+        data = {
+            'nodes': [
+                {'id': str(doc.id)},
+                {'id': str(folder.id)}
+            ],
+            'target_parent': {
+                'id': str(self.user.home_folder.id)
+            }
+        }
+
+        response = self.client.post(
+            url,
+            json.dumps(data),
+            content_type='application/json'
+        )
+
+        assert response.status_code == 200, response.data
+        assert self.user.inbox_folder.children.count() == 0
+        assert self.user.home_folder.children.count() == 2
+        sub_folder.refresh_from_db()
+        assert sub_folder.breadcrumb == '.home/My Documents/Invoices/'
+
+    def test_nodes_move_with_title_conflict(self):
+        Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.home_folder
+        )
+        folder = Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.inbox_folder
+        )
+
+        response = self.client.post(
+            reverse('nodes-move'),
+            json.dumps({
+                'nodes': [{'id': str(folder.id)}],
+                'target_parent': {'id': str(self.user.home_folder.id)}
+            }),
+            content_type='application/json'
+        )
+
+        assert response.status_code == 400
+        folder.refresh_from_db()
+        assert folder.parent_id == self.user.inbox_folder.id
+
     def test_create_document(self):
         """
         When 'lang' attribute is not specified during document creation
@@ -448,3 +563,182 @@ class NodesViewTestCase(TestCase):
         response = self.post(url, json_data, type="vnd.api")
         assert response.status_code == 400
         assert response.data[0]['code'] == 'unique'
+
+
+@patch('papermerge.core.signals.ocr_document_task')
+@patch('papermerge.core.signals.generate_page_previews_task')
+class NodesDownloadAsyncTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # built downloads are not left in tests' media folder
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    @patch('papermerge.core.views.nodes.build_nodes_download_task')
+    def test_async_download_enqueues_the_job(self, task_mock, *_):
+        folder = Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.home_folder
+        )
+
+        response = self.client.get(
+            '/api/nodes/download/',
+            {'node_ids': [str(folder.pk)], 'mode': 'async'}
+        )
+
+        assert response.status_code == 202
+        download_id = response.json()['download_id']
+        task_mock.apply_async.assert_called_once()
+        kwargs = task_mock.apply_async.call_args.kwargs['kwargs']
+        assert kwargs['download_id'] == download_id
+        assert kwargs['user_id'] == str(self.user.pk)
+        assert kwargs['node_ids'] == [str(folder.pk)]
+
+    @patch('papermerge.core.tasks.delete_nodes_download_task')
+    @patch('papermerge.core.signals.channel_group_notify')
+    def test_built_download_is_served_via_signed_url(self, notify, *_):
+        folder = Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.home_folder
+        )
+        doc = maker.document("s3.pdf", user=self.user)
+        doc.parent = folder
+        doc.save()
+        download_id = '5f2a1d9c-3b1e-4a56-9a1b-0d5c7f3e2b11'
+
+        # pending, as the job did not run yet
+        url = reverse('nodes-download-job', args=(download_id,))
+        assert self.client.get(url).json()['status'] == 'pending'
+
+        build_nodes_download_task(
+            download_id=download_id,
+            user_id=str(self.user.pk),
+            node_ids=[str(folder.pk)],
+            file_name='docs.zip'
+        )
+        # progress was reported
+        assert notify.call_args.kwargs['type'] == 'taskprogress'
+        assert notify.call_args.kwargs['task_kwargs']['processed'] == 1
+
+        result = self.client.get(url).json()
+        assert result['status'] == 'ready'
+
+        # signed URL does not require authentication
+        self.client.logout()
+        response = self.client.get(result['url'])
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/zip'
+        content = b''.join(response.streaming_content)
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        assert archive.namelist() == [
+            f"{folder.idified_title}/{doc.idified_title}"
+        ]
+
+        # resume i.e. download only the remaining part
+        response = self.client.get(result['url'], HTTP_RANGE='bytes=100-')
+        assert response.status_code == 206
+        assert response['Content-Range'] == (
+            f'bytes 100-{len(content) - 1}/{len(content)}'
+        )
+        assert b''.join(response.streaming_content) == content[100:]
+
+    @patch('papermerge.core.views.nodes.build_nodes_download_task')
+    def test_async_download_of_nodes_of_other_user(self, task_mock, *_):
+        other_user = baker.make('core.user')
+        own_folder = Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.home_folder
+        )
+        other_folder = Folder.objects.create(
+            title='Their Documents',
+            user=other_user,
+            parent=other_user.home_folder
+        )
+
+        response = self.client.get(
+            '/api/nodes/download/',
+            {'node_ids': [str(other_folder.pk)], 'mode': 'async'}
+        )
+
+        assert response.status_code == 404
+        task_mock.apply_async.assert_not_called()
+
+        response = self.client.get(
+            '/api/nodes/download/',
+            {
+                'node_ids': [str(other_folder.pk), str(own_folder.pk)],
+                'mode': 'async'
+            }
+        )
+
+        assert response.status_code == 202
+        kwargs = task_mock.apply_async.call_args.kwargs['kwargs']
+        assert kwargs['node_ids'] == [str(own_folder.pk)]
+
+    @patch('papermerge.core.tasks.delete_nodes_download_task')
+    @patch('papermerge.core.tasks.get_nodes_download')
+    def test_failed_download_is_reported(self, get_nodes_download, *_):
+        get_nodes_download.side_effect = ValueError('no luck')
+        download_id = '5f2a1d9c-3b1e-4a56-9a1b-0d5c7f3e2b12'
+
+        with self.assertRaises(ValueError):
+            build_nodes_download_task(
+                download_id=download_id,
+                user_id=str(self.user.pk),
+                node_ids=[str(self.user.home_folder.pk)]
+            )
+
+        url = reverse('nodes-download-job', args=(download_id,))
+        result = self.client.get(url).json()
+        assert result['status'] == 'failed'
+        assert 'url' not in result
+
+    def test_download_with_invalid_token(self, *_):
+        url = reverse('nodes-download-file', args=('invalid-token',))
+
+        response = self.client.get(url)
+
+        assert response.status_code == 404
+
+
+@patch('papermerge.core.signals.ocr_document_task')
+@patch('papermerge.core.signals.generate_page_previews_task')
+class NodesDownloadSendfileTestCase(TestCase):
+
+    def test_single_document_download(self, *_):
+        doc = maker.document("s3.pdf", user=self.user)
+        doc_version = doc.versions.last()
+
+        response = self.client.get(
+            '/api/nodes/download/',
+            {'node_ids': [str(doc.pk)]}
+        )
+
+        assert response.status_code == 200
+        assert 'X-Accel-Redirect' not in response
+        assert response['Content-Disposition'] == \
+            f"attachment; filename={doc_version.file_name}"
+
+    def test_single_document_download_via_nginx(self, *_):
+        doc = maker.document("s3.pdf", user=self.user)
+        doc_version = doc.versions.last()
+
+        with self.settings(PAPERMERGE_SENDFILE_BACKEND='nginx'):
+            response = self.client.get(
+                '/api/nodes/download/',
+                {'node_ids': [str(doc.pk)]}
+            )
+
+        assert response.status_code == 200
+        # file is sent by the proxy
+        assert response.content == b''
+        assert response['X-Accel-Redirect'] == \
+            f"/protected/{doc_version.document_path.url}"
+        assert response['Content-Type'] == 'application/pdf'
@@ -1,17 +1,20 @@
 from unittest.mock import patch
 import shutil
 import os
+import tempfile
 import io
 import json
 from pathlib import Path
 
 import pikepdf
+from PIL import Image
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APIClient
 
-from papermerge.core.models import User, Document, Folder
+from papermerge.core.models import User, Document, DocumentVersion, Folder
 from papermerge.core.storage import abs_path
+from papermerge.core.tasks import generate_page_previews_task
 
 MODELS_DIR_ABS_PATH = os.path.abspath(os.path.dirname(__file__))
 TEST_DIR_ABS_PATH = os.path.dirname(
@@ -71,7 +74,7 @@ class PageViewTestCase(TestCase):
             'text': 'Hello Page!'
         }
 
-    @patch('papermerge.core.models.document_version.convert_from_path')
+    @patch('papermerge.core.lib.previews.convert_from_path')
     def test_page_view_in_svg_format(self, _):
         """
         GET /pages/{id}/
@@ -105,6 +108,7 @@ class PageViewTestCase(TestCase):
             file_name='three-pages.pdf'
         )
         page = self.doc_version.pages.first()
+        self.doc_version.generate_previews()
 
         page.update_text_field(io.StringIO('Hello Page!'))
         response = self.client.get(
@@ -114,6 +118,211 @@ class PageViewTestCase(TestCase):
 
         assert response.status_code == 200
 
+    @patch(
+        'papermerge.core.lib.previews.convert_from_path',
+        side_effect=lambda *args, first_page, last_page, size, **kw: [
+            Image.new('RGB', (size[0], size[0]), 'white')
+            for _ in range(first_page, last_page + 1)
+        ]
+    )
+    def test_page_view_preview_tier(self, _):
+        """
+        GET /pages/{id}/?size=thumbnail
+        Accept: image/jpeg
+        """
+        self.doc_version.create_pages(page_count=1)
+        self.doc_version.page_count = 1
+        self.doc_version.save()
+        page = self.doc_version.pages.first()
+
+        with self.settings(
+            PAPERMERGE_PREVIEW_SIZES={'thumbnail': 50, 'full': 100},
+            PAPERMERGE_PREVIEW_FORMAT='webp'
+        ):
+            self.doc_version.generate_previews()
+
+        response = self.client.get(
+            reverse('pages_page', args=(page.pk,)) + '?size=thumbnail',
+            HTTP_ACCEPT='image/jpeg'
+        )
+
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'image/webp'
+        with Image.open(io.BytesIO(response.content)) as image:
+            assert image.width == 50
+
+    @patch(
+        'papermerge.core.lib.previews.convert_from_path',
+        side_effect=lambda *args, first_page, last_page, size, **kw: [
+            Image.new('RGB', (size[0], size[0]), 'white')
+            for _ in range(first_page, last_page + 1)
+        ]
+    )
+    def test_page_view_preview_via_nginx(self, _):
+        """
+        With sendfile backend configured, preview is sent by the front
+        proxy (response only contains X-Accel-Redirect header)
+        """
+        self.doc_version.create_pages(page_count=1)
+        self.doc_version.page_count = 1
+        self.doc_version.save()
+        page = self.doc_version.pages.first()
+        self.doc_version.generate_previews()
+        url, _ = page.get_preview_url('full')
+
+        with self.settings(
+            PAPERMERGE_SENDFILE_BACKEND='nginx',
+            PAPERMERGE_SENDFILE_URL_PREFIX='/media-internal/'
+        ):
+            response = self.client.get(
+                reverse('pages_page', args=(page.pk,)),
+                HTTP_ACCEPT='image/jpeg'
+            )
+
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'image/jpeg'
+        assert response['X-Accel-Redirect'] == f'/media-internal/{url}'
+        assert response.content == b''
+
+    @patch('papermerge.core.views.pages.generate_page_previews_task')
+    def test_page_view_preview_is_not_rendered_inline(self, task_mock):
+        """
+        When preview is not generated yet, it is scheduled (instead of
+        being rendered within the request)
+        """
+        self.doc_version.create_pages(page_count=1)
+        page = self.doc_version.pages.first()
+
+        response = self.client.get(
+            reverse('pages_page', args=(page.pk,)),
+            HTTP_ACCEPT='image/jpeg'
+        )
+
+        assert response.status_code == 404
+        task_mock.delay.assert_called_once_with(
+            str(self.doc_version.pk),
+            page_number=1
+        )
+
+    @patch('papermerge.core.views.pages.generate_page_previews_task')
+    def test_page_view_preview_is_scheduled_until_task_is_done(
+        self,
+        task_mock
+    ):
+        """
+        Preview generation is scheduled once while the task is pending;
+        the task releases the lock when it is done
+        """
+        self.doc_version.create_pages(page_count=1)
+        page = self.doc_version.pages.first()
+        url = reverse('pages_page', args=(page.pk,))
+
+        for _ in range(2):
+            self.client.get(url, HTTP_ACCEPT='image/jpeg')
+        assert task_mock.delay.call_count == 1
+
+        with patch.object(DocumentVersion, 'generate_previews'):
+            generate_page_previews_task(str(self.doc_version.pk), 1)
+
+        self.client.get(url, HTTP_ACCEPT='image/jpeg')
+        assert task_mock.delay.call_count == 2
+
+    @patch('papermerge.core.views.pages.generate_page_previews_task')
+    def test_page_view_unknown_preview_size(self, task_mock):
+        """
+        GET /pages/{id}/?size=<unknown tier> is rejected (and nothing
+        is scheduled)
+        """
+        self.doc_version.create_pages(page_count=1)
+        page = self.doc_version.pages.first()
+
+        response = self.client.get(
+            reverse('pages_page', args=(page.pk,)) + '?size=huge',
+            HTTP_ACCEPT='image/jpeg'
+        )
+
+        assert response.status_code == 400
+        task_mock.delay.assert_not_called()
+
+    @patch(
+        'papermerge.core.lib.previews.convert_from_path',
+        side_effect=lambda *args, first_page, last_page, size, **kw: [
+            Image.new('RGB', (size[0], size[0]), 'white')
+            for _ in range(first_page, last_page + 1)
+        ]
+    )
+    def test_page_thumbnail_view(self, _):
+        """
+        GET /pages/{id}/thumbnail/?width=80
+        """
+        self.doc_version.create_pages(page_count=1)
+        self.doc_version.page_count = 1
+        self.doc_version.save()
+        page = self.doc_version.pages.first()
+        url = reverse('pages_page_thumbnail', args=(page.pk,))
+
+        # previews and thumbnails cache are not left in tests' media folder
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        with self.settings(
+            PAPERMERGE_PREVIEW_SIZES={'thumbnail': 50, 'full': 100}
+        ):
+            self.doc_version.generate_previews()
+
+        response = self.client.get(url + '?width=80')
+
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'image/jpeg'
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) \
+                as image:
+            assert image.width == 80
+
+        # revalidation of the cached thumbnail
+        response = self.client.get(
+            url + '?width=80',
+            HTTP_IF_NONE_MATCH=response['ETag']
+        )
+
+        assert response.status_code == 304
+
+    def test_page_thumbnail_view_of_legacy_preview(self):
+        """
+        Thumbnails of pages without preview tiers are resized from
+        their legacy preview
+        """
+        self.doc_version.create_pages(page_count=1)
+        page = self.doc_version.pages.first()
+        url = reverse('pages_page_thumbnail', args=(page.pk,))
+
+        with tempfile.TemporaryDirectory() as media_root, \
+                self.settings(MEDIA_ROOT=media_root):
+            legacy_path = abs_path(page.page_path.preview_url)
+            os.makedirs(os.path.dirname(legacy_path), exist_ok=True)
+            Image.new('RGB', (200, 200), 'white').save(legacy_path)
+
+            response = self.client.get(url + '?width=80')
+
+            assert response.status_code == 200
+            assert response['Content-Type'] == 'image/jpeg'
+            with Image.open(
+                io.BytesIO(b''.join(response.streaming_content))
+            ) as image:
+                assert image.width == 80
+
+    def test_page_thumbnail_view_invalid_width(self):
+        self.doc_version.create_pages(page_count=1)
+        page = self.doc_version.pages.first()
+        url = reverse('pages_page_thumbnail', args=(page.pk,))
+
+        for width in ('abc', '0', '100000'):
+            response = self.client.get(url + f'?width={width}')
+
+            assert response.status_code == 400
+
     @patch('papermerge.core.signals.ocr_document_task')
     @patch('papermerge.core.signals.generate_page_previews_task')
     def test_page_view_in_text_format(self, _, _x):
@@ -583,9 +792,33 @@ class PageViewTestCase(TestCase):
                 text = f.read()
                 assert text == f'I am page {index + 1}'
 
+    @patch('papermerge.core.views.pages.generate_page_previews_task')
+    def test_page_view_legacy_preview(self, task_mock):
+        """
+        Pages of documents created before preview tiers (i.e. without
+        previews manifest) are served with their legacy preview, while
+        preview tiers are scheduled
+        """
+        self.doc_version.create_pages(page_count=1)
+        page = self.doc_version.pages.first()
+        legacy_path = abs_path(page.page_path.preview_url)
+        os.makedirs(os.path.dirname(legacy_path), exist_ok=True)
+        with open(legacy_path, 'wb') as f:
+            f.write(b'legacy jpeg')
+
+        response = self.client.get(
+            reverse('pages_page', args=(page.pk,)),
+            HTTP_ACCEPT='image/jpeg'
+        )
+
+        assert response.status_code == 200
+        assert response.content == b'legacy jpeg'
+        task_mock.delay.assert_called_once_with(str(self.doc_version.pk))
+
     @patch('papermerge.core.signals.ocr_document_task')
     @patch('papermerge.core.signals.generate_page_previews_task')
-    def test_pages_rotate(self, _x, _y):
+    @patch('papermerge.core.views.pages.generate_page_previews_task')
+    def test_pages_rotate(self, task_mock, _x, _y):
         self._upload(self.doc, 'three-pages.pdf')
         pages = self.doc_version.pages.all()
         pages_data = [
@@ -604,6 +837,9 @@ class PageViewTestCase(TestCase):
         )
 
         assert response.status_code == 204
+        # previews of new version are rendered by the worker
+        new_version = self.doc.versions.last()
+        task_mock.delay.assert_called_once_with(str(new_version.pk))
 
     @patch('papermerge.core.signals.ocr_document_task')
     @patch('papermerge.core.signals.generate_page_previews_task')
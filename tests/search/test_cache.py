@@ -0,0 +1,156 @@
+import tempfile
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from haystack.query import SearchQuerySet
+from rest_framework.test import APIClient
+
+from papermerge.core.models import User, Folder
+from papermerge.search.cache import (
+    bump_generation,
+    generation_key,
+    get_generation,
+    is_enabled
+)
+from papermerge.search.tasks import (
+    invalidate_removed,
+    update_index_coalesced
+)
+from .test_search_view import rebuild_index
+
+
+SEARCH_QUERY_SET = 'papermerge.search.views.SearchQuerySet'
+FILE_BASED_CACHE = 'django.core.cache.backends.filebased.FileBasedCache'
+LOCMEM_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+class SearchCacheTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # unlike default (locmem) cache, file based cache is shared
+        # between processes
+        cls.cache_dir = tempfile.TemporaryDirectory()
+        cls.cache_settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': FILE_BASED_CACHE,
+                'LOCATION': cls.cache_dir.name
+            }
+        })
+        cls.cache_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.cache_settings.disable()
+        cls.cache_dir.cleanup()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username="user1")
+        self.other_user = User.objects.create_user(username="user2")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.folder = Folder.objects.create(
+            title="Invoices",
+            user=self.user,
+            parent=self.user.home_folder
+        )
+        rebuild_index()
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        assert response.status_code == 200
+
+        return sorted(item['title'] for item in response.data)
+
+    def test_repeated_search_is_served_from_cache(self):
+        assert self.search(q='invoices') == ['Invoices']
+
+        with patch(SEARCH_QUERY_SET) as search_query_set:
+            # same query, normalized
+            assert self.search(q='  Invoices ') == ['Invoices']
+
+        search_query_set.assert_not_called()
+
+    def test_cached_results_are_not_served_after_index_update(self):
+        assert self.search(q='inv') == ['Invoices']
+        folder = Folder.objects.create(
+            title="Invoices 2022",
+            user=self.user,
+            parent=self.user.home_folder
+        )
+
+        update_index_coalesced(identifiers=[f'core.folder.{folder.pk}'])
+
+        assert self.search(q='inv') == ['Invoices', 'Invoices 2022']
+
+    def test_node_removal_invalidates_results_of_the_owner(self):
+        user_generation = get_generation(self.user.pk)
+        other_generation = get_generation(self.other_user.pk)
+        identifier = f'core.folder.{self.folder.pk}'
+        self.folder.delete()
+
+        update_index_coalesced(
+            identifiers=[identifier],
+            user_ids={identifier: str(self.user.pk)}
+        )
+
+        assert get_generation(self.user.pk) != user_generation
+        assert get_generation(self.other_user.pk) == other_generation
+
+    def test_index_update_invalidates_only_results_of_the_owner(self):
+        user_generation = get_generation(self.user.pk)
+        other_generation = get_generation(self.other_user.pk)
+
+        update_index_coalesced(identifiers=[f'core.folder.{self.folder.pk}'])
+
+        assert get_generation(self.user.pk) != user_generation
+        assert get_generation(self.other_user.pk) == other_generation
+
+    def test_removed_identifiers_without_owner_invalidate_all_results(self):
+        other_generation = get_generation(self.other_user.pk)
+
+        invalidate_removed(['core.folder.1'])
+
+        assert get_generation(self.other_user.pk) != other_generation
+
+    def test_generation_is_not_repeated_after_eviction(self):
+        generation = get_generation(self.user.pk)
+        bump_generation([self.user.pk])
+        cache.clear()
+
+        assert get_generation(self.user.pk) != generation
+
+    def test_generation_bumped_by_another_process_is_seen(self):
+        assert self.search(q='inv') == ['Invoices']
+        # e.g. cache of the worker process
+        worker_cache = FileBasedCache(self.cache_dir.name, {})
+
+        worker_cache.incr(generation_key(self.user.pk))
+
+        with patch(
+            SEARCH_QUERY_SET,
+            wraps=SearchQuerySet
+        ) as search_query_set:
+            assert self.search(q='inv') == ['Invoices']
+
+        search_query_set.assert_called()
+
+    def test_results_are_not_cached_with_process_local_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': LOCMEM_CACHE}}):
+            assert not is_enabled()
+            self.search(q='inv')
+
+            with patch(
+                SEARCH_QUERY_SET,
+                wraps=SearchQuerySet
+            ) as search_query_set:
+                assert self.search(q='inv') == ['Invoices']
+
+        search_query_set.assert_called()
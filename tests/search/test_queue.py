@@ -0,0 +1,240 @@
+import tempfile
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.test import TestCase, override_settings
+from haystack import connection_router, connections
+from haystack.query import SearchQuerySet
+
+from papermerge.core import tasks as core_tasks
+from papermerge.core.models import User, Folder
+from papermerge.search.queue import IndexUpdateQueue
+from papermerge.search.signals import SignalProcessor
+from papermerge.search.tasks import update_index_coalesced
+from papermerge.test import maker
+from .test_search_view import rebuild_index
+
+
+APPLY_ASYNC = 'papermerge.search.tasks.update_index_coalesced.apply_async'
+FILE_BASED_CACHE = 'django.core.cache.backends.filebased.FileBasedCache'
+
+
+def shared_cache_settings(location):
+    # unlike default (locmem) cache, file based cache is shared
+    # between processes
+    return override_settings(CACHES={
+        'default': {
+            'BACKEND': FILE_BASED_CACHE,
+            'LOCATION': location
+        }
+    })
+
+
+class IndexUpdateQueueTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.queue = IndexUpdateQueue()
+
+    def test_same_identifier_is_coalesced(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                assert self.queue.add('core.document.1') is True
+                assert self.queue.add('core.document.1') is False
+                assert self.queue.add('core.document.1') is False
+
+        apply_async.assert_called_once_with(
+            kwargs={'identifiers': ['core.document.1']}
+        )
+
+    def test_identifiers_of_one_transaction_are_sent_in_one_batch(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1')
+                self.queue.add('core.folder.2')
+
+        apply_async.assert_called_once_with(
+            kwargs={'identifiers': ['core.document.1', 'core.folder.2']}
+        )
+
+    def test_identifier_is_queued_again_by_next_transaction(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1')
+
+            with self.captureOnCommitCallbacks(execute=True):
+                assert self.queue.add('core.document.1') is True
+
+        assert apply_async.call_count == 2
+
+    def test_rolled_back_identifiers_are_sent_with_next_commit(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        self.queue.add('core.document.1')
+                        raise DatabaseError
+                except DatabaseError:
+                    pass
+                # flush registered within rolled back savepoint is gone,
+                # its identifier is sent with the next commit
+                self.queue.add('core.document.1')
+                self.queue.add('core.folder.2')
+
+        apply_async.assert_called_once_with(
+            kwargs={'identifiers': ['core.document.1', 'core.folder.2']}
+        )
+
+    def test_owners_of_identifiers_are_sent_to_the_worker(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1', user_id='user-1')
+                self.queue.add('core.document.2')
+
+        apply_async.assert_called_once_with(
+            kwargs={
+                'identifiers': ['core.document.1', 'core.document.2'],
+                'user_ids': {'core.document.1': 'user-1'}
+            }
+        )
+
+    def test_documents_with_changed_pages_are_sent_to_the_worker(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1')
+                self.queue.add('core.document.2', pages=True)
+                self.queue.add('core.document.2')
+
+        apply_async.assert_called_once_with(
+            kwargs={
+                'identifiers': ['core.document.1', 'core.document.2'],
+                'reindex_pages': ['core.document.2']
+            }
+        )
+
+
+class DebouncedIndexUpdateQueueTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_settings = shared_cache_settings(cache_dir.name)
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.queue = IndexUpdateQueue(debounce=5)
+
+    def test_identifier_committed_by_other_transaction_is_coalesced(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1')
+
+            # e.g. committed by the worker
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1')
+                self.queue.add('core.folder.2')
+
+        assert apply_async.call_args_list[0].kwargs == {
+            'kwargs': {'identifiers': ['core.document.1']},
+            'countdown': 5
+        }
+        assert apply_async.call_args_list[1].kwargs == {
+            'kwargs': {'identifiers': ['core.folder.2']},
+            'countdown': 5
+        }
+
+    def test_pages_are_queued_even_if_their_document_is_pending(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1')
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1', pages=True)
+
+        assert apply_async.call_args_list[1].kwargs == {
+            'kwargs': {
+                'identifiers': [],
+                'reindex_pages': ['core.document.1']
+            },
+            'countdown': 5
+        }
+
+    def test_identifier_is_queued_again_once_released(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1')
+
+            # i.e. worker started the task
+            self.queue.release(['core.document.1'])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue.add('core.document.1')
+
+        assert apply_async.call_count == 2
+
+    def test_identifiers_of_rolled_back_transaction_are_not_marked(self):
+        with patch(APPLY_ASYNC) as apply_async:
+            try:
+                with transaction.atomic():
+                    self.queue.add('core.document.1')
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+
+        apply_async.assert_not_called()
+        assert cache.get(self.queue.cache_key('core.document.1')) is None
+
+
+@patch('papermerge.core.signals.ocr_document_task')
+@patch('papermerge.core.signals.generate_page_previews_task')
+@patch('papermerge.core.tasks.generate_page_previews_task')
+class UploadIndexUpdatesTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_settings = shared_cache_settings(cache_dir.name)
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        signal_processor = SignalProcessor(connections, connection_router)
+        self.addCleanup(signal_processor.teardown)
+        self.user = User.objects.create_user(username="user1")
+
+    def test_upload_and_ocr_of_document_queue_one_index_update(self, *_):
+        with patch(APPLY_ASYNC) as apply_async:
+            # each step commits on its own (autocommit)
+            with self.captureOnCommitCallbacks(execute=True):
+                doc = maker.document("living-things.pdf", user=self.user)
+            with self.captureOnCommitCallbacks(execute=True):
+                core_tasks.post_ocr_document_task(str(doc.pk))
+
+        assert doc.versions.count() == 2
+        apply_async.assert_called_once()
+        kwargs = apply_async.call_args.kwargs['kwargs']
+        assert f'core.document.{doc.pk}' in kwargs['identifiers']
+        assert kwargs['reindex_pages'] == [f'core.document.{doc.pk}']
+
+
+class UpdateIndexCoalescedTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username="user1")
+        rebuild_index()
+
+    def test_existing_nodes_are_indexed(self):
+        folder = Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.home_folder
+        )
+
+        update_index_coalesced(identifiers=[f'core.folder.{folder.pk}'])
+
+        titles = [
+            item.title for item in SearchQuerySet().filter(user=self.user)
+        ]
+        assert 'My Documents' in titles
@@ -0,0 +1,124 @@
+import io
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from haystack import connections
+from haystack.query import SearchQuerySet
+
+from papermerge.core.models import User, Folder, Document, Page
+from papermerge.search.reindex import (
+    _index_batches,
+    format_progress,
+    iter_pk_batches,
+    reindex
+)
+
+
+class ReindexTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="user1")
+        self.folder = Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.home_folder
+        )
+        self.folder.tags.set(['important'], tag_kwargs={"user": self.user})
+        self.create_documents(count=3)
+        connections['default'].get_backend().clear()
+
+    def create_documents(self, count):
+        for number in range(Document.objects.count(), count):
+            doc = Document.objects.create_document(
+                title=f'invoice-{number}.pdf',
+                lang='deu',
+                user_id=self.user.pk,
+                parent=self.folder,
+            )
+            doc_version = doc.versions.last()
+            doc_version.create_pages(page_count=1)
+            doc_version.update_text_field([io.StringIO('cat and dog')])
+            doc.tags.set(['paid'], tag_kwargs={"user": self.user})
+
+    def test_iter_pk_batches(self):
+        queryset = Folder.objects.all()
+
+        batches = list(iter_pk_batches(queryset, batch_size=2))
+
+        assert [len(batch) for batch in batches] == [2, 1]
+        assert sorted(sum(batches, [])) == sorted(
+            str(pk) for pk in queryset.values_list('pk', flat=True)
+        )
+
+    def test_reindex_indexes_folders_documents_and_pages(self):
+        messages = []
+
+        total = reindex(batch_size=2, report=messages.append)
+
+        # 3 folders (.inbox, .home and 'My Documents'), 3 documents
+        # and their 3 pages
+        assert total == 9
+        assert messages[-1].startswith('core.page: 3/3 (100%)')
+        results = {
+            item.title: item
+            for item in SearchQuerySet().models(Document, Folder).filter(
+                user=self.user
+            )
+        }
+        assert list(results['invoice-0.pdf'].breadcrumb) == [
+            '.home', 'My Documents'
+        ]
+        assert list(results['invoice-0.pdf'].tags) == ['paid']
+        assert 'cat' in results['invoice-0.pdf'].text
+        assert list(results['My Documents'].tags) == ['important']
+        assert len(SearchQuerySet().models(Page).filter(text='dog')) == 3
+
+    def test_reindex_query_count_does_not_depend_on_number_of_documents(self):
+        with CaptureQueriesContext(connection) as few_documents:
+            reindex(model_paths=['core.document'], batch_size=100)
+        self.create_documents(count=10)
+        with CaptureQueriesContext(connection) as more_documents:
+            reindex(model_paths=['core.document'], batch_size=100)
+
+        assert len(more_documents) == len(few_documents)
+
+    def test_reindex_command(self):
+        out = io.StringIO()
+
+        call_command('reindex', 'folder', workers=0, clear=True, stdout=out)
+
+        assert 'core.folder: 3/3 (100%)' in out.getvalue()
+        assert 'Indexed 3 instances' in out.getvalue()
+        assert len(SearchQuerySet().models(Folder).filter(user=self.user)) == 3
+
+    def test_all_workers_are_forked_before_batches_are_fetched(self):
+        executors = []
+        process_counts = []
+
+        class Executor(ProcessPoolExecutor):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                executors.append(self)
+
+        def batches():
+            # i.e. parent (re)opens database connection
+            process_counts.append(len(executors[0]._processes))
+            yield from ()
+
+        with patch('papermerge.search.reindex.ProcessPoolExecutor', Executor):
+            assert list(_index_batches('core.folder', batches(), 3)) == []
+
+        assert process_counts == [3]
+
+    def test_format_progress(self):
+        assert format_progress(
+            done=1000, total=4000, elapsed=20
+        ) == "1000/4000 (25%), 50.0/s, ETA 0:01:00"
+        assert format_progress(
+            done=10, total=10, elapsed=1
+        ) == "10/10 (100%), 10.0/s"
@@ -12,6 +12,8 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 
 from papermerge.core.models import User, Folder, Document
+from papermerge.core.storage import abs_path
+from papermerge.search.tasks import update_index_coalesced
 
 SEARCH_DIR_ABS_PATH = os.path.abspath(os.path.dirname(__file__))
 TEST_DIR_ABS_PATH = os.path.dirname(SEARCH_DIR_ABS_PATH)
@@ -401,3 +403,145 @@ class SearchByTags(TestCase):
         expected_result = set(['fruits', 'folder3'])
         actual_result = set(result['title'] for result in response.data)
         assert expected_result == actual_result
+
+
+class SearchPaginationTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="user")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        for index in range(3):
+            Folder.objects.create(
+                title=f"folder-{index}",
+                user=self.user,
+                parent=self.user.home_folder
+            )
+        rebuild_index()
+
+    def test_results_are_paginated_with_cursor(self):
+        """
+        There are 5 folders: .inbox, .home and 3 created in setUp.
+        With two results per page next page URL is in `Link` header,
+        last page has no `Link` header.
+        """
+        titles = []
+        url = reverse('search') + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            assert response.status_code == 200
+            assert len(response.data) <= 2
+            titles.extend(item['title'] for item in response.data)
+            url = None
+            if response.has_header('Link'):
+                url = response['Link'].split(';')[0].strip('<>')
+
+        assert sorted(titles) == [
+            '.home', '.inbox', 'folder-0', 'folder-1', 'folder-2'
+        ]
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('search'), {'cursor': 'abc'})
+
+        assert response.status_code == 404
+
+    def test_results_are_streamed_as_ndjson(self):
+        response = self.client.get(
+            reverse('search'),
+            HTTP_ACCEPT='application/x-ndjson'
+        )
+
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/x-ndjson'
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        titles = [json.loads(line)['title'] for line in lines]
+        assert sorted(titles) == [
+            '.home', '.inbox', 'folder-0', 'folder-1', 'folder-2'
+        ]
+
+
+HOCR = """<html><body><div class='ocr_page' title='bbox 0 0 1000 1400'>
+<span class='ocrx_word' id='word_1_1' title='bbox 10 20 60 40; x_wconf 95'>
+the</span>
+<span class='ocrx_word' id='word_1_2' title='bbox 70 20 120 40; x_wconf 91'>
+<strong>cat</strong></span>
+<span class='ocrx_word' id='word_1_3' title='bbox 130 20 180 40; x_wconf 90'>
+sat</span>
+</div></body></html>"""
+
+
+class SearchPagesTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="user")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.doc = Document.objects.create_document(
+            title='animals.pdf',
+            lang='deu',
+            user_id=self.user.pk,
+            parent=self.user.home_folder,
+        )
+        doc_version = self.doc.versions.last()
+        doc_version.create_pages(page_count=2)
+        doc_version.update_text_field([
+            io.StringIO('I am page number one'),
+            io.StringIO('the cat sat')
+        ])
+        hocr_path = abs_path(doc_version.pages.last().page_path.hocr_url)
+        os.makedirs(os.path.dirname(hocr_path), exist_ok=True)
+        with open(hocr_path, 'w') as f:
+            f.write(HOCR)
+        connections["default"].get_backend().clear()
+        update_index_coalesced(
+            identifiers=[f'core.document.{self.doc.pk}'],
+            reindex_pages=[f'core.document.{self.doc.pk}']
+        )
+
+    def test_search_returns_matching_page_and_word_boxes(self):
+        response = self.client.get(
+            reverse('search-pages'),
+            {'q': 'cat', 'document_id': str(self.doc.pk)}
+        )
+
+        assert response.status_code == 200
+        assert len(response.data) == 1
+        assert response.data[0]['number'] == 2
+        assert response.data[0]['document_id'] == str(self.doc.pk)
+        assert response.data[0]['boxes'] == [[70, 20, 120, 40]]
+        assert response.data[0]['title'] == 'animals.pdf'
+
+    def test_renamed_document_does_not_reindex_pages(self):
+        self.doc.title = 'pets.pdf'
+        self.doc.save()
+
+        with patch(
+            'papermerge.search.tasks.update_index_instances'
+        ) as update_index_instances:
+            update_index_coalesced(
+                identifiers=[f'core.document.{self.doc.pk}']
+            )
+
+        assert [
+            call.args[0] for call in update_index_instances.call_args_list
+        ] == [Document]
+        # title is not indexed, thus is never stale
+        response = self.client.get(reverse('search-pages'), {'q': 'cat'})
+        assert response.data[0]['title'] == 'pets.pdf'
+
+    def test_pages_are_not_returned_by_node_search(self):
+        response = self.client.get(reverse('search'), {'q': 'cat'})
+
+        assert response.status_code == 200
+        assert [item['title'] for item in response.data] == ['animals.pdf']
+
+    def test_pages_of_deleted_document_are_removed_from_index(self):
+        self.doc.delete()
+
+        update_index_coalesced(identifiers=[f'core.document.{self.doc.pk}'])
+
+        response = self.client.get(reverse('search-pages'), {'q': 'cat'})
+        assert response.status_code == 200
+        assert len(response.data) == 0
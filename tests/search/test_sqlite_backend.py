@@ -0,0 +1,106 @@
+import io
+from unittest import skipUnless
+
+from django.test import TestCase
+from haystack import connections
+from haystack.query import SearchQuerySet
+
+from papermerge.core.models import User, Folder, Document
+from papermerge.search.sqlite_backend import SQLiteSearchBackend
+from .test_search_view import rebuild_index
+
+
+@skipUnless(
+    isinstance(connections['default'].get_backend(), SQLiteSearchBackend),
+    "SQLite search backend is not configured"
+)
+class SQLiteSearchBackendTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="john")
+        self.other_user = User.objects.create_user(username="john.smith")
+        self.folder = Folder.objects.create(
+            title='My Invoices',
+            user=self.user,
+            parent=self.user.home_folder
+        )
+        self.folder.tags.set(
+            ['important'],
+            tag_kwargs={"user": self.user}
+        )
+        other_folder = Folder.objects.create(
+            title='Invoices',
+            user=self.other_user,
+            parent=self.other_user.home_folder
+        )
+        other_folder.tags.set(
+            ['not important'],
+            tag_kwargs={"user": self.other_user}
+        )
+        doc = Document.objects.create_document(
+            title='letter.pdf',
+            lang='deu',
+            user_id=self.user.pk,
+            parent=self.user.home_folder,
+        )
+        doc_version = doc.versions.last()
+        doc_version.create_pages(page_count=1)
+        doc_version.update_text_field([
+            io.StringIO('The quick brown fox jumps over the lazy dog')
+        ])
+        rebuild_index()
+
+    def titles(self, query):
+        return sorted(item.title for item in query)
+
+    def test_user_filter_matches_whole_user_name(self):
+        query = SearchQuerySet().models(Folder).filter(user=self.user)
+
+        assert self.titles(query) == ['.home', '.inbox', 'My Invoices']
+
+    def test_tag_filter_matches_whole_tag(self):
+        query = SearchQuerySet().filter(tags__contain='important')
+
+        assert self.titles(query) == ['My Invoices']
+
+    def test_title_startswith(self):
+        query = SearchQuerySet().filter(
+            user=self.user
+        ).filter(title__startswith='invo')
+
+        assert self.titles(query) == ['My Invoices']
+
+    def test_content_search_is_ranked_and_highlighted(self):
+        query = SearchQuerySet().filter(
+            last_version_text__contains='jump'
+        ).highlight()
+        result = query[0]
+
+        assert len(query) == 1
+        assert result.title == 'letter.pdf'
+        assert result.score > 0
+        assert '<em>jumps</em>' in result.highlighted['indexed_content'][0]
+
+    def test_arbitrary_slices(self):
+        query = SearchQuerySet().models(Folder).order_by('title')
+
+        assert [item.title for item in query[1:4]] == [
+            '.home', '.inbox', '.inbox'
+        ]
+
+    def test_reindex_replaces_and_remove_deletes_object(self):
+        backend = connections['default'].get_backend()
+        index = connections['default'].get_unified_index().get_index(Folder)
+
+        self.folder.title = 'Receipts'
+        backend.update(index, [self.folder])
+
+        assert self.titles(
+            SearchQuerySet().filter(title='receipts')
+        ) == ['Receipts']
+        assert len(SearchQuerySet().filter(title='invoices')) == 1
+
+        backend.remove(f'core.folder.{self.folder.pk}')
+
+        assert len(SearchQuerySet().filter(title='receipts')) == 0
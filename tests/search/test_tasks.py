@@ -0,0 +1,75 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+from haystack import connection_router, connections
+from haystack.query import SearchQuerySet
+
+from papermerge.core.models import User, Folder
+from papermerge.core.models.node import move_nodes
+from papermerge.search.signals import SignalProcessor
+from papermerge.search.tasks import (
+    get_subtree_identifiers,
+    update_index_subtrees
+)
+from .test_search_view import rebuild_index
+
+
+class SearchTasksTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="user1")
+        self.folder = Folder.objects.create(
+            title='My Documents',
+            user=self.user,
+            parent=self.user.inbox_folder
+        )
+        self.sub_folder = Folder.objects.create(
+            title='Invoices',
+            user=self.user,
+            parent=self.folder
+        )
+        rebuild_index()
+
+    def test_get_subtree_identifiers(self):
+        identifiers = get_subtree_identifiers([self.folder.pk])
+
+        assert sorted(identifiers) == sorted([
+            f'core.folder.{self.folder.pk}',
+            f'core.folder.{self.sub_folder.pk}'
+        ])
+
+    def test_update_index_subtrees_updates_breadcrumb(self):
+        move_nodes(
+            node_ids=[self.folder.pk],
+            target_node=self.user.home_folder
+        )
+        connections['default'].get_backend().clear()
+        update_index_subtrees(node_ids=[str(self.folder.pk)])
+
+        result = [
+            item for item in SearchQuerySet().filter(user=self.user)
+            if item.title == 'Invoices'
+        ]
+
+        # only nodes of the moved subtree were indexed
+        assert len(SearchQuerySet().filter(user=self.user)) == 2
+        assert len(result) == 1
+        assert list(result[0].breadcrumb) == ['.home', 'My Documents']
+
+    @patch('papermerge.search.signals.update_index_subtrees')
+    def test_moved_subtrees_are_indexed_after_commit(self, task_mock):
+        signal_processor = SignalProcessor(connections, connection_router)
+        self.addCleanup(signal_processor.teardown)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            move_nodes(
+                node_ids=[self.folder.pk],
+                target_node=self.user.home_folder
+            )
+            # worker would read nodes before the move is committed
+            task_mock.apply_async.assert_not_called()
+
+        task_mock.apply_async.assert_called_once_with(
+            kwargs={'node_ids': [str(self.folder.pk)]}
+        )